@@ -0,0 +1,184 @@
+import sys
+import datetime
+from collections import OrderedDict
+import numpy as np
+import StockData as sd
+import RegressionModel as rm
+import TreeTraversal as tt
+import PredictionCache as pc
+
+'''
+Walk-forward backtest of the subset prediction agent. For every as-of day in a date range it does what
+StockPredictionMain does for today: predict the as-of day's price from every contiguous subset of the days
+before it, pick the subset closest to the real price, and use that subset to predict the next day.
+
+For the closed form model types ('ols', 'fast-linear') the as-of days are handled in vectorized chunks: each
+chunk's windows are stacked into a matrix and every subset of every window is fitted in one fitAllLinear call,
+so a year of as-of days takes seconds. Other model types fall back to running predictAllPrices for each as-of
+day.
+'''
+
+defaultConfig = {
+	'daysInThePast': 30, # number of days before each as-of day to build subsets from
+	'dayTodayToPredict': 0,
+	'dayInFutureToPredict': 1,
+	'regressionModelType': 'ols',
+	'modelOptions': {}, # settings overriding RegressionModel.modelParameters of the model type
+	'acceptedTolerance': 0.5,
+	'minSubsetLength': 2,
+	'subsetStrategy': None, # StockData.SubsetStrategy of the subsets to predict, None for all with minSubsetLength
+	'maxWindowsPerChunk': 2000000, # bounds memory of the vectorized path
+	'cacheDirectory': None, # PredictionCache folder for the models without a closed form, None to not cache
+}
+
+
+'''
+Per as-of day results of a backtest as parallel arrays (oldest as-of day first)
+'''
+class BacktestResult(object):
+
+	def __init__(self, ticker, config, dates, actualPrices, predictedPrices, datasets, actualNextPrices, predictedNextPrices):
+		self.ticker = ticker
+		self.config = config
+		self.dates = dates
+		self.actualPrices = actualPrices
+		self.predictedPrices = predictedPrices # closest subset prediction of each as-of day's price
+		self.datasets = datasets # (start day, end day) of the closest subset, in days before the as-of day
+		self.actualNextPrices = actualNextPrices # nan where the next day is not in the data yet
+		self.predictedNextPrices = predictedNextPrices
+		self.differences = np.abs(predictedPrices - actualPrices)
+		self.passed = self.differences <= config['acceptedTolerance']
+		self.nextErrors = np.abs(predictedNextPrices - actualNextPrices)
+
+	def __len__(self):
+		return len(self.dates)
+
+	'''
+	Fraction of as-of days whose closest subset prediction was within acceptedTolerance
+	'''
+	@property
+	def passRate(self):
+		if len(self.dates) == 0:
+			return 0.0
+		return float(np.mean(self.passed))
+
+	'''
+	Mean absolute error of the next day predictions, over the days whose next price is known
+	'''
+	@property
+	def mae(self):
+		known = ~np.isnan(self.nextErrors)
+		if not known.any():
+			return float('nan')
+		return float(np.mean(self.nextErrors[known]))
+
+	def printSummary(self):
+		print("---------*--------")
+		print("Testing Result:")
+		print("Ticker: %s" % self.ticker)
+		print("Number of testing days: %d" % len(self.dates))
+		print("Number of pass test: %d" % int(np.sum(self.passed)))
+		print("Percentage of performance: %.2f%%" % (self.passRate * 100))
+		print("Mean absolute error of next day predictions: $%.2f" % self.mae)
+
+
+'''
+Runs a walk-forward backtest for a ticker
+@param ticker - stock ticker, prices are read from <ticker>.csv unless config has a csvFilename
+@param start - first as-of date (ISO string or date), None for the earliest possible
+@param end - last as-of date (ISO string or date), None for the latest in the data
+@param config - dict overriding any of defaultConfig
+@return result - BacktestResult
+'''
+def backtest(ticker, start=None, end=None, config=None):
+	config = dict(defaultConfig, **(config or {}))
+	series = sd.getPriceSeries(config.get('csvFilename', ticker + '.csv'))
+	dates = series.date[::-1] # oldest first, so index i is i market days after the first day
+	closes = series.close[::-1]
+	daysInThePast = config['daysInThePast']
+
+	asOfIndexes = np.arange(daysInThePast, len(closes))
+	if start is not None:
+		asOfIndexes = asOfIndexes[dates[asOfIndexes] >= np.datetime64(str(start), 'D')]
+	if end is not None:
+		asOfIndexes = asOfIndexes[dates[asOfIndexes] <= np.datetime64(str(end), 'D')]
+
+	rm.getModelParameters(config['regressionModelType'], config['modelOptions']) # fails early on an unknown option
+	if config['regressionModelType'] in rm.olsModelTypes:
+		predictedPrices, datasets, predictedNextPrices = backtestOls(closes, asOfIndexes, config)
+	else:
+		predictedPrices, datasets, predictedNextPrices = backtestEachDay(closes, asOfIndexes, config)
+
+	nextIndexes = asOfIndexes + config['dayInFutureToPredict'] - config['dayTodayToPredict']
+	actualNextPrices = np.full(len(asOfIndexes), np.nan)
+	known = (nextIndexes >= 0) & (nextIndexes < len(closes))
+	actualNextPrices[known] = closes[nextIndexes[known]]
+	return BacktestResult(ticker, config, dates[asOfIndexes], closes[asOfIndexes], predictedPrices, datasets,
+		actualNextPrices, predictedNextPrices)
+
+
+'''
+Vectorized backtest for the closed form linear models. Each as-of day's window of days 1..daysInThePast is a
+row of a matrix (one matrix per chunk of as-of days), and fitAllLinear fits every subset of every row at once
+from prefix sums it builds along each row, with x = -day. These are the same coordinates and arithmetic as
+predictAllPrices rather than sums shared across the whole history, so the predictions are bitwise equal to
+backtestEachDay's and exact ties between subsets are broken the same way: the first closest subset in subset
+order, like PredictionIndex
+'''
+def backtestOls(closes, asOfIndexes, config):
+	subsetStarts, subsetEnds = sd.ContigSubsets(OrderedDict.fromkeys(xrange(1, config['daysInThePast'] + 1), 0.0),
+		config['minSubsetLength'], strategy=config['subsetStrategy']).indexArrays()
+	startDays = subsetStarts + 1 # day numbers of each subset relative to its as-of day
+	endDays = subsetEnds + 1
+	days = np.arange(1, config['daysInThePast'] + 1)
+
+	predictedPrices = np.empty(len(asOfIndexes))
+	predictedNextPrices = np.empty(len(asOfIndexes))
+	datasets = np.empty((len(asOfIndexes), 2), dtype=np.int64)
+	chunkSize = max(1, config['maxWindowsPerChunk'] // max(len(startDays), 1))
+	for chunkStart in xrange(0, len(asOfIndexes), chunkSize):
+		chunk = asOfIndexes[chunkStart:chunkStart + chunkSize]
+		windows = closes[chunk[:, np.newaxis] - days] # row i holds the prices of days 1..daysInThePast before chunk[i]
+		slopes, intercepts = rm.fitAllLinear(days * -1, windows, subsetStarts, subsetEnds) # need dates to be negative
+
+		todays = intercepts + slopes * config['dayTodayToPredict']
+		best = np.argmin(np.abs(todays - closes[chunk][:, np.newaxis]), axis=1) # first closest, like PredictionIndex
+		rows = np.arange(len(chunk))
+		predictedPrices[chunkStart:chunkStart + len(chunk)] = todays[rows, best]
+		predictedNextPrices[chunkStart:chunkStart + len(chunk)] = intercepts[rows, best] + slopes[rows, best] * config['dayInFutureToPredict']
+		datasets[chunkStart:chunkStart + len(chunk), 0] = startDays[best]
+		datasets[chunkStart:chunkStart + len(chunk), 1] = endDays[best]
+	return predictedPrices, datasets, predictedNextPrices
+
+
+'''
+Backtest for any model type, running the subset predictions separately for each as-of day
+'''
+def backtestEachDay(closes, asOfIndexes, config):
+	predictedPrices = np.empty(len(asOfIndexes))
+	predictedNextPrices = np.empty(len(asOfIndexes))
+	datasets = np.empty((len(asOfIndexes), 2), dtype=np.int64)
+	modelType = config['regressionModelType']
+	cache = pc.PredictionCache(config['cacheDirectory']) if config['cacheDirectory'] else None
+	for i, asOfIndex in enumerate(asOfIndexes.tolist()):
+		dateValues = OrderedDict((day, float(closes[asOfIndex - day])) for day in xrange(1, config['daysInThePast'] + 1))
+		subsets = sd.ContigSubsets(dateValues, config['minSubsetLength'], strategy=config['subsetStrategy'])
+		predictedDateValueSubsets = rm.predictAllPrices(subsets, config['dayTodayToPredict'], modelType, cache=cache, **config['modelOptions'])
+		foundNode = tt.PredictionIndex(predictedDateValueSubsets).nearest(closes[asOfIndex])
+		days = np.arange(foundNode.dataset[0], foundNode.dataset[1] + 1)
+		predictedPrices[i] = foundNode.value
+		datasets[i] = foundNode.dataset
+		predictedNextPrices[i] = rm.predictPriceArrays(days, closes[asOfIndex - days], config['dayInFutureToPredict'], modelType,
+			**config['modelOptions'])
+	return predictedPrices, datasets, predictedNextPrices
+
+
+if __name__ == '__main__':
+	# i.e. python Backtest.py AAPL 2017-01-01 2017-05-12
+	ticker = sys.argv[1] if len(sys.argv) > 1 else 'AAPL'
+	start = sys.argv[2] if len(sys.argv) > 2 else None
+	end = sys.argv[3] if len(sys.argv) > 3 else None
+	startTime = datetime.datetime.now()
+	result = backtest(ticker, start, end)
+	result.printSummary()
+	print("Backtest took %.2f secs" % (datetime.datetime.now() - startTime).total_seconds())
@@ -0,0 +1,206 @@
+import os
+import sys
+import csv
+import datetime
+import argparse
+import traceback
+import multiprocessing
+import numpy as np
+import StockData as sd
+import RegressionModel as rm
+import TreeTraversal as tt
+import QuoteDownloader as qd
+import PredictionCache as pc
+import Metrics as mt
+
+try:
+	import resource # not available on Windows, where the memory cap is skipped
+except ImportError:
+	resource = None
+
+'''
+Batch runner for the prediction pipeline over many tickers. Each ticker is run on a bounded pool of worker
+processes, so the interpreter and sklearn are only started once per worker instead of once per ticker:
+load the price series, predict every contiguous subset, find the subset closest to today's price, predict
+tomorrow from it and save the tree. One failing ticker only produces an error row in the summary.
+
+i.e. python BatchPredict.py --watchlist watchlist.txt --workers 8 --max-memory-mb 2048 --output summary.csv
+'''
+
+defaultConfig = {
+	'daysInThePast': 30,
+	'dayTodayToPredict': 0,
+	'dayInFutureToPredict': 1,
+	'regressionModelType': 'ols',
+	'modelOptions': {}, # settings overriding RegressionModel.modelParameters of the model type
+	'acceptedTolerance': 0.5,
+	'numOfChildren': 3,
+	'subsetStrategy': None, # StockData.SubsetStrategy of the subsets to predict, None for all of them
+	'csvDirectory': '.', # where <ticker>.csv files are read from
+	'dataDirectory': '.', # where <ticker>.plk prediction state is written, None to skip saving
+	'download': False, # download the latest CSVs of all tickers (concurrently) before predicting
+	'maxDownloads': 8, # most downloads in flight at once
+	'stockDataSource': 'google finance',
+	'cacheDirectory': None, # PredictionCache folder shared by the workers, None to not cache
+	'cacheMaxMb': 1024,
+	'metricsFilename': None, # file to write stage timings and counters to (.prom for Prometheus text, JSON otherwise)
+}
+
+summaryColumns = ['ticker', 'status', 'asOfDate', 'todaysPrice', 'foundPrice', 'foundStartDay', 'foundEndDay',
+	'todaysDifference', 'withinTolerance', 'tomorrowsPrice', 'tomorrowsGainLoss', 'seconds', 'error']
+
+
+'''
+Runs the whole prediction pipeline for one ticker
+@param ticker - stock ticker symbol
+@param config - dict like defaultConfig
+@return result - dict with a value for each of summaryColumns
+'''
+def predictTicker(ticker, config):
+	startTime = datetime.datetime.now()
+	csvFilename = os.path.join(config['csvDirectory'], ticker + '.csv')
+	series = sd.getPriceSeries(csvFilename)
+	todaysPrice = float(series.close[0])
+	dateValues = series.getDateValues(1, config['daysInThePast'])
+	modelType = config['regressionModelType']
+	cache = pc.PredictionCache(config['cacheDirectory'], config['cacheMaxMb'] * 1024 * 1024) if config['cacheDirectory'] else None
+	predictedDateValueSubsets = rm.predictAllPrices(sd.ContigSubsets(dateValues, strategy=config['subsetStrategy']), config['dayTodayToPredict'], modelType, cache=cache, **config['modelOptions'])
+	foundNode = tt.PredictionIndex(predictedDateValueSubsets).nearest(todaysPrice)
+
+	foundDays = np.arange(foundNode.dataset[0], foundNode.dataset[1] + 1)
+	tomorrowsPrice = float(rm.predictPriceArrays(foundDays, series.close[foundDays], config['dayInFutureToPredict'], modelType, **config['modelOptions']))
+	todaysDifference = float(rm.getPriceDifference(foundNode.value, todaysPrice))
+
+	if config['dataDirectory'] is not None:
+		rootNode = tt.createTree(config['numOfChildren'], predictedDateValueSubsets, config['subsetStrategy'])
+		tt.writeTreeToFile(rootNode, foundNode, series.getTodaysDate(), os.path.join(config['dataDirectory'], ticker + '.plk'),
+			ticker, modelType, series.sourceHash)
+
+	return {'ticker': ticker, 'status': 'ok', 'asOfDate': series.getTodaysDate(), 'todaysPrice': todaysPrice,
+		'foundPrice': foundNode.value, 'foundStartDay': foundNode.dataset[0], 'foundEndDay': foundNode.dataset[1],
+		'todaysDifference': todaysDifference, 'withinTolerance': todaysDifference <= config['acceptedTolerance'],
+		'tomorrowsPrice': tomorrowsPrice, 'tomorrowsGainLoss': tomorrowsPrice - todaysPrice,
+		'seconds': (datetime.datetime.now() - startTime).total_seconds(), 'error': ''}
+
+
+'''
+Worker process entry point: runs one ticker and turns any failure into an error row. When metrics are on,
+the ticker's timings and counters are sent back with the result under 'metrics'
+'''
+def runTicker(args):
+	ticker, config = args
+	startTime = datetime.datetime.now()
+	try:
+		with mt.tickerScope(ticker):
+			result = predictTicker(ticker, config)
+	except (Exception, MemoryError):
+		error = traceback.format_exc().strip().splitlines()[-1]
+		result = {'ticker': ticker, 'status': 'error', 'error': error,
+			'seconds': (datetime.datetime.now() - startTime).total_seconds()}
+	recorder = mt.getRecorder()
+	if recorder.enabled:
+		result['metrics'] = recorder.export()
+		recorder.reset()
+	return result
+
+
+def initBatchWorker(maxMemoryMb, metrics=False):
+	if metrics:
+		mt.enable()
+	if maxMemoryMb and resource is not None:
+		limit = int(maxMemoryMb) * 1024 * 1024
+		resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+'''
+Runs the prediction pipeline for a list of tickers and writes one summary row per ticker
+@param tickers - list of ticker symbols
+@param summaryFilename - CSV file to write the summary to
+@param numOfWorkers - number of worker processes
+@param maxMemoryMb - address space limit of each worker in MB, None for no limit
+@param config - dict overriding any of defaultConfig
+@param tickersPerWorker - tickers a worker runs before it is replaced by a fresh process, None to never replace
+@return results - list of result dicts in the order the tickers finished
+'''
+def runBatch(tickers, summaryFilename, numOfWorkers=None, maxMemoryMb=None, config=None, tickersPerWorker=50):
+	config = dict(defaultConfig, **(config or {}))
+	numOfWorkers = numOfWorkers or multiprocessing.cpu_count()
+	results = []
+	startTime = datetime.datetime.now()
+	recorder = mt.enable() if config['metricsFilename'] else mt.getRecorder()
+	if config['download']:
+		today = datetime.date.today()
+		failed = qd.downloadCsvFiles(tickers, (today - datetime.timedelta(days = 365)).isoformat(), today.isoformat(),
+			config['stockDataSource'], config['csvDirectory'], config['maxDownloads'])
+		for ticker, error in failed.items():
+			print("WARNING: %s, using the saved CSV file instead" % error)
+	pool = multiprocessing.Pool(numOfWorkers, initBatchWorker, (maxMemoryMb, recorder.enabled), tickersPerWorker)
+	try:
+		with open(summaryFilename, 'wb') as summaryFile:
+			summaryWriter = csv.DictWriter(summaryFile, summaryColumns)
+			summaryWriter.writeheader()
+			for result in pool.imap_unordered(runTicker, [(ticker, config) for ticker in tickers]):
+				if 'metrics' in result:
+					recorder.merge(result.pop('metrics'))
+				results.append(result)
+				summaryWriter.writerow(result)
+				summaryFile.flush() # keep finished tickers even if the batch is killed
+				sys.stderr.write('\rFinished %d of %d tickers (%s: %s) ' % (len(results), len(tickers), result['ticker'], result['status']))
+				sys.stderr.flush()
+		pool.close()
+	finally:
+		pool.terminate()
+		pool.join()
+	failed = sum(1 for result in results if result['status'] != 'ok')
+	print("\nPredicted %d tickers (%d failed) in %.1f secs. Summary saved to %s" % (len(results), failed,
+		(datetime.datetime.now() - startTime).total_seconds(), summaryFilename))
+	if config['metricsFilename']:
+		recorder.writeFile(config['metricsFilename'])
+		recorder.printReport()
+		print("Metrics saved to %s" % config['metricsFilename'])
+	return results
+
+
+'''
+Reads ticker symbols from a watchlist file: one or more comma or whitespace separated symbols per line,
+with # starting a comment
+'''
+def readWatchlist(filename):
+	tickers = []
+	with open(filename, 'r') as watchlist:
+		for line in watchlist:
+			line = line.split('#')[0].replace(',', ' ')
+			tickers.extend(ticker.strip().upper() for ticker in line.split() if ticker.strip())
+	return tickers
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Run the stock prediction pipeline for many tickers.')
+	parser.add_argument('tickers', nargs='*', help='ticker symbols to predict')
+	parser.add_argument('--watchlist', help='file with ticker symbols to predict')
+	parser.add_argument('--output', default='summary.csv', help='summary CSV file to write')
+	parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: one per CPU)')
+	parser.add_argument('--max-memory-mb', type=int, default=None, help='memory limit of each worker process')
+	parser.add_argument('--model', default=defaultConfig['regressionModelType'], help='regression model type')
+	parser.add_argument('--model-option', type=rm.parseModelOption, action='append', default=[], metavar='NAME=VALUE',
+		help='model setting overriding its default, i.e. numOfFeatures=50 or seed=7 for rbf-approx (repeatable)')
+	parser.add_argument('--days', type=int, default=defaultConfig['daysInThePast'], help='number of days in the past to use')
+	parser.add_argument('--download', action='store_true', help='download the latest CSV of each ticker first')
+	parser.add_argument('--subsets', type=sd.parseSubsetStrategy, default=None,
+		help='subsets to predict: all, anchored, ladder[:ratio] or stride[:days], with optional ,min=N,max=N')
+	parser.add_argument('--cache', default=None, help='folder to cache predictions in, so reruns skip finished work')
+	parser.add_argument('--metrics', default=None, help='file to write stage timings to, Prometheus text if it ends in .prom, JSON otherwise')
+	args = parser.parse_args()
+
+	tickers = [ticker.upper() for ticker in args.tickers]
+	if args.watchlist:
+		tickers.extend(readWatchlist(args.watchlist))
+	if not tickers:
+		parser.error('no tickers given')
+	try:
+		rm.getModelParameters(args.model, dict(args.model_option))
+	except ValueError as error:
+		parser.error(str(error))
+	runBatch(tickers, args.output, args.workers, args.max_memory_mb,
+		{'regressionModelType': args.model, 'modelOptions': dict(args.model_option), 'daysInThePast': args.days, 'download': args.download,
+		'cacheDirectory': args.cache, 'subsetStrategy': args.subsets, 'metricsFilename': args.metrics})
@@ -0,0 +1,274 @@
+import os
+import sys
+import json
+import pickle
+import shutil
+import platform
+import datetime
+import tempfile
+import argparse
+import timeit
+import multiprocessing
+from collections import OrderedDict
+import numpy as np
+import StockData as sd
+import RegressionModel as rm
+import TreeTraversal as tt
+
+try:
+	import resource # not available on Windows, where peak memory is not measured
+except ImportError:
+	resource = None
+
+'''
+Benchmarks of the StockData, RegressionModel and TreeTraversal hot paths on synthetic price series, so
+performance work can be measured and regressions caught. Every case (benchmark, series kind, number of days)
+runs in a fresh process and is timed over a few repeats; its wall time and the peak memory it used on top of
+its setup are saved to a JSON file, which can be compared with an earlier run.
+
+i.e. python Benchmark.py --output new.json --baseline old.json --threshold 0.2
+     python Benchmark.py --only fit-ols,createTree --sizes 30,1000 --kinds flat
+'''
+
+defaultSizes = [30, 100, 300, 1000, 5000]
+seriesKinds = ['random-walk', 'trending', 'flat']
+
+
+'''
+Generates a synthetic series of closing prices
+@param kind - 'random-walk' (normal daily returns), 'trending' (steady rise plus noise) or 'flat' (one price,
+like the constant testDateValues of prediction.py)
+@param numOfDays - number of days in the past, the series also has today
+@param seed - random seed, the same seed always gives the same series
+@return closes - array of numOfDays + 1 prices, oldest first and today last
+'''
+def syntheticCloses(kind, numOfDays, seed=0):
+	random = np.random.RandomState(seed)
+	if kind == 'random-walk':
+		return 100.0 * np.exp(np.cumsum(random.normal(0.0, 0.015, numOfDays + 1)))
+	if kind == 'trending':
+		return 100.0 + 0.25 * np.arange(numOfDays + 1) + random.normal(0.0, 0.5, numOfDays + 1)
+	if kind == 'flat':
+		return np.full(numOfDays + 1, 143.73)
+	raise ValueError("Unknown series kind: %s" % kind)
+
+
+'''
+Synthetic series as the day:price dict of days 1..numOfDays that getDataCsv returns
+'''
+def syntheticDateValues(kind, numOfDays, seed=0):
+	closes = syntheticCloses(kind, numOfDays, seed)
+	return OrderedDict((day, float(closes[-1 - day])) for day in xrange(1, numOfDays + 1))
+
+
+'''
+Writes a synthetic series as a price CSV file, ending on 2017-05-12
+'''
+def writeSyntheticCsv(filename, kind, numOfDays, seed=0):
+	closes = syntheticCloses(kind, numOfDays, seed)
+	dates = np.datetime64('2017-05-12') - np.arange(numOfDays + 1)[::-1]
+	sd.Quote.from_numpy({'date': dates, 'open': closes, 'high': closes * 1.01, 'low': closes * 0.99, 'close': closes,
+		'volume': np.full(numOfDays + 1, 1000000)}, 'BENCH').write_csv(filename)
+
+
+'''
+Each benchmark does its setup and returns the function to time
+@param dateValues - day:price dict of the synthetic series
+@param kind, numOfDays - kind and length of the series, for benchmarks that write it to a file
+@param workDirectory - empty temporary folder the benchmark may write to
+'''
+def benchContigSubsetsDict(dateValues, kind, numOfDays, workDirectory):
+	return lambda: sd.getAllContigSubsetsDict(dateValues)
+
+
+def benchContigSubsets(dateValues, kind, numOfDays, workDirectory):
+	return lambda: sd.ContigSubsets(dateValues)
+
+
+def benchPredictAllPrices(modelType):
+	def bench(dateValues, kind, numOfDays, workDirectory):
+		subsets = sd.ContigSubsets(dateValues)
+		return lambda: rm.predictAllPrices(subsets, 0, modelType)
+	return bench
+
+
+def benchCreateTree(dateValues, kind, numOfDays, workDirectory):
+	predictions = rm.predictAllPrices(sd.ContigSubsets(dateValues), 0, 'ols')
+	return lambda: tt.createTree(3, predictions)
+
+
+def benchBreadthFirstSearch(dateValues, kind, numOfDays, workDirectory):
+	rootNode = tt.createTree(3, rm.predictAllPrices(sd.ContigSubsets(dateValues), 0, 'ols'))
+	todaysPrice = dateValues[1] * 1.001
+	return lambda: tt.breadthFirstSearch(rootNode, todaysPrice)
+
+
+def benchPickleRoundTrip(dateValues, kind, numOfDays, workDirectory):
+	predictions = OrderedDict(rm.predictAllPrices(sd.ContigSubsets(dateValues), 0, 'ols'))
+	return lambda: pickle.loads(pickle.dumps(predictions, pickle.HIGHEST_PROTOCOL))
+
+
+def benchTreeFileRoundTrip(dateValues, kind, numOfDays, workDirectory):
+	rootNode = tt.createTree(3, rm.predictAllPrices(sd.ContigSubsets(dateValues), 0, 'ols'))
+	filename = os.path.join(workDirectory, 'BENCH.plk')
+	def roundTrip():
+		tt.writeTreeToFile(rootNode, rootNode, '2017-05-12', filename, 'BENCH', 'ols')
+		return tt.readTreeFromFile(filename)
+	return roundTrip
+
+
+def benchEndToEnd(dateValues, kind, numOfDays, workDirectory):
+	import BatchPredict
+	writeSyntheticCsv(os.path.join(workDirectory, 'BENCH.csv'), kind, numOfDays)
+	config = dict(BatchPredict.defaultConfig, daysInThePast=numOfDays, csvDirectory=workDirectory, dataDirectory=workDirectory)
+	def endToEnd():
+		sd.priceSeriesCache.clear() # parse the CSV every time, like a fresh run
+		return BatchPredict.predictTicker('BENCH', config)
+	return endToEnd
+
+
+# name:(benchmark, largest number of days it is run with). All pairs of n days are n*(n-1)/2 subsets, so the
+# per subset paths are capped where a run would take minutes or the subsets would not fit in memory
+benchmarks = OrderedDict([
+	('contigSubsetsDict', (benchContigSubsetsDict, 100)),
+	('contigSubsets', (benchContigSubsets, 5000)),
+	('fit-ols', (benchPredictAllPrices('ols'), 2000)),
+	('fit-linear', (benchPredictAllPrices('linear'), 30)),
+	('fit-rbf', (benchPredictAllPrices('rbf'), 30)),
+	('fit-poly3', (benchPredictAllPrices('poly3'), 2000)),
+	('fit-rbf-approx', (benchPredictAllPrices('rbf-approx'), 1000)),
+	('createTree', (benchCreateTree, 2000)),
+	('breadthFirstSearch', (benchBreadthFirstSearch, 2000)),
+	('pickleRoundTrip', (benchPickleRoundTrip, 1000)),
+	('treeFileRoundTrip', (benchTreeFileRoundTrip, 2000)),
+	('endToEnd', (benchEndToEnd, 1000)),
+])
+
+
+def peakMemoryKb():
+	if resource is None:
+		return None
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	return peak // 1024 if sys.platform == 'darwin' else peak # bytes on macOS, KB elsewhere
+
+
+'''
+Runs one benchmark case. Called in a fresh worker process so caches and memory use of earlier cases don't
+carry over; the output of the code being timed is discarded
+@return result - dict of the case and its timings
+'''
+def runCase(args):
+	name, kind, numOfDays, repeats = args
+	workDirectory = tempfile.mkdtemp(prefix='benchmark')
+	devnull = open(os.devnull, 'w')
+	stdout, stderr = sys.stdout, sys.stderr
+	sys.stdout = sys.stderr = devnull
+	try:
+		function = benchmarks[name][0](syntheticDateValues(kind, numOfDays), kind, numOfDays, workDirectory)
+		setupPeak = peakMemoryKb()
+		times = []
+		for _ in xrange(repeats):
+			startTime = timeit.default_timer()
+			function()
+			times.append(timeit.default_timer() - startTime)
+		peak = peakMemoryKb()
+	finally:
+		sys.stdout, sys.stderr = stdout, stderr
+		devnull.close()
+		shutil.rmtree(workDirectory, ignore_errors=True)
+	return {'name': name, 'kind': kind, 'days': numOfDays, 'repeats': repeats, 'seconds': min(times),
+		'medianSeconds': float(np.median(times)), 'peakMemoryMb': (peak - setupPeak) / 1024.0 if peak is not None else None}
+
+
+'''
+Runs the benchmarks
+@param names - benchmarks to run, None for all of them
+@param sizes - numbers of days in the past to run each benchmark with (skipped above its cap)
+@param kinds - synthetic series kinds to run each benchmark with
+@param repeats - times each case is timed, the fastest counts
+@return report - dict with details of the machine and the list of results
+'''
+def runBenchmarks(names=None, sizes=defaultSizes, kinds=seriesKinds, repeats=3):
+	cases = [(name, kind, numOfDays, repeats) for name in (names or benchmarks.keys()) for numOfDays in sizes
+		for kind in kinds if numOfDays <= benchmarks[name][1]]
+	results = []
+	for i, case in enumerate(cases):
+		sys.stderr.write('\rRunning benchmark %d of %d: %s %s %d days ' % (i + 1, len(cases), case[0], case[1], case[2]))
+		sys.stderr.flush()
+		pool = multiprocessing.Pool(1)
+		try:
+			results.append(pool.apply(runCase, (case,)))
+			pool.close()
+		finally:
+			pool.terminate()
+			pool.join()
+	sys.stderr.write('\n')
+	return {'created': datetime.datetime.now().isoformat(), 'python': platform.python_version(), 'numpy': np.__version__,
+		'machine': platform.platform(), 'processor': platform.processor(), 'results': results}
+
+
+def resultKey(result):
+	return (result['name'], result['kind'], result['days'])
+
+
+'''
+Compares benchmark results with a baseline run
+@param report, baseline - dicts from runBenchmarks (or their JSON files)
+@param threshold - fraction a case may be slower than the baseline before it counts as a regression
+@param minSeconds - cases faster than this in both runs are too noisy to count as regressions
+@return comparisons - list of (result, baseline seconds, ratio, regressed) for the cases in both runs
+'''
+def compareResults(report, baseline, threshold=0.1, minSeconds=0.001):
+	baselineResults = dict((resultKey(result), result) for result in baseline['results'])
+	comparisons = []
+	for result in report['results']:
+		old = baselineResults.get(resultKey(result))
+		if old is None:
+			continue
+		ratio = result['seconds'] / old['seconds'] if old['seconds'] > 0 else float('inf')
+		regressed = ratio > 1.0 + threshold and max(result['seconds'], old['seconds']) >= minSeconds
+		comparisons.append((result, old['seconds'], ratio, regressed))
+	return comparisons
+
+
+def printResults(report, comparisons=None):
+	baselines = dict((resultKey(result), (seconds, ratio, regressed)) for result, seconds, ratio, regressed in comparisons or [])
+	print("%-20s %-12s %6s %12s %12s %10s %12s %8s" % ('benchmark', 'series', 'days', 'secs', 'median secs', 'peak MB',
+		'baseline', 'ratio'))
+	for result in report['results']:
+		line = "%-20s %-12s %6d %12.6f %12.6f %10s" % (result['name'], result['kind'], result['days'], result['seconds'],
+			result['medianSeconds'], '%.1f' % result['peakMemoryMb'] if result['peakMemoryMb'] is not None else '-')
+		if resultKey(result) in baselines:
+			seconds, ratio, regressed = baselines[resultKey(result)]
+			line += " %12.6f %7.2fx%s" % (seconds, ratio, ' REGRESSION' if regressed else '')
+		print(line)
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmark the stock prediction hot paths on synthetic price series.')
+	parser.add_argument('--output', default='benchmark.json', help='JSON file to write the results to')
+	parser.add_argument('--baseline', default=None, help='JSON results of an earlier run to compare with')
+	parser.add_argument('--threshold', type=float, default=0.1, help='slowdown over the baseline that fails the run (default: %(default)s)')
+	parser.add_argument('--only', default=None, help='comma separated benchmarks to run: %s' % ', '.join(benchmarks))
+	parser.add_argument('--sizes', default=','.join(str(size) for size in defaultSizes), help='comma separated numbers of days')
+	parser.add_argument('--kinds', default=','.join(seriesKinds), help='comma separated series kinds')
+	parser.add_argument('--repeats', type=int, default=3, help='times each case is timed (default: %(default)s)')
+	args = parser.parse_args()
+
+	names = args.only.split(',') if args.only else None
+	unknown = [name for name in names or [] if name not in benchmarks]
+	if unknown:
+		parser.error('unknown benchmarks: %s' % ', '.join(unknown))
+	report = runBenchmarks(names, [int(size) for size in args.sizes.split(',')], args.kinds.split(','), args.repeats)
+	with open(args.output, 'w') as outputFile:
+		json.dump(report, outputFile, indent=2, sort_keys=True)
+	comparisons = None
+	if args.baseline:
+		with open(args.baseline, 'r') as baselineFile:
+			comparisons = compareResults(report, json.load(baselineFile), args.threshold)
+	printResults(report, comparisons)
+	print("Results saved to %s" % args.output)
+	regressions = [comparison for comparison in comparisons or [] if comparison[3]]
+	if regressions:
+		print("%d of %d cases are more than %d%% slower than the baseline" % (len(regressions), len(comparisons), args.threshold * 100))
+		sys.exit(1)
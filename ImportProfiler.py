@@ -0,0 +1,59 @@
+import sys
+import time
+import __builtin__
+
+'''
+Import time profiler for Python 2, which has no -X importtime. install() wraps the import statement, and every
+module imported for the first time afterwards is timed, both in total and excluding the modules it imported
+itself. report() prints the breakdown in import order, nested like the imports were
+'''
+
+originalImport = __builtin__.__import__
+records = [] # [depth, module name, cumulative seconds, self seconds], in the order the imports started
+nestedTimes = [] # seconds spent in nested imports, one entry per import in progress
+installTime = None
+
+
+def profiledImport(name, globals=None, locals=None, fromlist=None, level=-1):
+    if name in sys.modules:
+        return originalImport(name, globals, locals, fromlist, level)
+    record = [len(nestedTimes), name or 'from . import %s' % ', '.join(fromlist or ()), 0.0, 0.0]
+    records.append(record)
+    nestedTimes.append(0.0)
+    startTime = time.time()
+    try:
+        return originalImport(name, globals, locals, fromlist, level)
+    finally:
+        elapsed = time.time() - startTime
+        nested = nestedTimes.pop()
+        if nestedTimes:
+            nestedTimes[-1] += elapsed
+        record[2] = elapsed
+        record[3] = elapsed - nested
+
+
+def install():
+    global installTime
+    if __builtin__.__import__ is not profiledImport:
+        installTime = time.time()
+        __builtin__.__import__ = profiledImport
+
+
+def uninstall():
+    __builtin__.__import__ = originalImport
+
+
+'''
+Prints the imports that took at least minMilliseconds, and the top level totals
+@param title - what the report covers, i.e. 'startup'
+@param first - index in records of the first import to report, to leave out imports reported before
+'''
+def report(title='startup', minMilliseconds=1.0, first=0):
+    print("Import time breakdown (%s):" % title)
+    print("%10s %10s  %s" % ('total ms', 'self ms', 'module'))
+    for depth, name, cumulative, selfTime in records[first:]:
+        if cumulative * 1000 >= minMilliseconds:
+            print("%10.1f %10.1f  %s%s" % (cumulative * 1000, selfTime * 1000, '  ' * depth, name))
+    topLevel = sum(cumulative for depth, name, cumulative, selfTime in records[first:] if depth == 0)
+    print("%10.1f ms importing %d modules, %.1f ms since the profiler was installed" % (topLevel * 1000, len(records) - first,
+        (time.time() - installTime) * 1000 if installTime else 0.0))
@@ -0,0 +1,282 @@
+import json
+import time
+import threading
+from functools import wraps
+from contextlib import contextmanager
+
+'''
+Instrumentation of the prediction pipeline: timers around its stages and counters of the work done in them,
+optionally split by ticker. The pipeline records into the process wide recorder, which is a NullRecorder until
+enable() is called, so the hooks cost one method call that does nothing when metrics are off.
+
+Stages timed by the pipeline:
+    csvLoad       parsing a price CSV into a PriceSeries (StockData)
+    subsets       generating the contiguous subset windows (StockData.ContigSubsets)
+    fit           fitting the models of every subset (RegressionModel.predictAllPrices)
+    treeBuild     building the tree of predictions (TreeTraversal.createTree)
+    search        finding the subset closest to a price (breadthFirstSearch, PredictionIndex)
+    persistWrite  saving prediction state (TreeTraversal.writeTreeToFile)
+    persistRead   loading prediction state (TreeTraversal.readTreeFromFile)
+    download      downloading quotes (StockData.downloadQuote, QuoteDownloader)
+
+i.e. recorder = Metrics.enable()
+     with Metrics.tickerScope('AAPL'):
+         ...
+     print(recorder.toPrometheus())
+'''
+
+metricPrefix = 'stockprediction'
+
+
+'''
+Timer that records nothing, shared by every call of NullRecorder.timer
+'''
+class NullTimer(object):
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, excType, excValue, traceback):
+		return False
+
+
+nullTimer = NullTimer()
+
+
+'''
+Recorder used when metrics are off. Every method does nothing
+'''
+class NullRecorder(object):
+	enabled = False
+
+	def timer(self, stage):
+		return nullTimer
+
+	def addTime(self, stage, seconds, ticker=None):
+		pass
+
+	def count(self, name, amount=1, ticker=None):
+		pass
+
+	def tickerScope(self, ticker):
+		return nullTimer
+
+
+'''
+Times one run of a stage for a MetricsRecorder, as a context manager
+'''
+class StageTimer(object):
+
+	def __init__(self, recorder, stage):
+		self.recorder = recorder
+		self.stage = stage
+		self.startTime = None
+
+	def __enter__(self):
+		self.startTime = time.time()
+		return self
+
+	def __exit__(self, excType, excValue, traceback):
+		self.recorder.addTime(self.stage, time.time() - self.startTime)
+		return False
+
+
+'''
+Collects stage timings and counters. Safe to use from many threads; the ticker being worked on is kept per
+thread (see tickerScope), and recordings made outside of any ticker scope are only counted in the totals
+'''
+class MetricsRecorder(object):
+	enabled = True
+
+	def __init__(self):
+		self.timers = {} # (stage, ticker):[calls, total seconds, min seconds, max seconds], ticker '' when none
+		self.counters = {} # (name, ticker):amount
+		self.lock = threading.Lock()
+		self.local = threading.local()
+		self.startTime = time.time()
+
+	def currentTicker(self):
+		return getattr(self.local, 'ticker', '')
+
+	def timer(self, stage):
+		return StageTimer(self, stage)
+
+	def addTime(self, stage, seconds, ticker=None):
+		key = (stage, self.currentTicker() if ticker is None else ticker)
+		with self.lock:
+			timer = self.timers.get(key)
+			if timer is None:
+				self.timers[key] = [1, seconds, seconds, seconds]
+			else:
+				timer[0] += 1
+				timer[1] += seconds
+				timer[2] = min(timer[2], seconds)
+				timer[3] = max(timer[3], seconds)
+
+	def count(self, name, amount=1, ticker=None):
+		key = (name, self.currentTicker() if ticker is None else ticker)
+		with self.lock:
+			self.counters[key] = self.counters.get(key, 0) + amount
+
+	'''
+	Context manager that attributes everything recorded by this thread inside it to a ticker
+	'''
+	@contextmanager
+	def tickerScope(self, ticker):
+		previous = self.currentTicker()
+		self.local.ticker = ticker
+		try:
+			yield self
+		finally:
+			self.local.ticker = previous
+
+	'''
+	Raw timers and counters, picklable, for sending from a worker process to merge()
+	'''
+	def export(self):
+		with self.lock:
+			return {'timers': dict((key, list(timer)) for key, timer in self.timers.items()), 'counters': dict(self.counters)}
+
+	'''
+	Adds the timers and counters exported by another recorder (i.e. of a worker process) to this one
+	'''
+	def merge(self, exported):
+		with self.lock:
+			for key, (calls, total, least, most) in exported['timers'].items():
+				timer = self.timers.get(key)
+				if timer is None:
+					self.timers[key] = [calls, total, least, most]
+				else:
+					timer[0] += calls
+					timer[1] += total
+					timer[2] = min(timer[2], least)
+					timer[3] = max(timer[3], most)
+			for key, amount in exported['counters'].items():
+				self.counters[key] = self.counters.get(key, 0) + amount
+
+	def reset(self):
+		with self.lock:
+			self.timers.clear()
+			self.counters.clear()
+			self.startTime = time.time()
+
+	'''
+	Totals of every stage and counter, and the same per ticker
+	@return metrics - dict of 'stages' (stage:{'calls', 'seconds', 'minSeconds', 'maxSeconds'}), 'counters'
+	(name:amount), 'tickers' (ticker:{'stages', 'counters'}) and 'uptimeSeconds'
+	'''
+	def toDict(self):
+		exported = self.export()
+		stages, counters, tickers = {}, {}, {}
+		for (stage, ticker), (calls, total, least, most) in sorted(exported['timers'].items()):
+			for summary in [stages] + ([tickers.setdefault(ticker, {'stages': {}, 'counters': {}})['stages']] if ticker else []):
+				stats = summary.setdefault(stage, {'calls': 0, 'seconds': 0.0, 'minSeconds': least, 'maxSeconds': most})
+				stats['calls'] += calls
+				stats['seconds'] += total
+				stats['minSeconds'] = min(stats['minSeconds'], least)
+				stats['maxSeconds'] = max(stats['maxSeconds'], most)
+		for (name, ticker), amount in sorted(exported['counters'].items()):
+			counters[name] = counters.get(name, 0) + amount
+			if ticker:
+				tickerCounters = tickers.setdefault(ticker, {'stages': {}, 'counters': {}})['counters']
+				tickerCounters[name] = tickerCounters.get(name, 0) + amount
+		return {'stages': stages, 'counters': counters, 'tickers': tickers, 'uptimeSeconds': time.time() - self.startTime}
+
+	def toJson(self):
+		return json.dumps(self.toDict(), indent=2, sort_keys=True)
+
+	'''
+	Prometheus text exposition of the timers and counters, one series per stage (or counter) and ticker. Series
+	recorded outside a ticker scope have no ticker label, so sum() over a metric gives the total
+	'''
+	def toPrometheus(self, prefix=metricPrefix):
+		exported = self.export()
+		lines = []
+		timerMetrics = [('stage_calls_total', 'counter', 'Number of times each pipeline stage ran', 0),
+			('stage_seconds_total', 'counter', 'Seconds spent in each pipeline stage', 1),
+			('stage_seconds_max', 'gauge', 'Longest single run of each pipeline stage in seconds', 3)]
+		for name, metricType, description, column in timerMetrics:
+			lines.append('# HELP %s_%s %s' % (prefix, name, description))
+			lines.append('# TYPE %s_%s %s' % (prefix, name, metricType))
+			for (stage, ticker), timer in sorted(exported['timers'].items()):
+				lines.append('%s_%s{%s} %r' % (prefix, name, prometheusLabels(stage=stage, ticker=ticker), float(timer[column])))
+		lines.append('# HELP %s_events_total Work done by the pipeline stages' % prefix)
+		lines.append('# TYPE %s_events_total counter' % prefix)
+		for (name, ticker), amount in sorted(exported['counters'].items()):
+			lines.append('%s_events_total{%s} %r' % (prefix, prometheusLabels(event=name, ticker=ticker), float(amount)))
+		return '\n'.join(lines) + '\n'
+
+	'''
+	Writes the metrics to a file, as Prometheus text if its name ends in .prom and as JSON otherwise
+	'''
+	def writeFile(self, filename):
+		with open(filename, 'w') as metricsFile:
+			metricsFile.write(self.toPrometheus() if filename.endswith('.prom') else self.toJson())
+
+	def printReport(self):
+		metrics = self.toDict()
+		print("%-14s %8s %12s %12s %12s" % ('stage', 'calls', 'total secs', 'mean secs', 'max secs'))
+		for stage, stats in sorted(metrics['stages'].items(), key=lambda item: -item[1]['seconds']):
+			print("%-14s %8d %12.4f %12.6f %12.6f" % (stage, stats['calls'], stats['seconds'], stats['seconds'] / stats['calls'],
+				stats['maxSeconds']))
+		for name, amount in sorted(metrics['counters'].items()):
+			print("%-14s %8s" % (name, amount))
+
+
+def prometheusLabels(**labels):
+	return ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+		for name, value in sorted(labels.items()) if value != '')
+
+
+recorder = NullRecorder()
+
+
+def getRecorder():
+	return recorder
+
+
+def setRecorder(newRecorder):
+	global recorder
+	recorder = newRecorder
+
+
+'''
+Turns metrics on for this process
+@return recorder - the MetricsRecorder everything is now recorded into
+'''
+def enable():
+	if not recorder.enabled:
+		setRecorder(MetricsRecorder())
+	return recorder
+
+
+def disable():
+	setRecorder(NullRecorder())
+
+
+'''
+Context manager timing a stage into the current recorder
+'''
+def timer(stage):
+	return recorder.timer(stage)
+
+
+def count(name, amount=1):
+	recorder.count(name, amount)
+
+
+def tickerScope(ticker):
+	return recorder.tickerScope(ticker)
+
+
+'''
+Decorator timing every call of a function as a stage
+'''
+def timed(stage):
+	def decorate(function):
+		@wraps(function)
+		def timedFunction(*args, **kwargs):
+			with recorder.timer(stage):
+				return function(*args, **kwargs)
+		return timedFunction
+	return decorate
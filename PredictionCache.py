@@ -0,0 +1,255 @@
+import os
+import hashlib
+import thread
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+import Metrics as mt
+
+try:
+	import fcntl # not available on Windows, where msvcrt locks the file instead
+except ImportError:
+	fcntl = None
+	import msvcrt
+
+'''
+Disk backed, content addressed cache of prediction results. An entry's key is a hash of everything the result
+was computed from (the price arrays, the subset windows, the model type and its parameters, the day to
+predict), so an entry never has to be invalidated: changed inputs simply hash to a different key.
+
+Entries are .npz files of named arrays under <directory>/<namespace>/. Reading an entry touches its file, and
+when the cache grows past maxBytes the least recently used files are deleted. Every file is written under a
+temporary name and renamed into place, so a crash or a second process never leaves a half written entry.
+
+Besides whole entries the cache keeps fit tables: one file per model setup holding the digest:prediction pairs
+of individual subset fits, so runs that share windows (other window sizes, other dates of the same series)
+only fit the subsets they have not seen before. A fit table is read, merged and written back under a lock file,
+so processes adding fits to the same table at once don't drop each other's fits.
+'''
+
+cacheFormatVersion = 1 # part of every key, bump it when the stored layout changes
+fitEntryBytes = 48 # stored size of one subset fit: 40 byte hex digest and a float64
+
+
+'''
+Hashes the parts of a key. NumPy arrays are hashed by dtype, shape and bytes, anything else by its repr
+@return key - hex digest
+'''
+def makeKey(*parts):
+	digest = hashlib.sha1(str(cacheFormatVersion))
+	for part in parts:
+		if isinstance(part, np.ndarray):
+			part = np.ascontiguousarray(part)
+			digest.update('%s%s' % (part.dtype.str, part.shape))
+			digest.update(part.tobytes())
+		elif isinstance(part, dict):
+			digest.update(repr(sorted(part.items())))
+		else:
+			digest.update(repr(part))
+		digest.update('\x00')
+	return digest.hexdigest()
+
+
+'''
+Digest of the days and prices of one subset, the key of its fit in a fit table
+'''
+def subsetDigest(days, values):
+	return hashlib.sha1(np.ascontiguousarray(days).tobytes() + np.ascontiguousarray(values).tobytes()).hexdigest()
+
+
+'''
+Context manager holding an exclusive lock on a file (created when missing) across processes and threads
+'''
+@contextmanager
+def fileLock(filename):
+	with open(filename, 'a+b') as lockFile:
+		if fcntl is not None:
+			fcntl.flock(lockFile.fileno(), fcntl.LOCK_EX)
+		else:
+			lockFile.seek(0)
+			msvcrt.locking(lockFile.fileno(), msvcrt.LK_LOCK, 1)
+		try:
+			yield
+		finally:
+			if fcntl is not None:
+				fcntl.flock(lockFile.fileno(), fcntl.LOCK_UN)
+			else:
+				lockFile.seek(0)
+				msvcrt.locking(lockFile.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+'''
+@param directory - folder to keep the cache in, created when missing
+@param maxBytes - size the cache is trimmed back to, least recently used entries first
+'''
+class PredictionCache(object):
+
+	def __init__(self, directory, maxBytes=256 * 1024 * 1024):
+		self.directory = directory
+		self.maxBytes = maxBytes
+		self.hits = 0
+		self.misses = 0
+		self.fitHits = 0
+		self.fitMisses = 0
+		self.bytesRead = 0
+		self.bytesWritten = 0
+		self.evictions = 0
+		self.sizeOnDisk = None # worked out on the first write
+		self.lock = threading.Lock() # guards the counts above, the cache can be shared by threads (i.e. PredictionServer)
+
+	def entryFilename(self, namespace, key):
+		return os.path.join(self.directory, namespace, key + '.npz')
+
+	'''
+	Reads an entry
+	@return arrays - dict of name:array, or None if the entry is not cached
+	'''
+	def get(self, namespace, key):
+		arrays = self.readEntry(namespace, key)
+		with self.lock:
+			if arrays is None:
+				self.misses += 1
+			else:
+				self.hits += 1
+		mt.count('predictionCacheMisses' if arrays is None else 'predictionCacheHits')
+		return arrays
+
+	'''
+	Stores an entry
+	@param arrays - dict of name:array
+	'''
+	def put(self, namespace, key, arrays):
+		filename = self.entryFilename(namespace, key)
+		self.makeFolder(namespace)
+		tempFilename = '%s.%d.%d.tmp' % (filename, os.getpid(), thread.get_ident())
+		with open(tempFilename, 'wb') as entryFile:
+			np.savez(entryFile, **arrays)
+		size = os.path.getsize(tempFilename)
+		if os.name == 'nt' and os.path.exists(filename):
+			os.remove(filename) # os.rename does not replace existing files on Windows
+		os.rename(tempFilename, filename)
+		with self.lock:
+			self.bytesWritten += size
+			if self.sizeOnDisk is None:
+				self.sizeOnDisk = sum(size for _, size, _ in self.listEntries())
+			else:
+				self.sizeOnDisk += size
+			if self.sizeOnDisk > self.maxBytes:
+				self.evict()
+
+	def makeFolder(self, namespace):
+		folder = os.path.join(self.directory, namespace)
+		if not os.path.isdir(folder):
+			try:
+				os.makedirs(folder)
+			except OSError: # made by another process in the meantime
+				pass
+
+	def readEntry(self, namespace, key):
+		filename = self.entryFilename(namespace, key)
+		try:
+			with open(filename, 'rb') as entryFile:
+				stored = np.load(entryFile)
+				arrays = dict((name, stored[name]) for name in stored.files)
+			size = os.path.getsize(filename)
+			with self.lock:
+				self.bytesRead += size
+			os.utime(filename, None) # mark as recently used
+		except (IOError, OSError, ValueError): # missing, evicted by another process or unreadable
+			return None
+		return arrays
+
+	'''
+	Looks up the fits of many subsets in the fit table of one model setup
+	@param tableKey - key of the model setup (model type, parameters and day to predict)
+	@param digests - subsetDigest of each subset
+	@return fits - dict of digest:predicted price of the subsets that were found
+	'''
+	def lookupFits(self, tableKey, digests):
+		table = self.readFitTable(tableKey)
+		fits = dict((digest, table[digest]) for digest in digests if digest in table)
+		with self.lock:
+			self.fitHits += len(fits)
+			self.fitMisses += len(digests) - len(fits)
+		return fits
+
+	'''
+	Adds subset fits to the fit table of one model setup, merging with whatever is stored by then. The table is
+	locked from reading it to writing it back. A table is kept to half of maxBytes by dropping its oldest fits, so
+	one table can't push everything else out
+	@param fits - dict of digest:predicted price
+	'''
+	def storeFits(self, tableKey, fits):
+		if not fits:
+			return
+		self.makeFolder('fits')
+		with fileLock(self.entryFilename('fits', tableKey) + '.lock'):
+			table = self.readFitTable(tableKey)
+			for digest in fits:
+				table.pop(digest, None) # re-added at the end, as the newest
+			table.update(fits)
+			digests = table.keys()[-max(1, self.maxBytes // 2 // fitEntryBytes):]
+			self.put('fits', tableKey, {'digests': np.array(digests, dtype='S40'),
+				'prices': np.array([table[digest] for digest in digests], dtype=float)})
+
+	def readFitTable(self, tableKey):
+		stored = self.readEntry('fits', tableKey)
+		if stored is None:
+			return OrderedDict()
+		return OrderedDict(zip(stored['digests'].tolist(), stored['prices'].tolist()))
+
+	'''
+	Generates (filename, size, last used time) of every entry file in the cache, leaving out lock files and files
+	still being written
+	'''
+	def listEntries(self):
+		if not os.path.isdir(self.directory):
+			return
+		for namespace in os.listdir(self.directory):
+			folder = os.path.join(self.directory, namespace)
+			if not os.path.isdir(folder):
+				continue
+			for name in os.listdir(folder):
+				if not name.endswith('.npz'):
+					continue
+				filename = os.path.join(folder, name)
+				try:
+					fileStat = os.stat(filename)
+				except OSError:
+					continue
+				yield filename, fileStat.st_size, fileStat.st_mtime
+
+	'''
+	Deletes the least recently used files until the cache fits in maxBytes. Called with the lock held
+	'''
+	def evict(self):
+		entries = sorted(self.listEntries(), key=lambda entry: entry[2])
+		self.sizeOnDisk = sum(size for _, size, _ in entries)
+		for filename, size, _ in entries:
+			if self.sizeOnDisk <= self.maxBytes:
+				break
+			try:
+				os.remove(filename)
+			except OSError:
+				pass
+			self.sizeOnDisk -= size
+			self.evictions += 1
+
+	'''
+	Counts of this process's cache use, plus the entries and bytes currently on disk
+	'''
+	def stats(self):
+		entries = list(self.listEntries())
+		with self.lock:
+			self.sizeOnDisk = sum(size for _, size, _ in entries)
+			return {'hits': self.hits, 'misses': self.misses, 'fitHits': self.fitHits, 'fitMisses': self.fitMisses,
+				'bytesRead': self.bytesRead, 'bytesWritten': self.bytesWritten, 'evictions': self.evictions,
+				'entries': len(entries), 'bytesOnDisk': self.sizeOnDisk, 'maxBytes': self.maxBytes}
+
+	def printStats(self):
+		stats = self.stats()
+		print("Prediction cache: %d hits, %d misses, subset fits: %d hits, %d misses" % (stats['hits'], stats['misses'],
+			stats['fitHits'], stats['fitMisses']))
+		print("Prediction cache: %d bytes read, %d bytes written, %d evicted, %d entries / %d of %d bytes on disk" % (
+			stats['bytesRead'], stats['bytesWritten'], stats['evictions'], stats['entries'], stats['bytesOnDisk'], stats['maxBytes']))
@@ -0,0 +1,315 @@
+import os
+import json
+import time
+import datetime
+import argparse
+import threading
+import urlparse
+import BaseHTTPServer
+import SocketServer
+import numpy as np
+import StockData as sd
+import RegressionModel as rm
+import TreeTraversal as tt
+import PredictionCache as pc
+import Metrics as mt
+
+'''
+Long running prediction service. Price series and subset prediction indexes stay in memory per ticker, so a
+prediction is answered without starting Python, importing the models or reading the CSV again. When a ticker's
+CSV changes (new bars pushed to the server, a sync, or another process writing the file) its predictions are
+brought up to date on the next request: closed form linear models roll their stored lines forward and only fit
+the subsets that include the new days, other models recompute (through the prediction cache if one is set).
+
+JSON API, on 127.0.0.1 only:
+    GET  /health                             tickers loaded and requests served
+    GET  /predict/<ticker>                   today's closest subset and tomorrow's predicted price
+    GET  /nearest/<ticker>?price=P&k=K       the K subsets whose predictions are closest to P
+    POST /bars/<ticker>                      {"bars": [{"date", "open", "high", "low", "close", "volume"}, ...]}
+    POST /sync/<ticker>                      download the days missing from the ticker's CSV
+    GET  /metrics[?format=json]              stage timings and counters, per ticker, as Prometheus text or JSON
+
+i.e. python PredictionServer.py --port 8642 --model ols --preload AAPL
+     curl http://127.0.0.1:8642/predict/AAPL
+'''
+
+defaultConfig = {
+	'daysInThePast': 30,
+	'dayTodayToPredict': 0,
+	'dayInFutureToPredict': 1,
+	'regressionModelType': 'ols',
+	'modelOptions': {}, # settings overriding RegressionModel.modelParameters of the model type
+	'acceptedTolerance': 0.5,
+	'csvDirectory': '.', # where <ticker>.csv files are read from
+	'subsetStrategy': None, # StockData.SubsetStrategy of the subsets to predict, None for all of them
+	'cacheDirectory': None, # PredictionCache folder, None to not cache
+	'stockDataSource': 'google finance',
+	'metrics': True, # record stage timings and counters for /metrics
+}
+
+
+'''
+Raised for requests that can't be answered, with the HTTP status to answer them with
+'''
+class PredictionServiceError(Exception):
+
+	def __init__(self, status, message):
+		Exception.__init__(self, message)
+		self.status = status
+
+
+'''
+Everything kept in memory for one ticker. Replaced as a whole when the ticker's data changes, so a request
+that already holds a TickerState keeps seeing consistent data
+'''
+class TickerState(object):
+
+	def __init__(self, ticker, series, predictions, prediction):
+		self.ticker = ticker
+		self.series = series
+		self.predictions = predictions # (start day, end day):predicted price, from predictAllPrices
+		self.index = tt.PredictionIndex(predictions)
+		self.prediction = prediction # answer of /predict, worked out once per state
+		self.loadedAt = time.time()
+
+
+'''
+Keeps the TickerStates and brings them up to date. Safe to call from many threads: each ticker has its own
+lock, so a slow rebuild of one ticker never holds up requests for the others
+'''
+class PredictionService(object):
+
+	def __init__(self, config=None):
+		self.config = dict(defaultConfig, **(config or {}))
+		self.cache = pc.PredictionCache(self.config['cacheDirectory']) if self.config['cacheDirectory'] else None
+		self.metrics = mt.enable() if self.config['metrics'] else None
+		self.states = {}
+		self.tickerLocks = {}
+		self.lock = threading.Lock() # guards states, tickerLocks and the counts below
+		self.requestCount = 0
+		self.rebuildCount = 0
+		self.rollCount = 0
+
+	def countRequest(self):
+		with self.lock:
+			self.requestCount += 1
+
+	def csvFilename(self, ticker):
+		return os.path.join(self.config['csvDirectory'], ticker + '.csv')
+
+	def getTickerLock(self, ticker):
+		with self.lock:
+			if ticker not in self.tickerLocks:
+				self.tickerLocks[ticker] = threading.Lock()
+			return self.tickerLocks[ticker]
+
+	'''
+	Gets the up to date TickerState of a ticker, loading or updating it when its CSV is new or has changed
+	'''
+	def getState(self, ticker):
+		ticker = ticker.upper()
+		filename = self.csvFilename(ticker)
+		if not os.path.exists(filename):
+			raise PredictionServiceError(404, "No price data for %s" % ticker)
+		with self.getTickerLock(ticker), mt.tickerScope(ticker):
+			series = sd.getPriceSeries(filename) # a new object only when the file changed
+			state = self.states.get(ticker)
+			if state is None or state.series is not series:
+				state = self.buildState(ticker, series, state)
+				with self.lock:
+					self.states[ticker] = state
+			return state
+
+	def buildState(self, ticker, series, oldState):
+		config = self.config
+		modelType = config['regressionModelType']
+		dateValues = series.getDateValues(1, config['daysInThePast'])
+		dayOffset = series.getDayOffset(oldState.series.getTodaysDate()) if oldState is not None else 0
+		if dayOffset > 0 and isinstance(oldState.predictions, rm.LinearSubsetPredictions):
+			old = oldState.predictions
+			predictions = rm.rollLinearPredictions(np.array(old.keys(), dtype=np.int64).reshape(len(old), 2), old.slopes,
+				old.intercepts, dateValues, dayOffset, config['dayTodayToPredict'], config['subsetStrategy'])
+			with self.lock:
+				self.rollCount += 1
+		else:
+			predictions = rm.predictAllPrices(sd.ContigSubsets(dateValues, strategy=config['subsetStrategy']),
+				config['dayTodayToPredict'], modelType, cache=self.cache, **config['modelOptions'])
+			with self.lock:
+				self.rebuildCount += 1
+		state = TickerState(ticker, series, predictions, None)
+		state.prediction = self.makePrediction(state)
+		return state
+
+	def makePrediction(self, state):
+		config = self.config
+		series = state.series
+		todaysPrice = float(series.close[0])
+		foundNode = state.index.nearest(todaysPrice)
+		foundDays = np.arange(foundNode.dataset[0], foundNode.dataset[1] + 1)
+		tomorrowsPrice = float(rm.predictPriceArrays(foundDays, series.close[foundDays], config['dayInFutureToPredict'],
+			config['regressionModelType'], **config['modelOptions']))
+		todaysDifference = float(rm.getPriceDifference(foundNode.value, todaysPrice))
+		return {'ticker': state.ticker, 'asOfDate': series.getTodaysDate(), 'todaysPrice': todaysPrice,
+			'foundPrice': foundNode.value, 'foundStartDay': foundNode.dataset[0], 'foundEndDay': foundNode.dataset[1],
+			'todaysDifference': todaysDifference, 'withinTolerance': todaysDifference <= config['acceptedTolerance'],
+			'tomorrowsPrice': tomorrowsPrice, 'tomorrowsGainLoss': tomorrowsPrice - todaysPrice,
+			'modelType': config['regressionModelType'], 'sourceHash': series.sourceHash}
+
+	def predict(self, ticker):
+		return dict(self.getState(ticker).prediction)
+
+	def nearest(self, ticker, price, k=1):
+		state = self.getState(ticker)
+		return {'ticker': state.ticker, 'asOfDate': state.series.getTodaysDate(), 'price': price,
+			'subsets': [{'startDay': node.dataset[0], 'endDay': node.dataset[1], 'predictedPrice': node.value}
+				for node in state.index.kNearest(price, k)]}
+
+	'''
+	Adds pushed bars to a ticker's CSV. The predictions are rolled forward on the next request
+	@param bars - list of dicts with date (ISO string), open, high, low, close and volume
+	'''
+	def addBars(self, ticker, bars):
+		ticker = ticker.upper()
+		filename = self.csvFilename(ticker)
+		if not os.path.exists(filename):
+			raise PredictionServiceError(404, "No price data for %s" % ticker)
+		try:
+			bars = sorted(bars, key=lambda bar: bar['date'])
+			columns = dict((name, np.array([bar[name] for bar in bars], dtype=dtype)) for name, dtype in sd.Quote.COLUMNS)
+		except (KeyError, TypeError, ValueError) as error:
+			raise PredictionServiceError(400, "Bad bars: %s" % error)
+		with self.getTickerLock(ticker):
+			added = sd.mergeQuoteIntoCsv(filename, sd.Quote.from_numpy(columns, ticker))
+		return {'ticker': ticker, 'added': added}
+
+	def sync(self, ticker):
+		ticker = ticker.upper()
+		with self.getTickerLock(ticker), mt.tickerScope(ticker):
+			added = sd.syncCsvFile(ticker, datetime.date.today().isoformat(), self.config['stockDataSource'], self.csvFilename(ticker))
+		return {'ticker': ticker, 'added': added}
+
+	def health(self):
+		with self.lock:
+			return {'status': 'ok', 'tickers': sorted(self.states), 'requests': self.requestCount, 'rebuilds': self.rebuildCount,
+				'rolls': self.rollCount}
+
+	def getMetrics(self):
+		if self.metrics is None:
+			raise PredictionServiceError(404, "Metrics are turned off")
+		return self.metrics
+
+
+'''
+HTTP front end of a PredictionService, one thread per request
+'''
+class PredictionServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+	daemon_threads = True
+
+	def __init__(self, service, port=8642, host='127.0.0.1'):
+		BaseHTTPServer.HTTPServer.__init__(self, (host, port), PredictionRequestHandler)
+		self.service = service
+
+	@property
+	def baseUrl(self):
+		return "http://%s:%d" % self.server_address[:2]
+
+
+class PredictionRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1' # keep connections open between requests
+
+	def do_GET(self):
+		self.answer('GET')
+
+	def do_POST(self):
+		self.answer('POST')
+
+	def answer(self, method):
+		service = self.server.service
+		service.countRequest()
+		startTime = time.time()
+		parts = urlparse.urlsplit(self.path)
+		query = dict((name, values[-1]) for name, values in urlparse.parse_qs(parts.query).items())
+		path = [part for part in parts.path.split('/') if part]
+		try:
+			if method == 'GET' and path == ['metrics'] and query.get('format') != 'json':
+				self.sendText(200, service.getMetrics().toPrometheus(), 'text/plain; version=0.0.4')
+				return
+			if method == 'GET' and path == ['health']:
+				result = service.health()
+			elif method == 'GET' and path == ['metrics']:
+				result = service.getMetrics().toDict()
+			elif method == 'GET' and len(path) == 2 and path[0] == 'predict':
+				result = service.predict(path[1])
+			elif method == 'GET' and len(path) == 2 and path[0] == 'nearest':
+				try:
+					price, k = float(query['price']), int(query.get('k', 1))
+				except (KeyError, ValueError):
+					raise PredictionServiceError(400, "nearest needs a numeric price and k")
+				result = service.nearest(path[1], price, k)
+			elif method == 'POST' and len(path) == 2 and path[0] == 'bars':
+				result = service.addBars(path[1], self.readJson().get('bars', []))
+			elif method == 'POST' and len(path) == 2 and path[0] == 'sync':
+				result = service.sync(path[1])
+			else:
+				raise PredictionServiceError(404, "Unknown request: %s %s" % (method, parts.path))
+			status = 200
+		except PredictionServiceError as error:
+			status, result = error.status, {'error': str(error)}
+		except Exception as error:
+			status, result = 500, {'error': "%s: %s" % (type(error).__name__, error)}
+		result['milliseconds'] = round((time.time() - startTime) * 1000, 3)
+		self.sendJson(status, result)
+
+	def readJson(self):
+		length = int(self.headers.get('Content-Length') or 0)
+		try:
+			body = json.loads(self.rfile.read(length) or '{}')
+		except ValueError as error:
+			raise PredictionServiceError(400, "Bad JSON: %s" % error)
+		if not isinstance(body, dict):
+			raise PredictionServiceError(400, "Expected a JSON object")
+		return body
+
+	def sendJson(self, status, result):
+		self.sendText(status, json.dumps(result, sort_keys=True), 'application/json')
+
+	def sendText(self, status, body, contentType):
+		self.send_response(status)
+		self.send_header('Content-Type', contentType)
+		self.send_header('Content-Length', str(len(body)))
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		pass
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Serve stock predictions over a local JSON API.')
+	parser.add_argument('--port', type=int, default=8642, help='port to listen on (127.0.0.1 only)')
+	parser.add_argument('--model', default=defaultConfig['regressionModelType'], help='regression model type')
+	parser.add_argument('--model-option', type=rm.parseModelOption, action='append', default=[], metavar='NAME=VALUE',
+		help='model setting overriding its default, i.e. numOfFeatures=50 or seed=7 for rbf-approx (repeatable)')
+	parser.add_argument('--days', type=int, default=defaultConfig['daysInThePast'], help='number of days in the past to use')
+	parser.add_argument('--csv-directory', default='.', help='folder of <ticker>.csv files')
+	parser.add_argument('--subsets', type=sd.parseSubsetStrategy, default=None, help='subset strategy, see BatchPredict.py')
+	parser.add_argument('--cache', default=None, help='folder to cache predictions in')
+	parser.add_argument('--preload', nargs='*', default=[], help='tickers to load before serving')
+	parser.add_argument('--no-metrics', action='store_true', help='don\'t record stage timings for /metrics')
+	args = parser.parse_args()
+	try:
+		rm.getModelParameters(args.model, dict(args.model_option))
+	except ValueError as error:
+		parser.error(str(error))
+
+	service = PredictionService({'regressionModelType': args.model, 'modelOptions': dict(args.model_option), 'daysInThePast': args.days,
+		'csvDirectory': args.csv_directory, 'subsetStrategy': args.subsets, 'cacheDirectory': args.cache,
+		'metrics': not args.no_metrics})
+	for ticker in args.preload:
+		service.getState(ticker)
+	server = PredictionServer(service, args.port)
+	print("Serving predictions for %s at %s" % (', '.join(ticker.upper() for ticker in args.preload) or 'any ticker', server.baseUrl))
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		server.server_close()
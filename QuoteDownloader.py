@@ -0,0 +1,235 @@
+import os
+import time
+import datetime
+import threading
+import httplib
+import urllib
+import urlparse
+import posixpath
+import BaseHTTPServer
+import SocketServer
+from Queue import Queue, Empty
+from collections import OrderedDict
+import StockData as sd
+import QuoteParser as qp
+import Metrics as mt
+
+'''
+Concurrent quote downloader. A few worker threads share a queue of symbols, each keeps one open HTTP
+connection per host and reuses it for every symbol it fetches, failed requests are retried with exponential
+backoff, and each response is parsed straight into columnar NumPy arrays.
+
+Where quotes are fetched from is decided by a url builder function (symbol, startDate, endDate) -> url, so the
+downloader can be pointed at FixtureServer, a local HTTP server that serves recorded CSV files, to use it
+offline:
+
+    server = FixtureServer('recorded_csvs')
+    downloader = QuoteDownloader(server.quoteUrl)
+    results = downloader.download(['AAPL', 'ORCL'], '2017-01-01', '2017-05-12')
+    server.shutdown()
+'''
+
+def googleQuoteUrl(symbol, startDate, endDate):
+    start = datetime.date(int(startDate[0:4]), int(startDate[5:7]), int(startDate[8:10]))
+    end = datetime.date(int(endDate[0:4]), int(endDate[5:7]), int(endDate[8:10]))
+    return "http://www.google.com/finance/historical?" + urllib.urlencode([('q', symbol.upper()),
+        ('startdate', start.strftime('%b %d, %Y')), ('enddate', end.strftime('%b %d, %Y')), ('output', 'csv')])
+
+
+def yahooQuoteUrl(symbol, startDate, endDate):
+    start_year, start_month, start_day = startDate.split('-')
+    end_year, end_month, end_day = endDate.split('-')
+    return "http://ichart.finance.yahoo.com/table.csv?" + urllib.urlencode([('s', symbol),
+        ('a', int(start_month) - 1), ('b', start_day), ('c', start_year),
+        ('d', int(end_month) - 1), ('e', end_day), ('f', end_year)])
+
+
+quoteUrlBuilders = {'google finance': googleQuoteUrl, 'yahoo': yahooQuoteUrl}
+
+
+'''
+Raised for a symbol whose quotes could not be downloaded after all retries
+'''
+class QuoteDownloadError(Exception):
+    pass
+
+
+'''
+Downloads quotes for many symbols concurrently
+@param urlBuilder - function (symbol, startDate, endDate) -> url of the symbol's CSV
+@param maxConcurrency - most requests in flight at once (number of worker threads)
+@param retries - number of times a failed request is retried
+@param backoff - seconds to wait before the first retry, doubled for each retry after it
+@param timeout - socket timeout of each request in seconds
+'''
+class QuoteDownloader(object):
+
+    def __init__(self, urlBuilder=googleQuoteUrl, maxConcurrency=8, retries=3, backoff=0.5, timeout=10.0):
+        self.urlBuilder = urlBuilder
+        self.maxConcurrency = maxConcurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+
+    '''
+    Downloads and parses the quotes of every symbol
+    @return results - dict of symbol:columns (see QuoteParser.parseQuoteText), or symbol:QuoteDownloadError if it failed,
+    in the order of symbols
+    '''
+    def download(self, symbols, startDate, endDate):
+        results = OrderedDict((symbol, None) for symbol in symbols)
+        pending = Queue()
+        for symbol in symbols:
+            pending.put(symbol)
+        workers = [threading.Thread(target=self.downloadWorker, args=(pending, results, startDate, endDate))
+                   for _ in xrange(max(1, min(self.maxConcurrency, len(symbols))))]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return results
+
+    def downloadWorker(self, pending, results, startDate, endDate):
+        connections = {} # (scheme, host) -> connection kept open for this thread
+        try:
+            while True:
+                try:
+                    symbol = pending.get_nowait()
+                except Empty:
+                    return
+                try:
+                    with mt.tickerScope(symbol):
+                        with mt.timer('download'):
+                            results[symbol] = qp.parseQuoteText(self.fetch(connections, self.urlBuilder(symbol, startDate, endDate)))
+                        mt.count('downloads')
+                except Exception as error:
+                    results[symbol] = error if isinstance(error, QuoteDownloadError) else QuoteDownloadError("%s: %s" % (symbol, error))
+        finally:
+            for connection in connections.values():
+                connection.close()
+
+    '''
+    GETs a url over this thread's connection to its host, retrying with backoff on connection errors,
+    server errors and rate limiting
+    @return body - text of the response
+    '''
+    def fetch(self, connections, url):
+        parts = urlparse.urlsplit(url)
+        path = parts.path + ('?' + parts.query if parts.query else '')
+        for attempt in xrange(self.retries + 1):
+            if attempt > 0:
+                mt.count('downloadRetries')
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            connection = connections.get((parts.scheme, parts.netloc))
+            if connection is None:
+                connectionClass = httplib.HTTPSConnection if parts.scheme == 'https' else httplib.HTTPConnection
+                connection = connectionClass(parts.netloc, timeout=self.timeout)
+                connections[(parts.scheme, parts.netloc)] = connection
+            try:
+                connection.request('GET', path, headers={'Connection': 'keep-alive'})
+                response = connection.getresponse()
+                body = response.read() # the whole body has to be read before the connection can be reused
+            except (httplib.HTTPException, IOError) as error:
+                connection.close()
+                del connections[(parts.scheme, parts.netloc)]
+                lastError = error
+                continue
+            if response.status == 200:
+                mt.count('downloadBytes', len(body))
+                return body
+            lastError = "HTTP %d %s" % (response.status, response.reason)
+            if response.status != 429 and response.status < 500:
+                break # the request itself is wrong, retrying won't help
+        raise QuoteDownloadError("%s: %s" % (url, lastError))
+
+
+'''
+Downloads the CSV files of many tickers concurrently, in the same format as StockData.downloadCsvFile. Yahoo
+prices are adjusted for splits and dividends like StockData.YahooQuote does
+@param adjust - 'back', 'forward' or None, the StockData.adjustPrices mode of Yahoo prices
+@param downloader - QuoteDownloader to use (i.e. one pointed at a FixtureServer), None for one of the source
+@return failed - dict of ticker:QuoteDownloadError for the tickers that could not be downloaded
+'''
+def downloadCsvFiles(tickers, startDate, endDate, source, directory='.', maxConcurrency=8, adjust='back', downloader=None):
+    downloader = downloader or QuoteDownloader(quoteUrlBuilders[source], maxConcurrency)
+    failed = {}
+    for ticker, columns in downloader.download(tickers, startDate, endDate).items():
+        if isinstance(columns, Exception):
+            failed[ticker] = columns
+        else:
+            if source == 'yahoo':
+                columns = sd.adjustPrices(columns, adjust)
+            quote = sd.quoteFromColumns(ticker, columns)
+            quote.write_csv(os.path.join(directory, ticker + '.csv'))
+    return failed
+
+
+'''
+Local HTTP server that serves recorded quote CSV files, so the downloader can be run without the internet.
+Any request whose path or 'q'/'s'/'symbol' query parameter names a symbol gets <directory>/<SYMBOL>.csv.
+requestCount and connectionCount count what the server got, and failures makes it answer a symbol's next
+requests with HTTP 503, to test connection reuse and retries
+@param directory - folder of recorded CSV files
+@param port - port to listen on, 0 picks a free one
+'''
+class FixtureServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, directory, port=0):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port), FixtureRequestHandler)
+        self.directory = directory
+        self.requestCount = 0
+        self.connectionCount = 0
+        self.failures = {} # SYMBOL:number of its next requests to answer with HTTP 503
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def baseUrl(self):
+        return "http://127.0.0.1:%d" % self.server_address[1]
+
+    def quoteUrl(self, symbol, startDate, endDate):
+        return self.baseUrl + "/quotes?" + urllib.urlencode([('symbol', symbol), ('start', startDate), ('end', endDate)])
+
+    def shutdown(self):
+        BaseHTTPServer.HTTPServer.shutdown(self)
+        self.server_close()
+
+
+class FixtureRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep connections open between requests
+
+    def handle(self):
+        with self.server.lock:
+            self.server.connectionCount += 1
+        BaseHTTPServer.BaseHTTPRequestHandler.handle(self)
+
+    def do_GET(self):
+        parts = urlparse.urlsplit(self.path)
+        query = urlparse.parse_qs(parts.query)
+        symbol = (query.get('symbol') or query.get('q') or query.get('s') or [posixpath.splitext(posixpath.basename(parts.path))[0]])[0]
+        with self.server.lock:
+            self.server.requestCount += 1
+            failing = self.server.failures.get(symbol.upper(), 0) > 0
+            if failing:
+                self.server.failures[symbol.upper()] -= 1
+        if failing:
+            self.send_error(503, "Failing %s on purpose" % symbol)
+            return
+        filename = os.path.join(self.server.directory, os.path.basename(symbol.upper()) + '.csv')
+        if not os.path.isfile(filename):
+            self.send_error(404, "No recorded quotes for %s" % symbol)
+            return
+        with open(filename, 'rb') as recorded:
+            body = recorded.read()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/csv')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
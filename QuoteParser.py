@@ -0,0 +1,257 @@
+import re
+import numpy as np
+
+'''
+Bulk parser for the daily quote CSV layouts found in this repo and returned by the quote sources:
+
+    iso     - Date, Open, High, Low, Close, Volume[, Adj Close] with ISO dates (AAPL.csv, Yahoo, Quote.to_csv)
+    google  - the same columns with 1-May-17 dates and often a UTF-8 BOM (aaplOld2.csv, Google Finance)
+    symbol  - headerless SYMBOL,yyyy-mm-dd,hh:mm:ss,open,high,low,close,volume rows (orcl.csv)
+
+The dialect is detected from the first lines, then whole files are converted column by column with NumPy
+instead of calling float() and strptime once per field. Columns are returned as a dict of arrays sorted oldest
+first: 'date' (datetime64[D]), 'open', 'high', 'low', 'close' (float64), 'volume' (int64), plus 'adjClose',
+'time' (timedelta64[s]) and 'symbol' when the file has them.
+
+Large files can be read in chunks with iterQuoteChunks, which never holds more than one chunk of text.
+'''
+
+isoDatePattern = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+googleDatePattern = re.compile(r'^\d{1,2}-[A-Za-z]{3}-\d{2}$')
+headerNames = {'date': 'date', 'open': 'open', 'high': 'high', 'low': 'low', 'close': 'close', 'volume': 'volume',
+               'adj close': 'adjClose', 'adj. close': 'adjClose'}
+monthNames = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+defaultChunkBytes = 64 * 1024 * 1024
+utf8Bom = '\xef\xbb\xbf'
+
+
+'''
+Layout of a quote CSV file, as found by detectDialect
+@param name - 'iso', 'google' or 'symbol'
+@param hasHeader - whether the first line holds the column names
+@param numOfFields - number of comma separated fields on every row
+@param columns - dict of column name:field index
+'''
+class QuoteDialect(object):
+
+    def __init__(self, name, hasHeader, numOfFields, columns):
+        self.name = name
+        self.hasHeader = hasHeader
+        self.numOfFields = numOfFields
+        self.columns = columns
+
+    def __repr__(self):
+        return "QuoteDialect(%r, hasHeader=%r, numOfFields=%d)" % (self.name, self.hasHeader, self.numOfFields)
+
+
+'''
+Works out the layout of a quote CSV from its first lines
+@param sample - text from the start of the file (a few lines are enough)
+@return dialect - QuoteDialect of the file
+'''
+def detectDialect(sample):
+    lines = [line.strip() for line in stripBom(sample).splitlines() if line.strip()]
+    if not lines:
+        raise ValueError("Empty quote file")
+    fields = [field.strip() for field in lines[0].split(',')]
+    hasHeader = fields[0].lower() == 'date'
+    if hasHeader:
+        columns = dict((headerNames[field.lower()], i) for i, field in enumerate(fields) if field.lower() in headerNames)
+        missing = [name for name in ('date', 'open', 'high', 'low', 'close', 'volume') if name not in columns]
+        if missing:
+            raise ValueError("Quote file header has no %s column: %s" % (', '.join(missing), lines[0]))
+        if len(lines) < 2:
+            return QuoteDialect('iso', True, len(fields), columns)
+        fields = [field.strip() for field in lines[1].split(',')]
+    elif len(fields) == 8 and isoDatePattern.match(fields[1]):
+        return QuoteDialect('symbol', False, 8, {'symbol': 0, 'date': 1, 'time': 2, 'open': 3, 'high': 4, 'low': 5,
+                                                 'close': 6, 'volume': 7})
+    else:
+        columns = {'date': 0, 'open': 1, 'high': 2, 'low': 3, 'close': 4, 'volume': 5}
+        if len(fields) == 7:
+            columns['adjClose'] = 6
+
+    dateField = fields[columns['date']]
+    if isoDatePattern.match(dateField):
+        return QuoteDialect('iso', hasHeader, len(fields), columns)
+    if googleDatePattern.match(dateField):
+        return QuoteDialect('google', hasHeader, len(fields), columns)
+    raise ValueError("Unknown quote file layout, first row: %s" % lines[0])
+
+
+'''
+Removes the UTF-8 byte order mark from the start of text, if it starts with one
+'''
+def stripBom(text):
+    if text.startswith(utf8Bom):
+        return text[len(utf8Bom):]
+    return text
+
+
+'''
+Parses the text of a whole quote CSV file
+@param text - contents of the file
+@param dialect - QuoteDialect of the text, detected when None
+@return columns - dict of column arrays sorted oldest first (see above)
+'''
+def parseQuoteText(text, dialect=None):
+    text = stripBom(text)
+    if dialect is None:
+        dialect = detectDialect(text[:4096])
+    if dialect.hasHeader:
+        text = text.partition('\n')[2]
+    return sortColumns(parseRows(text, dialect))
+
+
+'''
+Parses a quote CSV file
+@param filename - name of the file
+@param chunkBytes - read the file this many bytes at a time, None to read it all at once
+@return columns - dict of column arrays sorted oldest first (see above)
+'''
+def parseQuoteFile(filename, chunkBytes=None):
+    if chunkBytes is None:
+        with open(filename, 'rb') as quoteFile:
+            return parseQuoteText(quoteFile.read())
+    return sortColumns(concatenateColumns(list(iterQuoteChunks(filename, chunkBytes))))
+
+
+'''
+Reads a quote CSV file a chunk at a time, for files too big to hold as text. Chunks are cut at line ends
+@param filename - name of the file
+@param chunkBytes - approximate size of each chunk of text
+@return generator of column dicts, one per chunk, with rows in file order (not sorted)
+'''
+def iterQuoteChunks(filename, chunkBytes=defaultChunkBytes):
+    with open(filename, 'rb') as quoteFile:
+        remainder = stripBom(quoteFile.read(4096))
+        while remainder.count('\n') < 2: # detect the dialect from whole lines
+            more = quoteFile.read(4096)
+            if not more:
+                break
+            remainder += more
+        dialect = detectDialect(remainder[:remainder.rfind('\n') + 1] or remainder)
+        if dialect.hasHeader:
+            remainder = remainder.partition('\n')[2]
+        while True:
+            chunk = quoteFile.read(chunkBytes)
+            if not chunk:
+                break
+            lineEnd = (remainder + chunk).rfind('\n')
+            if lineEnd < 0:
+                remainder += chunk
+                continue
+            text = remainder + chunk
+            remainder = text[lineEnd + 1:]
+            yield parseRows(text[:lineEnd + 1], dialect)
+        if remainder.strip():
+            yield parseRows(remainder, dialect)
+
+
+'''
+Converts header-less CSV rows of a known dialect into column arrays, in the order of the rows
+'''
+def parseRows(text, dialect):
+    text = text.replace('\r', '')
+    if '\n\n' in text or text.startswith('\n'):
+        text = '\n'.join(line for line in text.split('\n') if line.strip())
+    text = text.strip('\n')
+    if not text:
+        return emptyColumns(dialect)
+    fields = np.array(text.replace('\n', ',').split(','))
+    if fields.size % dialect.numOfFields != 0:
+        raise ValueError("Quote rows do not all have %d fields" % dialect.numOfFields)
+    fields = fields.reshape(-1, dialect.numOfFields)
+    if ' ' in text:
+        fields = np.char.strip(fields)
+
+    columns = {}
+    dateFields = fields[:, dialect.columns['date']]
+    columns['date'] = parseGoogleDates(dateFields) if dialect.name == 'google' else dateFields.astype('datetime64[D]')
+    for name in ('open', 'high', 'low', 'close', 'adjClose'):
+        if name in dialect.columns:
+            columns[name] = toFloatColumn(fields[:, dialect.columns[name]])
+    columns['volume'] = toIntColumn(fields[:, dialect.columns['volume']])
+    if 'time' in dialect.columns:
+        columns['time'] = parseTimes(fields[:, dialect.columns['time']])
+    if 'symbol' in dialect.columns:
+        columns['symbol'] = fields[:, dialect.columns['symbol']]
+    return columns
+
+
+def emptyColumns(dialect):
+    columns = {'date': np.empty(0, dtype='datetime64[D]'), 'volume': np.empty(0, dtype=np.int64)}
+    for name in ('open', 'high', 'low', 'close', 'adjClose'):
+        if name in dialect.columns:
+            columns[name] = np.empty(0)
+    if 'time' in dialect.columns:
+        columns['time'] = np.empty(0, dtype='timedelta64[s]')
+    if 'symbol' in dialect.columns:
+        columns['symbol'] = np.empty(0, dtype='S1')
+    return columns
+
+
+'''
+Sorts every column by date (and time of day when there is one), keeping the file order of equal dates
+'''
+def sortColumns(columns):
+    if 'time' in columns:
+        order = np.lexsort((columns['time'], columns['date']))
+    else:
+        order = np.argsort(columns['date'], kind='mergesort')
+    return dict((name, column[order]) for name, column in columns.items())
+
+
+def concatenateColumns(chunks):
+    if len(chunks) == 1:
+        return chunks[0]
+    return dict((name, np.concatenate([chunk[name] for chunk in chunks])) for name in chunks[0])
+
+
+'''
+Converts 1-May-17 style dates to datetime64[D] without strptime, by reading the day, month and year straight
+from the bytes of the zero padded strings. Two digit years follow strptime: 69-99 are 19xx, 00-68 are 20xx
+'''
+def parseGoogleDates(dateFields):
+    chars = np.char.zfill(dateFields.astype('S9'), 9).view(np.uint8).reshape(-1, 9).astype(np.int64)
+    days = (chars[:, 0] - 48) * 10 + chars[:, 1] - 48
+    yearsInCentury = (chars[:, 7] - 48) * 10 + chars[:, 8] - 48
+    years = np.where(yearsInCentury < 69, 2000, 1900) + yearsInCentury
+    monthKeys = (chars[:, 3] | 32) * 65536 + (chars[:, 4] | 32) * 256 + (chars[:, 5] | 32) # lower case
+    knownKeys = np.array([ord(name[0].lower()) * 65536 + ord(name[1]) * 256 + ord(name[2]) for name in monthNames])
+    keyOrder = np.argsort(knownKeys)
+    positions = np.minimum(np.searchsorted(knownKeys[keyOrder], monthKeys), len(knownKeys) - 1)
+    if np.any(knownKeys[keyOrder][positions] != monthKeys) or np.any(days < 1) or np.any(days > 31):
+        raise ValueError("Unknown date in quote file: %s" % dateFields[0])
+    months = keyOrder[positions]
+    return ((years - 1970).astype('datetime64[Y]').astype('datetime64[M]') + months.astype('timedelta64[M]')).astype('datetime64[D]') \
+        + (days - 1).astype('timedelta64[D]')
+
+
+def parseTimes(timeFields):
+    chars = timeFields.astype('S8').view(np.uint8).reshape(-1, 8).astype(np.int64) - 48
+    seconds = (chars[:, 0] * 10 + chars[:, 1]) * 3600 + (chars[:, 3] * 10 + chars[:, 4]) * 60 + chars[:, 6] * 10 + chars[:, 7]
+    return seconds.astype('timedelta64[s]')
+
+
+'''
+Converts price fields to float64, with Google's '-' for a missing price read as nan
+'''
+def toFloatColumn(fields):
+    missing = fields == '-'
+    if missing.any():
+        fields = np.where(missing, 'nan', fields)
+    return fields.astype(np.float64)
+
+
+'''
+Converts volume fields to int64, with '-' read as 0
+'''
+def toIntColumn(fields):
+    missing = fields == '-'
+    if missing.any():
+        fields = np.where(missing, '0', fields)
+    try:
+        return fields.astype(np.int64)
+    except ValueError: # i.e. 1.2e6
+        return fields.astype(np.float64).astype(np.int64)
@@ -1,32 +1,92 @@
 import csv
 import numpy as np
-from sklearn.svm import SVR
-import matplotlib.pyplot as plt
 import copy
 from collections import OrderedDict
 import sys
 import datetime
+from itertools import izip
+import multiprocessing
+import StockData as sd
+import PredictionCache as pc
+import Metrics as mt
+
+olsModelTypes = ('ols', 'fast-linear') # closed form linear models that can predict all subsets at once
+modelParameters = { # estimator settings of each model type, also part of the prediction cache keys
+	'ols': {},
+	'fast-linear': {},
+	'linear': {'kernel': 'linear', 'C': 1e3},
+	'rbf': {'kernel': 'rbf', 'C': 1e3, 'gamma': 0.1},
+	'poly2': {'degree': 2, 'alpha': 0.0}, # alpha is a ridge penalty on the x terms, with x scaled to [-1, 0] per window
+	'poly3': {'degree': 3, 'alpha': 0.0},
+	'ridge': {'degree': 1, 'alpha': 1.0},
+	# more features approximate the rbf kernel (of the same gamma as 'rbf') more closely, the seed fixes the basis
+	'rbf-approx': {'numOfFeatures': 20, 'gamma': 0.1, 'alpha': 1e-3, 'seed': 0},
+}
+
+'''
+Gets the estimator settings of a model type with some of them overridden, i.e. predictAllPrices(subsets, 0,
+'rbf-approx', numOfFeatures=50, seed=7)
+@param modelOptions - dict of setting:value overriding modelParameters[modelType], None for the defaults
+@return parameters - dict of every setting of the model type
+'''
+def getModelParameters(modelType, modelOptions=None):
+	if modelType not in modelParameters:
+		raise ValueError("Unknown model type %s (model types: %s)" % (modelType, ', '.join(sorted(modelParameters))))
+	parameters = dict(modelParameters[modelType])
+	unknown = sorted(set(modelOptions or {}) - set(parameters))
+	if unknown:
+		raise ValueError("Model %s has no option %s (options: %s)" % (modelType, ', '.join(unknown), ', '.join(sorted(parameters)) or 'none'))
+	parameters.update(modelOptions or {})
+	return parameters
+
+
+'''
+Parses a model setting from text like "numOfFeatures=50" (i.e. for --model-option), numbers become int or float
+@return (setting, value)
+'''
+def parseModelOption(text):
+	name, separator, value = text.partition('=')
+	if not separator or not name.strip():
+		raise ValueError("Model options look like name=value, got %s" % text)
+	for convert in (int, float):
+		try:
+			return name.strip(), convert(value)
+		except ValueError:
+			pass
+	return name.strip(), value.strip()
+
+'''
+Gets sklearn's SVR class. sklearn (and matplotlib for the graphs) are only imported by the code paths that use
+them, since importing them takes longer than the closed form models take to run
+'''
+def loadSVR():
+	from sklearn.svm import SVR
+	return SVR
+
 
 '''
 Predicts a single value with Regression based on:
 @param dateValues - a dictionary that contains date:price pairs
-@param dayToPredict - the day to predict where 0 is today, 1 is tomorrow, -1 is yesterday, etc...
-@param modelType - type of Regression model (i.e. "rbf", "linear", "poly", etc...)
-@return predictedPrice - the predicted price
+@param dayToPredict - the day to predict where 0 is today, 1 is tomorrow, -1 is yesterday, etc... or a list of
+days to predict them all from one fit
+@param modelType - type of Regression model (i.e. "rbf", "linear", "ols", "poly2", "poly3", "ridge", etc...)
+@param modelOptions - settings overriding the model type's modelParameters
+@return predictedPrice - the predicted price, or an array of the predicted price of each day in dayToPredict
 '''
-def predictPrice(dateValues, dayToPredict, modelType, printGraph, plotTodaysPrice):
+def predictPrice(dateValues, dayToPredict, modelType, printGraph, plotTodaysPrice, **modelOptions):
 	if modelType == 'linear':
 		dates = [i*-1 for i in dateValues.keys()] # need dates to be negative
 		dates = np.reshape(dates, (len(dateValues), 1)) # format our dates list into an n by 1 matrix
 		values = dateValues.values()
-		svrLin = SVR(kernel = 'linear', C=1e3) # linear support vector regression
+		svrLin = loadSVR()(**getModelParameters(modelType, modelOptions)) # linear support vector regression
 		svrLin.fit(dates, values) # fit/train each of our models on our dates/price data using this method
 
 		# The following code is used for graphing purposes
 		if (printGraph == 1):
+			import matplotlib.pyplot as plt
 			plt.scatter(dates, values, color='black', label='Data') # plot initial data points as black dots with label 'Data'
 			plt.plot(dates, svrLin.predict(dates), color='green', label='Linear model')
-			plt.scatter(dayToPredict, svrLin.predict(dayToPredict)[0], color = 'green', label='Linear predicted price')
+			plt.scatter(dayToPredict, svrLin.predict(np.reshape(dayToPredict, (-1, 1)))[0], color = 'green', label='Linear predicted price')
 			plt.scatter(0, plotTodaysPrice, color = 'red', label='Todays Price')
 			plt.xlabel('Days from today')
 			plt.ylabel('Price')
@@ -34,48 +94,661 @@ def predictPrice(dateValues, dayToPredict, modelType, printGraph, plotTodaysPric
 			# plt.legend(loc = 'best')
 			plt.legend(loc = 'upper left')
 			plt.show()
-		predictedPrice = svrLin.predict(dayToPredict)[0]
-		return predictedPrice
+		predictedPrices = svrLin.predict(np.reshape(dayToPredict, (-1, 1)))
+		return predictedPrices[0] if np.ndim(dayToPredict) == 0 else predictedPrices
+
+	elif modelType in olsModelTypes or modelType in batchModels:
+		return predictPriceArrays(dateValues.keys(), dateValues.values(), dayToPredict, modelType, **modelOptions)
 
 	elif modelType == 'rbf':
-		print('Predicting price based on rbf model')
+		return predictPriceArrays(dateValues.keys(), dateValues.values(), dayToPredict, modelType, **modelOptions)
 	else:
-		print('An incorrect model type was supplied - only choose linear or rbf')
+		print('An incorrect model type was supplied - only choose linear, rbf, ols or one of %s' % ', '.join(sorted(batchModels)))
 	
 
 '''
-Predicts multiple values with Regression based on:
-@param dateValues - a list of dictionaries that contain date:price pairs
+Fits an ordinary least squares line to many windows of one price series at once. Prefix sums of x, x^2, y
+and xy are built a single time, so every window's fit is a handful of vectorized array operations
+@param dates - array of x values (days from today, negative for the past)
+@param values - array of prices, parallel to dates, or a 2D array with one price series of the same dates per row
+@param starts - array of window start indexes into dates/values
+@param ends - array of window end indexes (inclusive), parallel to starts
+@return slopes, intercepts - arrays with the fitted line of each window so that price = intercept + slope*x (one
+row per series for 2D values)
+'''
+def fitAllLinear(dates, values, starts, ends):
+	dates = np.asarray(dates, dtype=float)
+	values = np.asarray(values, dtype=float)
+	x = dates - dates[0] # shift x so the prefix sums stay small and precise
+	prefixX = np.concatenate(([0.0], np.cumsum(x)))
+	prefixXX = np.concatenate(([0.0], np.cumsum(x * x)))
+	prefixY = np.concatenate((np.zeros(values.shape[:-1] + (1,)), np.cumsum(values, axis=-1)), axis=-1)
+	prefixXY = np.concatenate((np.zeros(values.shape[:-1] + (1,)), np.cumsum(x * values, axis=-1)), axis=-1)
+
+	stops = ends + 1
+	count = (stops - starts).astype(float)
+	sumX = prefixX[stops] - prefixX[starts]
+	sumXX = prefixXX[stops] - prefixXX[starts]
+	sumY = prefixY[..., stops] - prefixY[..., starts]
+	sumXY = prefixXY[..., stops] - prefixXY[..., starts]
+
+	denominators = count * sumXX - sumX * sumX
+	with np.errstate(divide='ignore', invalid='ignore'):
+		slopes = np.where(denominators != 0, (count * sumXY - sumX * sumY) / denominators, 0.0) # one day subsets are flat
+	intercepts = (sumY - slopes * sumX) / count - slopes * dates[0] # undo the shift of x
+	return slopes, intercepts
+
+
+'''
+Fits a least squares polynomial of x (optionally ridge penalised) to many windows of one price series at once,
+solving the normal equations of all windows as a stacked batch with numpy.linalg.solve. The windows are
+grouped by start index, and each group's sums of x^k and x^k*y come from one cumulative sum with x measured
+from that start, so no moment is the difference of two large prefix sums (a cubic needs x^6, which would
+leave no significant digits). Each window's moments are then scaled by its span so its x runs over [-1, 0].
+Windows with too few days for every term are fitted with the terms they have days for
+@param dates, values, starts, ends - like fitAllLinear
+@param degree - degree of the polynomial
+@param alpha - ridge penalty on the coefficients of the x terms (not the constant), in the scaled x
+@param maxWindowsPerChunk - number of windows solved at a time, bounds memory
+@return coefficients - windows by degree + 1 array, constant first, of each window's polynomial of (x - origin) / scale
+@return origins, scales - arrays of each window's first x and span
+'''
+def fitAllPolynomial(dates, values, starts, ends, degree, alpha=0.0, maxWindowsPerChunk=200000):
+	dates = np.asarray(dates, dtype=float)
+	values = np.asarray(values, dtype=float)
+	starts = np.asarray(starts, dtype=np.int64)
+	ends = np.asarray(ends, dtype=np.int64)
+	coefficients = np.zeros((len(starts), degree + 1))
+	origins = dates[starts]
+	scales = np.abs(dates[ends] - origins)
+	scales[scales == 0] = 1.0
+	powers = np.arange(2 * degree + 1)
+
+	order = np.argsort(starts, kind='mergesort')
+	sortedStarts = starts[order]
+	groupStarts = np.flatnonzero(np.concatenate(([True], sortedStarts[1:] != sortedStarts[:-1]))) if len(order) else []
+	pending = []
+	numOfPending = 0
+	for groupStart, groupEnd in izip(groupStarts, np.append(groupStarts[1:], len(order))):
+		windows = order[groupStart:groupEnd]
+		anchor = sortedStarts[groupStart]
+		rows = ends[windows] - anchor
+		x = dates[anchor:anchor + rows.max() + 1] - dates[anchor]
+		xPowers = x[:, np.newaxis] ** powers
+		pending.append((windows, np.cumsum(xPowers, axis=0)[rows],
+			np.cumsum(xPowers[:, :degree + 1] * values[anchor:anchor + len(x), np.newaxis], axis=0)[rows]))
+		numOfPending += len(windows)
+		if numOfPending >= maxWindowsPerChunk:
+			solvePolynomialChunk(pending, coefficients, scales, degree, alpha)
+			pending = []
+			numOfPending = 0
+	if pending:
+		solvePolynomialChunk(pending, coefficients, scales, degree, alpha)
+	return coefficients, origins, scales
+
+
+def solvePolynomialChunk(pending, coefficients, scales, degree, alpha):
+	windows = np.concatenate([group[0] for group in pending])
+	terms = np.arange(degree + 1)
+	windowScales = scales[windows][:, np.newaxis]
+	moments = np.concatenate([group[1] for group in pending]) / windowScales ** np.arange(2 * degree + 1)
+	valueMoments = np.concatenate([group[2] for group in pending]) / windowScales ** terms
+	matrices = moments[:, terms[:, np.newaxis] + terms] # sum of x^(i+j) at row i, column j
+	matrices[:, terms[1:], terms[1:]] += alpha
+	unused = moments[:, :1] <= terms # a window of n days can only fit n terms
+	if unused.any():
+		matrices[unused[:, :, np.newaxis] | unused[:, np.newaxis, :]] = 0.0
+		unusedWindows, unusedTerms = np.nonzero(unused)
+		matrices[unusedWindows, unusedTerms, unusedTerms] = 1.0
+		valueMoments[unused] = 0.0
+	coefficients[windows] = np.linalg.solve(matrices, valueMoments[:, :, np.newaxis])[:, :, 0]
+
+
+'''
+Evaluates the polynomials from fitAllPolynomial at x
+@param x - a value, or an array of values
+@return values - array with the value of each window's polynomial at x (windows by len(x) for an array of x)
+'''
+def evaluatePolynomials(coefficients, origins, scales, x):
+	x = np.asarray(x, dtype=float)
+	if x.ndim > 0:
+		origins = origins[:, np.newaxis]
+		scales = scales[:, np.newaxis]
+		coefficients = coefficients[:, :, np.newaxis]
+	scaledX = (x - origins) / scales
+	values = np.zeros(scaledX.shape)
+	for term in xrange(coefficients.shape[1] - 1, -1, -1):
+		values = values * scaledX + coefficients[:, term]
+	return values
+
+
+def predictAllPolynomial(dates, values, starts, ends, dayToPredict, degree, alpha=0.0):
+	coefficients, origins, scales = fitAllPolynomial(dates, values, starts, ends, degree, alpha)
+	return evaluatePolynomials(coefficients, origins, scales, dayToPredict)
+
+
+'''
+Maps x through a fixed random Fourier feature basis: sqrt(2/D)*cos(w*x + b) with w drawn from a normal of
+variance 2*gamma and b uniform on [0, 2pi), so the dot product of two feature vectors approximates the rbf
+kernel exp(-gamma*(x - x')^2). The same seed always gives the same basis
+@return features - array of numOfFeatures features of each x (one row per x for an array of x)
+'''
+def randomFourierFeatures(x, numOfFeatures, gamma, seed):
+	random = np.random.RandomState(seed)
+	frequencies = random.normal(0.0, np.sqrt(2.0 * gamma), numOfFeatures)
+	phases = random.uniform(0.0, 2.0 * np.pi, numOfFeatures)
+	return np.sqrt(2.0 / numOfFeatures) * np.cos(np.multiply.outer(x, frequencies) + phases)
+
+
+'''
+Approximate rbf kernel regression of many windows at once: a ridge regression (with an unpenalised constant)
+on randomFourierFeatures of x. Every day's features are computed once, and each window's normal equations
+are the difference of prefix sums of the feature outer products and of features*y. The features are bounded by
+sqrt(2/D), so unlike powers of x these prefix sums stay small enough to subtract. The windows are solved as
+stacked batches with numpy.linalg.solve
+@param dates, values, starts, ends - like fitAllLinear
+@param numOfFeatures - number of random features, the accuracy knob (cost grows with its square)
+@param gamma - kernel width, as for the 'rbf' SVR
+@param alpha - ridge penalty, needed for windows with fewer days than features
+@param seed - seed of the random feature basis
+@param maxWindowsPerChunk - number of windows solved at a time, bounds memory
+@return predictedPrices - array of each window's prediction at dayToPredict (windows by days for a list of days)
+'''
+def predictAllRbfApprox(dates, values, starts, ends, dayToPredict, numOfFeatures=20, gamma=0.1, alpha=1e-3, seed=0,
+		maxWindowsPerChunk=20000):
+	dates = np.asarray(dates, dtype=float)
+	values = np.asarray(values, dtype=float)
+	starts = np.asarray(starts, dtype=np.int64)
+	stops = np.asarray(ends, dtype=np.int64) + 1
+	numOfTerms = numOfFeatures + 1
+	features = np.column_stack((np.ones(len(dates)), randomFourierFeatures(dates, numOfFeatures, gamma, seed)))
+	prefixOuter = np.zeros((len(dates) + 1, numOfTerms * numOfTerms))
+	np.cumsum((features[:, :, np.newaxis] * features[:, np.newaxis, :]).reshape(len(dates), -1), axis=0, out=prefixOuter[1:])
+	prefixValues = np.zeros((len(dates) + 1, numOfTerms))
+	np.cumsum(features * values[:, np.newaxis], axis=0, out=prefixValues[1:])
+	penalty = alpha * np.eye(numOfTerms)
+	penalty[0, 0] = 0.0 # the constant is not penalised
+	targets = randomFourierFeatures(np.asarray(dayToPredict, dtype=float), numOfFeatures, gamma, seed)
+	targets = np.concatenate((np.ones(targets.shape[:-1] + (1,)), targets), axis=-1) # features of each day to predict
+
+	predictedPrices = np.empty((len(starts),) + np.shape(dayToPredict))
+	for first in xrange(0, len(starts), maxWindowsPerChunk):
+		chunkStarts = starts[first:first + maxWindowsPerChunk]
+		chunkStops = stops[first:first + maxWindowsPerChunk]
+		matrices = (prefixOuter[chunkStops] - prefixOuter[chunkStarts]).reshape(-1, numOfTerms, numOfTerms) + penalty
+		coefficients = np.linalg.solve(matrices, (prefixValues[chunkStops] - prefixValues[chunkStarts])[:, :, np.newaxis])
+		predictedPrices[first:first + len(chunkStarts)] = coefficients[:, :, 0].dot(targets.T)
+	return predictedPrices
+
+
+# model types predicted for every subset at once, name:function(dates, values, starts, ends, dayToPredict,
+# **getModelParameters(name, modelOptions)) returning an array of the predicted prices
+batchModels = {
+	'poly2': predictAllPolynomial,
+	'poly3': predictAllPolynomial,
+	'ridge': predictAllPolynomial,
+	'rbf-approx': predictAllRbfApprox,
+}
+
+
+'''
+Predicts a single value with Regression from parallel arrays instead of a dictionary, so subsets can be
+passed in as views over a shared price array
+@param days - array of days where 1 is yesterday, 2 is the day before, etc...
+@param values - array of prices, parallel to days
+@param dayToPredict - the day to predict where 0 is today, 1 is tomorrow, -1 is yesterday, etc... or a list of
+days to predict them all from one fit
+@param modelType - type of Regression model (i.e. "rbf", "linear", "ols", "poly2", "poly3", "ridge", etc...)
+@param modelOptions - settings overriding the model type's modelParameters
+@return predictedPrice - the predicted price, or an array of the predicted price of each day in dayToPredict
+'''
+def predictPriceArrays(days, values, dayToPredict, modelType, **modelOptions):
+	dates = np.asarray(days, dtype=float) * -1 # need dates to be negative
+	parameters = getModelParameters(modelType, modelOptions)
+	if modelType in ('linear', 'rbf'):
+		svr = loadSVR()(**parameters) # linear or radial basis function support vector regression
+		svr.fit(np.reshape(dates, (len(dates), 1)), values)
+		predictedPrices = svr.predict(np.reshape(dayToPredict, (-1, 1)).astype(float))
+		return predictedPrices[0] if np.ndim(dayToPredict) == 0 else predictedPrices
+	elif modelType in olsModelTypes:
+		slopes, intercepts = fitAllLinear(dates, values, np.array([0]), np.array([len(dates) - 1]))
+		return intercepts[0] + slopes[0] * np.asarray(dayToPredict, dtype=float)
+	elif modelType in batchModels:
+		return batchModels[modelType](dates, values, [0], [len(dates) - 1], dayToPredict, **parameters)[0]
+	return predictPrice(OrderedDict(zip(days, values)), dayToPredict, modelType, 0, 0)
+
+
+'''
+{(start day, end day): predicted price} dict returned by the closed form linear model. It also keeps each
+subset's fitted line (slopes and intercepts arrays, parallel to the dict, for x = -day) so the predictions
+can be rolled forward to a later day with rollLinearPredictions instead of being recomputed
+'''
+class LinearSubsetPredictions(OrderedDict):
+	slopes = None
+	intercepts = None
+
+
+def makeLinearSubsetPredictions(datasets, slopes, intercepts, dayToPredict):
+	predictedPrices = intercepts + slopes * dayToPredict
+	predictions = LinearSubsetPredictions(zip([tuple(dataset) for dataset in datasets.tolist()], predictedPrices.tolist()))
+	predictions.slopes = slopes
+	predictions.intercepts = intercepts
+	return predictions
+
+
+'''
+Predictions of every subset for several days to predict (horizons) at once, from one fit per subset, as
+returned by predictAllPrices for a list of days. select() gives the usual {(start day, end day): predicted
+price} dict of any one horizon
+@param datasets - n by 2 array of the subsets' (start day, end day) datasets
+@param horizons - list of the days predicted, i.e. [0, 1, 5, 20]
+@param prices - n by len(horizons) array of predicted prices
+@param slopes, intercepts - fitted lines of the closed form linear models, None for other models
+'''
+class HorizonPredictions(object):
+
+	def __init__(self, datasets, horizons, prices, slopes=None, intercepts=None):
+		self.datasets = np.asarray(datasets, dtype=np.int64).reshape(-1, 2)
+		self.horizons = np.asarray(horizons).tolist()
+		self.prices = np.asarray(prices, dtype=float).reshape(len(self.datasets), len(self.horizons))
+		self.slopes = slopes
+		self.intercepts = intercepts
+
+	def __len__(self):
+		return len(self.datasets)
+
+	'''
+	Gets the column of prices of a horizon
+	@param horizon - one of horizons, None for the first
+	'''
+	def horizonIndex(self, horizon=None):
+		if horizon is None:
+			return 0
+		if horizon not in self.horizons:
+			raise ValueError("No predictions for day %s, only for days %s" % (horizon, self.horizons))
+		return self.horizons.index(horizon)
+
+	'''
+	@return dateValueDict - dict of (start day, end day):predicted price of one horizon (a LinearSubsetPredictions
+	for the closed form linear models)
+	'''
+	def select(self, horizon=None):
+		if self.slopes is not None:
+			return makeLinearSubsetPredictions(self.datasets, self.slopes, self.intercepts, self.horizons[self.horizonIndex(horizon)])
+		return OrderedDict(izip([tuple(dataset) for dataset in self.datasets.tolist()], self.prices[:, self.horizonIndex(horizon)].tolist()))
+
+	def toArrays(self):
+		arrays = {'datasets': self.datasets, 'horizons': np.array(self.horizons, dtype=float), 'prices': self.prices}
+		if self.slopes is not None:
+			arrays['slopes'] = self.slopes
+			arrays['intercepts'] = self.intercepts
+		return arrays
+
+	@classmethod
+	def fromArrays(cls, arrays, horizons):
+		return cls(arrays['datasets'], horizons, arrays['prices'], arrays.get('slopes'), arrays.get('intercepts'))
+
+
+'''
+Predicts every subset of a StockData.ContigSubsets in one vectorized pass using ordinary least squares.
+Gives the same result as calling predictPrice with 'ols' on each subset
+@param subsets - StockData.ContigSubsets of the date:price series
 @param dayToPredict - the day to predict where 0 is today, 1 is tomorrow, -1 is yesterday, etc...
-@param modelType - type of Regression model (i.e. "rbf", "linear", "poly", etc...)
-@param return dateValueDict - a list of date:predicted price pairs where date is a tuple of (start day, end day)
+@return dateValueDict - a LinearSubsetPredictions dict of date:predicted price pairs where date is a tuple of
+(start day, end day), in the same order as the subsets
 '''
-def predictAllPrices(dateValues, dayToPredict, modelType):
+def predictAllPricesOls(subsets, dayToPredict):
+	starts, ends = subsets.indexArrays()
+	slopes, intercepts = fitAllLinear(subsets.days * -1, subsets.values, starts, ends) # need dates to be negative
+	datasets = np.column_stack((subsets.days[starts], subsets.days[ends]))
+	mt.count('subsetsFitted', len(starts))
+	return makeLinearSubsetPredictions(datasets, slopes, intercepts, dayToPredict)
+
+
+'''
+Predicts every subset of a StockData.ContigSubsets in one vectorized pass with one of the batchModels
+@return dateValueDict - a dict of date:predicted price pairs where date is a tuple of (start day, end day), in
+the same order as the subsets
+'''
+def predictAllPricesBatch(subsets, dayToPredict, modelType, modelOptions=None):
+	starts, ends = subsets.indexArrays()
+	predictedPrices = batchModels[modelType](subsets.days * -1, subsets.values, starts, ends, dayToPredict,
+		**getModelParameters(modelType, modelOptions))
+	mt.count('subsetsFitted', len(starts))
+	return OrderedDict(izip(subsets.datasets(), predictedPrices.tolist()))
+
+
+'''
+Rolls closed form linear subset predictions forward by dayOffset market days. A subset made only of days that
+were already known keeps its fitted line, which is just re-expressed relative to the new today, so only the
+subsets that include one of the dayOffset newest days are fitted (O(n*dayOffset) instead of O(n^2) for AllPairs)
+@param datasets - n by 2 array of the stored (start day, end day) datasets
+@param slopes, intercepts - arrays of the stored fitted lines, parallel to datasets
+@param dateValues - date:price dict of days 1..daysInThePast as of the new today
+@param dayOffset - number of market days passed since the stored predictions were made
+@param dayToPredict - the day to predict where 0 is today, 1 is tomorrow, -1 is yesterday, etc...
+@param strategy - StockData.SubsetStrategy of the subsets to return, None for all of them
+@return dateValueDict - LinearSubsetPredictions of the strategy's subsets of dateValues, in ContigSubsets order
+'''
+@mt.timed('fit')
+def rollLinearPredictions(datasets, slopes, intercepts, dateValues, dayOffset, dayToPredict, strategy=None):
+	subsets = sd.ContigSubsets(dateValues, strategy=strategy)
+	starts, ends = subsets.indexArrays()
+	newDatasets = np.column_stack((subsets.days[starts], subsets.days[ends]))
+	storedDatasets = np.asarray(datasets, dtype=np.int64).reshape(-1, 2) + dayOffset
+
+	# find each wanted subset among the stored ones by its (start day, end day) packed into one sortable key
+	keyBase = max(int(newDatasets.max()) if len(newDatasets) else 0, int(storedDatasets.max()) if len(storedDatasets) else 0) + 1
+	storedKeys = storedDatasets[:, 0] * keyBase + storedDatasets[:, 1]
+	newKeys = newDatasets[:, 0] * keyBase + newDatasets[:, 1]
+	storedOrder = np.argsort(storedKeys, kind='mergesort')
+	positions = np.minimum(np.searchsorted(storedKeys[storedOrder], newKeys), max(len(storedKeys) - 1, 0))
+	kept = np.zeros(len(newKeys), dtype=bool)
+	if len(storedKeys):
+		kept = storedKeys[storedOrder][positions] == newKeys
+	storedIndexes = storedOrder[positions[kept]] if len(storedKeys) else np.zeros(0, dtype=np.int64)
+
+	newSlopes = np.empty(len(newKeys))
+	newIntercepts = np.empty(len(newKeys))
+	# a day later means x = -day is one lower, so the same line has intercept + slope*dayOffset at the new x = 0
+	newSlopes[kept] = np.asarray(slopes)[storedIndexes]
+	newIntercepts[kept] = np.asarray(intercepts)[storedIndexes] + newSlopes[kept] * dayOffset
+	fitted = ~kept
+	newSlopes[fitted], newIntercepts[fitted] = fitAllLinear(subsets.days * -1, subsets.values, starts[fitted], ends[fitted]) # need dates to be negative
+	mt.count('subsetsFitted', int(fitted.sum()))
+	mt.count('subsetsRolled', int(kept.sum()))
+	return makeLinearSubsetPredictions(newDatasets, newSlopes, newIntercepts, dayToPredict)
+
+
+'''
+Keeps only the subset predictions that lie within the first maxDay days. A subset's prediction only depends on
+its own days, so this gives the same result as predicting the subsets of days 1..maxDay from scratch (with
+any of the prefix consistent StockData subset strategies)
+@param dateValueDict - dict of (start day, end day):predicted price pairs from predictAllPrices
+@param maxDay - last day a kept subset may end on
+@return dateValueDict - the kept pairs, in the same order (a LinearSubsetPredictions keeps its fitted lines)
+'''
+def filterPredictionsByWindow(dateValueDict, maxDay):
+	datasets = np.array(dateValueDict.keys(), dtype=np.int64).reshape(len(dateValueDict), 2)
+	kept = np.flatnonzero(datasets[:, 1] <= maxDay)
+	if isinstance(dateValueDict, LinearSubsetPredictions):
+		filtered = LinearSubsetPredictions()
+		filtered.slopes = dateValueDict.slopes[kept]
+		filtered.intercepts = dateValueDict.intercepts[kept]
+	else:
+		filtered = OrderedDict()
+	items = dateValueDict.items()
+	for index in kept.tolist():
+		filtered[items[index][0]] = items[index][1]
+	return filtered
+
+
+'''
+The opposite of filterPredictionsByWindow: predicts the subsets of a larger window from the predictions of the
+first maxDay days, fitting only the subsets that end after day maxDay
+@param dateValueDict - dict of (start day, end day):predicted price pairs of the subsets of days 1..maxDay
+@param maxDay - last day of the window dateValueDict was predicted for
+@param subsets - StockData.ContigSubsets of the larger window, made with the same prefix consistent strategy
+@return dateValueDict - the predictions of every subset, in ContigSubsets order (a LinearSubsetPredictions when
+both the stored and the new predictions are)
+'''
+def extendPredictionsWindow(dateValueDict, maxDay, subsets, dayToPredict, modelType, numOfWorkers=1, cache=None, **modelOptions):
+	starts, ends = subsets.indexArrays()
+	datasets = np.column_stack((subsets.days[starts], subsets.days[ends]))
+	added = np.flatnonzero(datasets[:, 1] > maxDay)
+	kept = np.flatnonzero(datasets[:, 1] <= maxDay)
+	if len(added):
+		newDict = predictAllPrices(subsets.select(added), dayToPredict, modelType, numOfWorkers, cache, **modelOptions)
+	else:
+		newDict = LinearSubsetPredictions() if isinstance(dateValueDict, LinearSubsetPredictions) else OrderedDict()
+	positions = dict((dataset, i) for i, dataset in enumerate(dateValueDict.keys()))
+	storedIndexes = np.array([positions[dataset] for dataset in map(tuple, datasets[kept].tolist())], dtype=np.int64)
+
+	if isinstance(dateValueDict, LinearSubsetPredictions) and isinstance(newDict, LinearSubsetPredictions):
+		slopes = np.empty(len(datasets))
+		intercepts = np.empty(len(datasets))
+		slopes[kept] = dateValueDict.slopes[storedIndexes]
+		intercepts[kept] = dateValueDict.intercepts[storedIndexes]
+		if len(added):
+			slopes[added] = newDict.slopes
+			intercepts[added] = newDict.intercepts
+		return makeLinearSubsetPredictions(datasets, slopes, intercepts, dayToPredict)
+	predictedPrices = np.empty(len(datasets))
+	predictedPrices[kept] = np.array(dateValueDict.values(), dtype=float)[storedIndexes]
+	predictedPrices[added] = newDict.values()
+	return OrderedDict(izip(map(tuple, datasets.tolist()), predictedPrices.tolist()))
+
+
+'''
+Generates the (start day, end day) dataset and predicted price of each subset, one fit at a time
+@param dateValues - a StockData.ContigSubsets or a list of dictionaries that contain date:price pairs
+'''
+def iterSubsetPredictions(dateValues, dayToPredict, modelType, modelOptions=None):
+	if isinstance(dateValues, sd.ContigSubsets):
+		for currDataset, (days, values) in izip(dateValues.datasets(), dateValues):
+			yield currDataset, predictPriceArrays(days, values, dayToPredict, modelType, **(modelOptions or {}))
+	else:
+		for currDateValues in dateValues:
+			currDataset = (min(currDateValues.keys()), max(currDateValues.keys()))
+			yield currDataset, predictPrice(currDateValues, dayToPredict, modelType, 0, 0, **(modelOptions or {}))
+
+
+'''
+Estimates the time left for a loop from how long the completed iterations took
+@return (minutes, seconds) remaining
+'''
+def estimateTimeRemaining(completed, total, startTime):
+	elapsedTime = divmod((datetime.datetime.now() - startTime).total_seconds(), 60)
+	currMinutesRemaining = (float(elapsedTime[0]) * float(total) / float(completed)) - float(elapsedTime[0])
+	totalSecondsRemaining = (float(elapsedTime[1]) * float(total) / float(completed)) - float(elapsedTime[1]) + currMinutesRemaining*60.00
+	return divmod(totalSecondsRemaining, 60)
+
+
+def writeProgress(completed, total, totalMinSecRemaining):
+	percentComplete = 100*float(completed) / float(total)
+	sys.stderr.write('\rComputing subset %d of %d (%.2f%%) %d min %d secs remaining ' % (completed, total, percentComplete, totalMinSecRemaining[0], totalMinSecRemaining[1]))
+	sys.stderr.flush()
+
+
+'''
+Predicts multiple values with Regression based on:
+@param dateValues - a StockData.ContigSubsets or a list of dictionaries that contain date:price pairs
+@param dayToPredict - the day to predict where 0 is today, 1 is tomorrow, -1 is yesterday, etc... or a list of
+days to predict them all from one fit per subset
+@param modelType - type of Regression model (i.e. "rbf", "linear", "ols", "poly2", "poly3", "ridge", etc...)
+@param numOfWorkers - number of processes to fit the subsets with, 1 fits them all in this process
+@param cache - PredictionCache.PredictionCache to reuse earlier results from, None to compute everything
+@param modelOptions - settings overriding the model type's modelParameters, i.e. numOfFeatures=50, seed=7 for
+'rbf-approx'
+@param return dateValueDict - a list of date:predicted price pairs where date is a tuple of (start day, end day),
+or HorizonPredictions for a list of days
+'''
+@mt.timed('fit')
+def predictAllPrices(dateValues, dayToPredict, modelType, numOfWorkers=1, cache=None, **modelOptions):
+	getModelParameters(modelType, modelOptions) # fails before any fitting on an unknown option
+	if np.ndim(dayToPredict) > 0:
+		if not isinstance(dateValues, sd.ContigSubsets):
+			dateValues = sd.ContigSubsets.fromDicts(dateValues)
+		return predictAllHorizons(dateValues, list(dayToPredict), modelType, numOfWorkers, cache, modelOptions)
+	if modelType in olsModelTypes or modelType in batchModels or numOfWorkers > 1 or cache is not None:
+		if not isinstance(dateValues, sd.ContigSubsets):
+			dateValues = sd.ContigSubsets.fromDicts(dateValues) # one subset per dict, whichever strategy made them
+		if cache is not None:
+			return predictAllPricesCached(dateValues, dayToPredict, modelType, numOfWorkers, cache, modelOptions)
+		if modelType in olsModelTypes:
+			return predictAllPricesOls(dateValues, dayToPredict)
+		if modelType in batchModels:
+			return predictAllPricesBatch(dateValues, dayToPredict, modelType, modelOptions)
+		return predictAllPricesParallel(dateValues, dayToPredict, modelType, numOfWorkers, modelOptions=modelOptions)
 	sizeOfDateValues = len(dateValues)
-	currMin = 0
-	currMax = 0
 	dateValueDict = OrderedDict({})
 	startTime = datetime.datetime.now()
-	for i in range(0, sizeOfDateValues):
-		percentComplete = 100*float((i+1)) / float(sizeOfDateValues)
-		if (i % 10 == 0):
-			currTime = datetime.datetime.now()
-			elapsedDateTime = (currTime - startTime)
-			elapsedTime = divmod(elapsedDateTime.total_seconds(), 60)
-			currMinutesRemaining = (float(elapsedTime[0]) * float(sizeOfDateValues) / float(i+1)) - float(elapsedTime[0])
-			totalSecondsRemaining = (float(elapsedTime[1]) * float(sizeOfDateValues) / float(i+1)) - float(elapsedTime[1]) + currMinutesRemaining*60.00
-			totalMinSecRemaining = divmod(totalSecondsRemaining, 60)
-		sys.stderr.write('\rComputing subset %d of %d (%.2f%%) %d min %d secs remaining ' % (i+1, sizeOfDateValues, percentComplete, totalMinSecRemaining[0], totalMinSecRemaining[1]))
-		sys.stderr.flush()
-		currMin = min(dateValues[i].keys())
-		currMax = max(dateValues[i].keys())
-		currPrice = predictPrice(dateValues[i], dayToPredict, modelType, 0, 0)
-		currDataset = (currMin, currMax)
+	for i, (currDataset, currPrice) in enumerate(iterSubsetPredictions(dateValues, dayToPredict, modelType, modelOptions)):
 		dateValueDict[currDataset] = currPrice
+		if (i % 10 == 0 or i+1 == sizeOfDateValues):
+			writeProgress(i+1, sizeOfDateValues, estimateTimeRemaining(i+1, sizeOfDateValues, startTime))
 	print("\n")
+	mt.count('subsetsFitted', len(dateValueDict))
 	return dateValueDict
 
 
+'''
+predictAllPrices for a list of days to predict. Every subset is fitted once and its model evaluated at each
+of the days: the closed form and batch models evaluate their fitted coefficients, the per subset models
+(linear and rbf SVR) predict all the days from the same fitted estimator. The whole result is cached as one
+entry, per subset fits are not shared with the single day fit tables
+@return predictions - HorizonPredictions in the same order as the subsets
+'''
+def predictAllHorizons(subsets, horizons, modelType, numOfWorkers=1, cache=None, modelOptions=None):
+	starts, ends = subsets.indexArrays()
+	parameters = getModelParameters(modelType, modelOptions)
+	if cache is not None:
+		key = pc.makeKey('predictAllHorizons', modelType, parameters, horizons,
+			subsets.days, subsets.values, starts, ends)
+		stored = cache.get('horizonPredictions', key)
+		if stored is not None:
+			return HorizonPredictions.fromArrays(stored, horizons)
+	datasets = np.column_stack((subsets.days[starts], subsets.days[ends]))
+	horizonArray = np.array(horizons, dtype=float)
+	if modelType in olsModelTypes:
+		slopes, intercepts = fitAllLinear(subsets.days * -1, subsets.values, starts, ends) # need dates to be negative
+		predictions = HorizonPredictions(datasets, horizons, intercepts[:, np.newaxis] + slopes[:, np.newaxis] * horizonArray,
+			slopes, intercepts)
+	elif modelType in batchModels:
+		predictions = HorizonPredictions(datasets, horizons,
+			batchModels[modelType](subsets.days * -1, subsets.values, starts, ends, horizonArray, **parameters))
+	elif numOfWorkers > 1:
+		predictions = HorizonPredictions(datasets, horizons,
+			predictAllPricesParallel(subsets, horizonArray, modelType, numOfWorkers, modelOptions=modelOptions).values())
+	else:
+		prices = np.empty((len(starts), len(horizons)))
+		startTime = datetime.datetime.now()
+		for i, (days, values) in enumerate(subsets):
+			prices[i] = predictPriceArrays(days, values, horizonArray, modelType, **(modelOptions or {}))
+			if (i % 10 == 0 or i+1 == len(prices)):
+				writeProgress(i+1, len(prices), estimateTimeRemaining(i+1, len(prices), startTime))
+		print("\n")
+		predictions = HorizonPredictions(datasets, horizons, prices)
+	if modelType in olsModelTypes or modelType in batchModels or numOfWorkers <= 1:
+		mt.count('subsetsFitted', len(starts)) # predictAllPricesParallel counts its own
+	if cache is not None:
+		cache.put('horizonPredictions', key, predictions.toArrays())
+	return predictions
+
+
+'''
+predictAllPrices through a PredictionCache. The whole result is cached under a hash of the series, the subset
+windows, the model setup and dayToPredict. On a miss, models without a closed form also look up each subset's
+fit on its own, so only subsets never fitted before with the same model setup are fitted
+'''
+def predictAllPricesCached(subsets, dayToPredict, modelType, numOfWorkers, cache, modelOptions=None):
+	starts, ends = subsets.indexArrays()
+	key = pc.makeKey('predictAllPrices', modelType, getModelParameters(modelType, modelOptions), dayToPredict,
+		subsets.days, subsets.values, starts, ends)
+	stored = cache.get('predictions', key)
+	if stored is not None:
+		return predictionsFromArrays(stored, dayToPredict)
+	if modelType in olsModelTypes:
+		dateValueDict = predictAllPricesOls(subsets, dayToPredict)
+	elif modelType in batchModels:
+		dateValueDict = predictAllPricesBatch(subsets, dayToPredict, modelType, modelOptions)
+	else:
+		dateValueDict = predictSubsetsCached(subsets, dayToPredict, modelType, numOfWorkers, cache, modelOptions)
+	cache.put('predictions', key, predictionsToArrays(dateValueDict))
+	return dateValueDict
+
+
+def predictSubsetsCached(subsets, dayToPredict, modelType, numOfWorkers, cache, modelOptions=None):
+	tableKey = pc.makeKey('subsetFits', modelType, getModelParameters(modelType, modelOptions), dayToPredict)
+	ranges = list(subsets.ranges())
+	digests = [pc.subsetDigest(subsets.days[start:end + 1], subsets.values[start:end + 1]) for start, end in ranges]
+	fits = cache.lookupFits(tableKey, digests)
+	missing = [i for i, digest in enumerate(digests) if digest not in fits]
+	if missing:
+		missingRanges = [ranges[i] for i in missing]
+		if numOfWorkers > 1:
+			missingPrices = predictAllPricesParallel(subsets, dayToPredict, modelType, numOfWorkers, ranges=missingRanges,
+				modelOptions=modelOptions).values()
+		else:
+			missingPrices = []
+			startTime = datetime.datetime.now()
+			for start, end in missingRanges:
+				missingPrices.append(predictPriceArrays(subsets.days[start:end + 1], subsets.values[start:end + 1], dayToPredict,
+					modelType, **(modelOptions or {})))
+				if (len(missingPrices) % 10 == 1 or len(missingPrices) == len(missingRanges)):
+					writeProgress(len(missingPrices), len(missingRanges), estimateTimeRemaining(len(missingPrices), len(missingRanges), startTime))
+			print("\n")
+			mt.count('subsetsFitted', len(missingRanges))
+		newFits = dict((digests[i], float(price)) for i, price in izip(missing, missingPrices))
+		cache.storeFits(tableKey, newFits)
+		fits.update(newFits)
+	return OrderedDict(izip(subsets.datasets(), [fits[digest] for digest in digests]))
+
+
+'''
+Converts predictAllPrices results to arrays for the cache and back
+'''
+def predictionsToArrays(dateValueDict):
+	arrays = {'datasets': np.array(dateValueDict.keys(), dtype=np.int64).reshape(len(dateValueDict), 2),
+		'prices': np.array(dateValueDict.values(), dtype=float)}
+	if isinstance(dateValueDict, LinearSubsetPredictions):
+		arrays['slopes'] = dateValueDict.slopes
+		arrays['intercepts'] = dateValueDict.intercepts
+	return arrays
+
+
+def predictionsFromArrays(arrays, dayToPredict):
+	if 'slopes' in arrays:
+		return makeLinearSubsetPredictions(arrays['datasets'], arrays['slopes'], arrays['intercepts'], dayToPredict)
+	return OrderedDict(izip([tuple(dataset) for dataset in arrays['datasets'].tolist()], arrays['prices'].tolist()))
+
+
+'''
+Fits the subsets of a StockData.ContigSubsets on a pool of worker processes. Each worker gets the shared days
+and prices once when it starts, then only chunks of (start, end) index ranges are sent to it, and the
+predictions come back in chunk order so the result is ordered like the serial one
+@param subsets - StockData.ContigSubsets of the date:price series
+@param numOfWorkers - number of worker processes
+@param chunkSize - number of subsets sent to a worker at a time
+@param ranges - (start, end) index pairs of the subsets to fit, None for all of them
+@param modelOptions - settings overriding the model type's modelParameters
+@return dateValueDict - a dict of date:predicted price pairs where date is a tuple of (start day, end day)
+'''
+def predictAllPricesParallel(subsets, dayToPredict, modelType, numOfWorkers, chunkSize=64, ranges=None, modelOptions=None):
+	ranges = list(subsets.ranges()) if ranges is None else ranges
+	chunks = [(ranges[i:i + chunkSize], dayToPredict, modelType, modelOptions or {}) for i in xrange(0, len(ranges), chunkSize)]
+	predictedPrices = []
+	startTime = datetime.datetime.now()
+	pool = multiprocessing.Pool(numOfWorkers, initSubsetWorker, (subsets.days, subsets.values))
+	try:
+		for chunkPrices in pool.imap(predictSubsetChunk, chunks):
+			predictedPrices.extend(chunkPrices)
+			writeProgress(len(predictedPrices), len(ranges), estimateTimeRemaining(len(predictedPrices), len(ranges), startTime))
+		pool.close()
+	finally:
+		pool.terminate()
+		pool.join()
+	print("\n")
+	mt.count('subsetsFitted', len(ranges))
+	days = subsets.days.tolist()
+	return OrderedDict(izip([(days[start], days[end]) for start, end in ranges], predictedPrices))
+
+
+workerDays = None # days and prices of the series being fitted, set once in each worker process
+workerValues = None
+
+def initSubsetWorker(days, values):
+	global workerDays, workerValues
+	workerDays = days
+	workerValues = values
+
+
+def predictSubsetChunk(chunk):
+	ranges, dayToPredict, modelType, modelOptions = chunk
+	return [predictPriceArrays(workerDays[start:end + 1], workerValues[start:end + 1], dayToPredict, modelType, **modelOptions)
+		for start, end in ranges]
+
+
 '''
 Gets the absolute difference in price between two values
 @return absolute difference between two values
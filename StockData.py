@@ -1,7 +1,86 @@
 import urllib,time,datetime
 from collections import OrderedDict
-import copy
-import csv
+from itertools import izip
+import os
+import hashlib
+import threading
+import numpy as np
+import QuoteParser as qp
+import Metrics as mt
+
+
+priceSeriesCache = OrderedDict() # process-wide cache of parsed CSV files: absolute path -> ((mtime, size), PriceSeries), least recently used first
+priceSeriesCacheSize = 64 # most CSV files kept parsed, so long running processes don't keep every file they ever read
+priceSeriesCacheLock = threading.Lock()
+
+'''
+In-memory columnar copy of a price CSV file (any layout QuoteParser reads), parsed once into NumPy arrays.
+Rows are newest first, so index 0 is today and index n is n market days ago, the same day numbering used by
+getDataCsv
+'''
+class PriceSeries(object):
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, 'rb') as csvfile:
+            content = csvfile.read()
+        self.sourceHash = hashlib.sha1(content).hexdigest() # identifies the data predictions were made from
+        columns = qp.parseQuoteText(content) # oldest first, whatever the layout of the file
+        self.date = columns['date'][::-1]
+        self.open_, self.high, self.low, self.close = [columns[name][::-1] for name in ('open', 'high', 'low', 'close')]
+        self.volume = columns['volume'][::-1]
+
+    def __len__(self):
+        return len(self.close)
+
+    '''
+    Returns a dictionary of day:price (closing) pairs from startDay to endDay (inclusive)
+    '''
+    def getDateValues(self, startDay, endDay):
+        closes = self.close[startDay:endDay + 1]
+        return OrderedDict(zip(xrange(startDay, startDay + len(closes)), closes.tolist()))
+
+    '''
+    Returns the number of market days between date and the most recent day, or 0 if date is not in the file
+    '''
+    def getDayOffset(self, date):
+        try:
+            matches = np.flatnonzero(self.date == np.datetime64(str(date), 'D'))
+        except ValueError:
+            return 0
+        if len(matches) == 0:
+            return 0
+        return int(matches[0])
+
+    def getTodaysDate(self):
+        return str(self.date[0])
+
+
+'''
+Gets the parsed PriceSeries of a CSV file, only reading the file again when it has changed on disk. Only the
+latest version of each file is kept, and only the priceSeriesCacheSize most recently used files
+@param filename - name of the CSV file
+@return series - PriceSeries of the file
+'''
+def getPriceSeries(filename):
+    key = os.path.abspath(filename)
+    fileStat = os.stat(key)
+    fileVersion = (fileStat.st_mtime, fileStat.st_size)
+    with priceSeriesCacheLock:
+        cached = priceSeriesCache.pop(key, None)
+        if cached is not None and cached[0] == fileVersion:
+            priceSeriesCache[key] = cached # now the most recently used
+            mt.count('csvCacheHits')
+            return cached[1]
+    with mt.timer('csvLoad'):
+        series = PriceSeries(key)
+    mt.count('csvRowsLoaded', len(series.close))
+    with priceSeriesCacheLock:
+        priceSeriesCache.pop(key, None)
+        priceSeriesCache[key] = (fileVersion, series)
+        while len(priceSeriesCache) > priceSeriesCacheSize:
+            priceSeriesCache.popitem(last=False)
+    return series
 
 
 '''
@@ -12,80 +91,289 @@ Reads CSV file and returns a dictionary of date:price (closing) pairs
 @return dateValuesDict - dictionary of date:value pairs extrapolated from the csv
 '''
 def getDataCsv(filename, startDay, endDay):
-    dateValues = OrderedDict({})
-    with open(filename, 'r') as csvfile:
-        csvFileReader = csv.reader(csvfile) 
-        next(csvFileReader) # skip first row because it's only column names
-        index = 0
-        while (index < startDay): # skip rows until index = startDay -1
-            next(csvFileReader)
-            index += 1
-        currDay = startDay
-        for row in csvFileReader:
-            dateValues[currDay] = float((row[4])) # append the price and convert to float to be more precise
-            if currDay == endDay:
-                break
-            currDay += 1
-        return dateValues
+    return getPriceSeries(filename).getDateValues(startDay, endDay)
 
 
 def getDayOffsetCsv(filename, date):
-    date = str(date)
-    with open(filename, 'r') as csvfile:
-        csvFileReader = csv.reader(csvfile) 
-        next(csvFileReader) # skip first row because it's only column names
-        index = 0
-        for row in csvFileReader:
-            if row[0] == date:
-                return index
-            index += 1
-        return 0;
+    return getPriceSeries(filename).getDayOffset(date)
 
 def getTodaysDateCsv(filename):
-    with open(filename, 'r') as csvfile:
-        csvFileReader = csv.reader(csvfile) 
-        next(csvFileReader) # skip first row because it's only column names
-        for row in csvFileReader:
-            return row[0]
+    return getPriceSeries(filename).getTodaysDate()
 '''
 Computes all contiguous subsets (length > 1) of a map by creating a list of keys from the passed in dict, getting
 all contiguous subsets of that list, and then iterating through each subset to map the keys back to
 it's values, and returning a list of dictionaries of all contiguous subsets based on those keys
 @param dateValuesDict - single dictionary of date:value pairs 
+@param strategy - SubsetStrategy choosing which subsets to make, None for all of them
 @return an array of dictionaries of all of the contiguous subsets based on the passed in keys
 '''
-def getAllContigSubsetsDict(dateValuesDict):
-    dayKeys = dateValuesDict.keys()
+def getAllContigSubsetsDict(dateValuesDict, strategy=None):
+    return [OrderedDict(zip(days.tolist(), values.tolist())) for days, values in ContigSubsets(dateValuesDict, strategy=strategy)]
+
+
+'''
+Subset strategies choose which contiguous subsets (start index, end index) of an n day series are predicted.
+Every strategy returns its subsets ordered by start, then by end, and never includes a subset shorter than
+minLength or longer than maxLength. The built in strategies are also prefix consistent: the subsets of the
+first m days are exactly the subsets of all n days that end within them, so predictions of a long window can
+be filtered down to a shorter one (see RegressionModel.filterPredictionsByWindow)
+'''
+class SubsetStrategy(object):
+    name = None
+
+    def __init__(self, minLength=2, maxLength=None):
+        self.minLength = max(int(minLength), 1)
+        self.maxLength = None if maxLength is None else int(maxLength)
+
+    def lengthBounds(self, length):
+        return self.minLength, length if self.maxLength is None else min(self.maxLength, length)
+
+    '''
+    Returns the start and end indexes (end inclusive) of every subset of a series of length days, as two
+    parallel arrays
+    '''
+    def indexArrays(self, length):
+        raise NotImplementedError
+
+    def parameters(self):
+        return {}
+
+    '''
+    Returns a JSON friendly dict that subsetStrategyFromDescription turns back into an equal strategy
+    '''
+    def describe(self):
+        description = {'name': self.name, 'minLength': self.minLength, 'maxLength': self.maxLength}
+        description.update(self.parameters())
+        return description
+
+    def __eq__(self, other):
+        return isinstance(other, SubsetStrategy) and self.describe() == other.describe()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__name__, ', '.join('%s=%r' % item for item in sorted(self.describe().items()) if item[0] != 'name'))
+
+
+'''
+Every (start, end) pair, O(n^2) subsets. This is what getAllContigSubsetsDict has always done
+'''
+class AllPairs(SubsetStrategy):
+    name = 'all'
+
+    def indexArrays(self, length):
+        minLength, maxLength = self.lengthBounds(length)
+        starts, ends = np.triu_indices(length, minLength - 1)
+        keep = (ends - starts) < maxLength
+        return starts[keep], ends[keep]
+
+
+'''
+Only the subsets that start on the most recent day (day 1 when the series starts there), O(n) subsets
+'''
+class AnchoredWindows(SubsetStrategy):
+    name = 'anchored'
+
+    def indexArrays(self, length):
+        minLength, maxLength = self.lengthBounds(length)
+        ends = np.arange(minLength - 1, maxLength, dtype=np.int64)
+        return np.zeros(len(ends), dtype=np.int64), ends
+
+
+'''
+Subsets of every start but only of lengths on a geometric ladder minLength, minLength*ratio, minLength*ratio^2,
+... (rounded), O(n log n) subsets
+@param ratio - growth of the length from one rung to the next, > 1
+'''
+class GeometricLadder(SubsetStrategy):
+    name = 'ladder'
+
+    def __init__(self, ratio=2.0, minLength=2, maxLength=None):
+        super(GeometricLadder, self).__init__(minLength, maxLength)
+        if ratio <= 1:
+            raise ValueError("Geometric ladder ratio must be > 1, got %s" % ratio)
+        self.ratio = float(ratio)
+
+    def parameters(self):
+        return {'ratio': self.ratio}
+
+    def lengths(self, length):
+        minLength, maxLength = self.lengthBounds(length)
+        if maxLength < minLength:
+            return np.zeros(0, dtype=np.int64)
+        rungs = int(np.log(maxLength + 1.0) / np.log(self.ratio)) + 2 # enough rungs to pass maxLength
+        lengths = np.unique(np.round(minLength * self.ratio ** np.arange(rungs)).astype(np.int64))
+        return lengths[lengths <= maxLength]
+
+    def indexArrays(self, length):
+        return startsByLengths(np.arange(length, dtype=np.int64), self.lengths(length), length)
+
+
+'''
+Subsets of every length but only starting on every stride-th day (the most recent day included), O(n^2/stride)
+subsets
+@param stride - number of days between two starts
+'''
+class StrideStarts(SubsetStrategy):
+    name = 'stride'
+
+    def __init__(self, stride=5, minLength=2, maxLength=None):
+        super(StrideStarts, self).__init__(minLength, maxLength)
+        if stride < 1:
+            raise ValueError("Stride must be at least 1, got %s" % stride)
+        self.stride = int(stride)
+
+    def parameters(self):
+        return {'stride': self.stride}
+
+    def indexArrays(self, length):
+        minLength, maxLength = self.lengthBounds(length)
+        return startsByLengths(np.arange(0, length, self.stride, dtype=np.int64), np.arange(minLength, maxLength + 1, dtype=np.int64), length)
+
+
+'''
+Pairs every start with every length that fits in the series, ordered by start, then by end
+'''
+def startsByLengths(starts, lengths, length):
+    starts, lengths = np.meshgrid(starts, lengths, indexing='ij')
+    fits = starts + lengths <= length
+    return starts[fits], starts[fits] + lengths[fits] - 1
+
+
+subsetStrategies = {'all': AllPairs, 'anchored': AnchoredWindows, 'ladder': GeometricLadder, 'stride': StrideStarts}
+subsetArguments = {'ladder': 'ratio', 'stride': 'stride'} # parameter set by the ":argument" of parseSubsetStrategy
+
+'''
+Rebuilds a strategy from SubsetStrategy.describe(), None gives AllPairs
+'''
+def subsetStrategyFromDescription(description):
+    if description is None:
+        return AllPairs()
+    parameters = dict((str(name), value) for name, value in description.items() if name != 'name')
+    if description['name'] not in subsetStrategies:
+        raise ValueError("Unknown subset strategy: %s" % description['name'])
+    return subsetStrategies[description['name']](**parameters)
+
+
+'''
+Parses a strategy from text like "all", "anchored", "ladder:1.5", "stride:5,min=3,max=60"
+'''
+def parseSubsetStrategy(text):
+    parts = text.split(',')
+    name, _, argument = parts[0].strip().partition(':')
+    if name not in subsetStrategies:
+        raise ValueError("Unknown subset strategy: %s (choose from %s)" % (name, ', '.join(sorted(subsetStrategies))))
+    parameters = {}
+    for part in parts[1:]:
+        key, _, value = part.strip().partition('=')
+        if key not in ('min', 'max'):
+            raise ValueError("Unknown option of subset strategy %s: %s (choose from min, max)" % (name, key))
+        parameters[{'min': 'minLength', 'max': 'maxLength'}[key]] = int(value)
+    if argument:
+        if name not in subsetArguments:
+            raise ValueError("Subset strategy %s takes no argument, got %s" % (name, argument))
+        parameters[subsetArguments[name]] = float(argument) if name == 'ladder' else int(argument)
+    return subsetStrategies[name](**parameters)
+
+
+'''
+Lazy sequence of the contiguous subsets of a date:value dict. The days and values are stored once in shared
+NumPy arrays and each subset is handed out as (days, values) views over them, so no subset is ever copied.
+Subsets are ordered like getAllContigSubsetsDict: by start day, then by end day
+@param dateValuesDict - single dictionary of date:value pairs
+@param minLength - shortest subset to include (2 matches getAllContigSubsetsDict)
+@param maxLength - longest subset to include, None for no limit
+@param strategy - SubsetStrategy choosing the subsets, None for AllPairs(minLength, maxLength)
+'''
+class ContigSubsets(object):
+
+    def __init__(self, dateValuesDict, minLength=2, maxLength=None, strategy=None):
+        self.days = np.array(dateValuesDict.keys(), dtype=np.int64)
+        self.values = np.array(dateValuesDict.values(), dtype=float)
+        self.strategy = strategy if strategy is not None else AllPairs(minLength, maxLength)
+        with mt.timer('subsets'):
+            self.starts, self.ends = self.strategy.indexArrays(len(self.days))
+        mt.count('subsetsGenerated', len(self.starts))
+
+    '''
+    ContigSubsets of a list of date:value dicts (i.e. from getAllContigSubsetsDict), one subset per dict in the
+    same order. The dicts must all be runs of consecutive days of one series, which is rebuilt from their union
+    '''
+    @classmethod
+    def fromDicts(cls, dateValueDicts):
+        series = {}
+        for dateValues in dateValueDicts:
+            series.update(dateValues)
+        subsets = cls.__new__(cls)
+        subsets.days = np.array(sorted(series), dtype=np.int64)
+        subsets.values = np.array([series[day] for day in subsets.days.tolist()], dtype=float)
+        subsets.strategy = None
+        starts, ends = [], []
+        for dateValues in dateValueDicts:
+            days = sorted(dateValues)
+            start, end = np.searchsorted(subsets.days, [days[0], days[-1]]).tolist()
+            if end - start + 1 != len(days):
+                raise ValueError("Subset of days %s to %s is not contiguous in the series" % (days[0], days[-1]))
+            if subsets.values[start:end + 1].tolist() != [float(dateValues[day]) for day in days]:
+                raise ValueError("Subsets have different prices for the same days within %s to %s" % (days[0], days[-1]))
+            starts.append(start)
+            ends.append(end)
+        subsets.starts = np.array(starts, dtype=np.int64)
+        subsets.ends = np.array(ends, dtype=np.int64)
+        return subsets
 
-    dayKeySubsets = getAllContigSubsetsList(dayKeys) # get list of contig subsets based on keys
-    sizeOfDayKeySubsets = len(dayKeySubsets) # get size of all subsets of key string
+    '''
+    ContigSubsets of only the subsets at the given positions (i.e. the ones still to be predicted), sharing the
+    days and values arrays
+    '''
+    def select(self, indexes):
+        subsets = self.__class__.__new__(self.__class__)
+        subsets.days = self.days
+        subsets.values = self.values
+        subsets.strategy = None
+        subsets.starts = self.starts[indexes]
+        subsets.ends = self.ends[indexes]
+        return subsets
 
-    currDayKeySubset = [] # ary of the current subset (i.e. [1,2,3,4])
-    currDaySubsetLength = 0; # length of the current subset (i.e. 3)
-    currDateValueDict = OrderedDict({}) # current date:value dictionary (i.e. {1:145, 2:147})
-    totalDateValues = [] # this will hold all of the contiguous date:value dicts in an array
+    def __len__(self):
+        return len(self.starts)
 
-    for i in xrange(sizeOfDayKeySubsets): # for each subset of keyStringSubsets
-        currDayKeySubset = dayKeySubsets[i]
-        currDayKeySubsetLength = len(dayKeySubsets[i])
-        if(currDayKeySubsetLength>1): # only worry about subsets that have length >1
-            currDateValueDict.clear() # clear current dictionary
-            # map each element of each list of contig subset keys back to it's values
-            for j in xrange(currDayKeySubsetLength):
-                currDateValueDict[int(currDayKeySubset[j])] = float(dateValuesDict[int(currDayKeySubset[j])])
-            # append the current subset dict into the total dict
-            totalDateValues.append(copy.deepcopy(currDateValueDict))
-    return totalDateValues
+    def __iter__(self):
+        for start, end in self.ranges():
+            yield self.days[start:end + 1], self.values[start:end + 1]
+
+    '''
+    Generates the (start, end) index pairs (end inclusive) of every subset
+    '''
+    def ranges(self):
+        return izip(self.starts.tolist(), self.ends.tolist())
+
+    '''
+    Generates the (start day, end day) dataset tuple of every subset, the keys used by predictAllPrices
+    '''
+    def datasets(self):
+        return izip(self.days[self.starts].tolist(), self.days[self.ends].tolist())
+
+    '''
+    Returns the start and end indexes of every subset as two parallel arrays, for vectorized model backends
+    '''
+    def indexArrays(self):
+        return self.starts, self.ends
 
 
 '''
 Returns a list of all contiguous subsets from a list. Works for any data type (integer, string, etc...)
 @param aList - list to create contiguous subsets with
+@param strategy - SubsetStrategy choosing the subsets, None for every subset (including length 1)
 For example, if aList = ['a','b','c'], then this will return:
 [['a'], ['a', 'b'], ['a', 'b', 'c'], ['b'], ['b', 'c'], ['c']]
 '''
-def getAllContigSubsetsList(alist):
+def getAllContigSubsetsList(alist, strategy=None):
     length = len(alist)
+    if strategy is not None:
+        starts, ends = strategy.indexArrays(length)
+        return [alist[i:j+1] for i, j in izip(starts.tolist(), ends.tolist())]
     subsets = [alist[i:j+1] for i in xrange(length) for j in xrange(i,length)] # generate all contiguous subsets of that keyString
     return subsets
 
@@ -97,6 +385,146 @@ def downloadCsvFile(ticker, startDate, endDate, source):
     elif (source == 'yahoo'):
         print("Yahoo is not set up yet!")
 
+'''
+Brings a ticker's CSV file up to date by downloading only the days after the newest stored date and merging
+them in front of the stored rows (the file is newest first). The merged file is written under a temporary
+name and renamed over the old one, so readers never see a half written file. A sidecar index of date:row
+offset (<filename>.idx) is kept alongside it, which gives the newest stored date without parsing the file
+@param ticker - stock ticker symbol
+@param endDate - last date to download (ISO string)
+@param source - 'google finance' or 'yahoo'
+@param filename - CSV file to sync, <ticker>.csv by default
+@param startDate - first date to download (ISO string) when there is no CSV file yet
+@return newBars - number of days added to the file
+'''
+def syncCsvFile(ticker, endDate, source, filename=None, startDate=None):
+    filename = filename or ticker + '.csv'
+    if not os.path.exists(filename):
+        if startDate is None:
+            startDate = (datetime.date(int(endDate[0:4]), int(endDate[5:7]), int(endDate[8:10])) - datetime.timedelta(days = 365)).isoformat()
+        quote = downloadQuote(ticker, startDate, endDate, source)
+        writeFileAtomically(filename, quote.to_csv())
+        writeCsvIndex(filename)
+        return len(quote.close)
+
+    lastDate = getLastSyncedDate(filename)
+    firstNewDate = (np.datetime64(lastDate, 'D') + 1).astype(datetime.date).isoformat()
+    if firstNewDate > endDate:
+        return 0
+    return mergeQuoteIntoCsv(filename, downloadQuote(ticker, firstNewDate, endDate, source))
+
+
+'''
+Adds the bars of a Quote that are newer than the newest stored date in front of a CSV file's rows, written
+atomically like syncCsvFile (i.e. for bars pushed to PredictionServer)
+@return newBars - number of days added to the file
+'''
+def mergeQuoteIntoCsv(filename, quote):
+    storedIndex = readCsvIndex(filename)
+    lastDate = getLastSyncedDate(filename, storedIndex)
+    newRows = [row for row in quote.to_csv().splitlines()[1:] if row.split(',')[0] > lastDate]
+    if not newRows:
+        return 0
+    with open(filename, 'rb') as csvfile:
+        header = csvfile.readline()
+        storedRows = csvfile.read()
+    writeFileAtomically(filename, header + '\n'.join(newRows) + '\n' + storedRows)
+    if storedIndex is None:
+        writeCsvIndex(filename)
+        return len(newRows)
+    # the stored rows only moved down by the length of the new ones, so the index is updated without reading the file
+    index = OrderedDict()
+    offset = len(header)
+    for row in newRows:
+        index[row.split(',', 1)[0]] = offset
+        offset += len(row) + 1
+    for date, storedOffset in storedIndex.items():
+        index[date] = storedOffset + offset - len(header)
+    writeCsvIndex(filename, index)
+    return len(newRows)
+
+
+'''
+Gets the newest date stored in a CSV file, from its sidecar index when that is up to date and from the parsed
+file otherwise
+@param index - the file's index if it was already read, as returned by readCsvIndex
+'''
+def getLastSyncedDate(filename, index=None):
+    index = index if index is not None else readCsvIndex(filename)
+    if index and qp.isoDatePattern.match(next(iter(index))):
+        return next(iter(index))
+    return getTodaysDateCsv(filename)
+
+
+'''
+Writes the sidecar index of a CSV file: a first line with the size and modification time of the CSV file it
+was made for, then one "date,offset" line per row, where offset is the byte offset of the row in the CSV file
+@param index - OrderedDict of date:offset, newest first, None to build it by reading the file
+'''
+def writeCsvIndex(filename, index=None):
+    if index is None:
+        index = OrderedDict()
+        with open(filename, 'rb') as csvfile:
+            offset = len(csvfile.readline()) # skip first row because it's only column names
+            for row in csvfile:
+                if row.strip():
+                    index[row.split(',', 1)[0].strip()] = offset
+                offset += len(row)
+    stat = os.stat(filename)
+    indexLines = ["csv,%d,%r" % (stat.st_size, stat.st_mtime)] + ["%s,%d" % (date, offset) for date, offset in index.items()]
+    writeFileAtomically(filename + '.idx', '\n'.join(indexLines) + '\n')
+
+
+'''
+Reads the sidecar index of a CSV file written by syncCsvFile or mergeQuoteIntoCsv
+@return index - OrderedDict of date (ISO string):byte offset of its row, newest first, or None when there is no
+index or the CSV file was changed after it was written
+'''
+def readCsvIndex(filename):
+    try:
+        with open(filename + '.idx', 'r') as indexFile:
+            lines = indexFile.read().splitlines()
+        stat = os.stat(filename)
+    except (IOError, OSError):
+        return None
+    if not lines or lines[0] != "csv,%d,%r" % (stat.st_size, stat.st_mtime):
+        return None
+    index = OrderedDict()
+    for line in lines[1:]:
+        if line.strip():
+            date, offset = line.strip().split(',')
+            index[date] = int(offset)
+    return index
+
+
+@mt.timed('download')
+def downloadQuote(ticker, startDate, endDate, source):
+    mt.count('downloads')
+    if (source == 'google finance'):
+        return GoogleQuote(ticker, startDate, endDate)
+    elif (source == 'yahoo'):
+        return YahooQuote(ticker, startDate, endDate)
+    raise ValueError("Unknown stock data source: %s" % source)
+
+
+def writeFileAtomically(filename, content):
+    tempFilename = filename + '.tmp'
+    with open(tempFilename, 'wb') as output:
+        output.write(content)
+    if os.name == 'nt' and os.path.exists(filename):
+        os.remove(filename) # os.rename does not replace existing files on Windows
+    os.rename(tempFilename, filename)
+
+
+'''
+Builds a Quote from columnar arrays (i.e. from QuoteParser.parseQuoteText), oldest bar first
+@param symbol - stock ticker symbol
+@param columns - dict of 'date', 'open', 'high', 'low', 'close' and 'volume' arrays
+@return quote - Quote with one bar per row of the arrays, sharing them where their dtypes already match
+'''
+def quoteFromColumns(symbol, columns):
+    return Quote.from_numpy(columns, symbol)
+
 '''
 gets a date:value dict based on dataset
 '''
@@ -106,53 +534,169 @@ def getDateValueCsv(dataset, dateOffset, filename):
 
 
 
+'''
+Daily bars of one symbol, stored column by column in NumPy arrays (oldest bar first). The arrays are allocated
+with spare room and doubled when full, so append and extend don't copy on every bar; date, open_, high, low,
+close and volume are views of the filled part of each array
+'''
 class Quote(object):
    
     DATE_FMT = '%Y-%m-%d'
     TIME_FMT = '%H:%M:%S'
+    COLUMNS = (('date','datetime64[D]'),('open','float64'),('high','float64'),('low','float64'),('close','float64'),('volume','int64'))
 
-    def __init__(self):
+    def __init__(self,capacity=256):
         self.symbol = ''
-        self.date,self.open_,self.high,self.low,self.close,self.volume = ([] for _ in range(6))
+        self.clear(capacity)
+
+    '''
+    Removes all bars, giving the Quote new arrays (so arrays handed out by to_numpy or taken by from_numpy are
+    left alone)
+    '''
+    def clear(self,capacity=256):
+        self.length = 0
+        self.columns = dict((name,np.empty(capacity,dtype=dtype)) for name,dtype in self.COLUMNS)
+
+    date = property(lambda self: self.columns['date'][:self.length])
+    open_ = property(lambda self: self.columns['open'][:self.length])
+    high = property(lambda self: self.columns['high'][:self.length])
+    low = property(lambda self: self.columns['low'][:self.length])
+    close = property(lambda self: self.columns['close'][:self.length])
+    volume = property(lambda self: self.columns['volume'][:self.length])
+
+    def __len__(self):
+        return self.length
+
+    '''
+    Makes room for at least capacity bars, at least doubling the arrays so appends stay amortized O(1)
+    '''
+    def reserve(self,capacity):
+        if capacity <= len(self.columns['close']):
+            return
+        capacity = max(capacity, 2 * len(self.columns['close']))
+        for name,dtype in self.COLUMNS:
+            column = np.empty(capacity,dtype=dtype)
+            column[:self.length] = self.columns[name][:self.length]
+            self.columns[name] = column
 
     def append(self,dt,open_,high,low,close,volume):
-        self.date.append(dt.date())
-        self.open_.append(float(open_))
-        self.high.append(float(high))
-        self.low.append(float(low))
-        self.close.append(float(close))
-        self.volume.append(int(volume))
+        self.reserve(self.length + 1)
+        bar = self.length
+        self.columns['date'][bar] = np.datetime64(dt.strftime(self.DATE_FMT),'D')
+        self.columns['open'][bar] = open_
+        self.columns['high'][bar] = high
+        self.columns['low'][bar] = low
+        self.columns['close'][bar] = close
+        self.columns['volume'][bar] = volume
+        self.length += 1
         # self.append('Date', 'Open', 'High', 'Low', 'Close', 'Volume')
 
+    '''
+    Appends many bars at once from columnar arrays (see QuoteParser.parseQuoteText), oldest bar first
+    '''
+    def extend(self,columns):
+        count = len(columns['close'])
+        self.reserve(self.length + count)
+        for name,dtype in self.COLUMNS:
+            self.columns[name][self.length:self.length + count] = columns[name]
+        self.length += count
+
+    '''
+    Returns the bars as a dict of column arrays, oldest first. The arrays are views of the Quote's own storage,
+    not copies
+    '''
+    def to_numpy(self):
+        return dict((name,self.columns[name][:self.length]) for name,dtype in self.COLUMNS)
+
+    '''
+    Wraps columnar arrays in a Quote without copying them when they already have the right dtypes. Appending to
+    the Quote afterwards moves it to new arrays, so the passed in arrays are never written to
+    @param columns - dict of 'date', 'open', 'high', 'low', 'close' and 'volume' arrays, oldest bar first
+    '''
+    @classmethod
+    def from_numpy(cls,columns,symbol=''):
+        quote = cls.__new__(cls)
+        quote.symbol = symbol.upper()
+        quote.columns = dict((name,np.asarray(columns[name],dtype=dtype)) for name,dtype in cls.COLUMNS)
+        quote.length = len(quote.columns['close'])
+        return quote
+
     def to_csv(self):
-        length = len(self.close)        
-        return "Date, Open, High, Low, Close, Volume\n" + ''.join(["{0},{1:.2f},{2:.2f},{3:.2f},{4:.2f},{5}\n".format(
-            self.date[length -1 - bar].strftime('%Y-%m-%d'),
-            self.open_[length -1 - bar],self.high[length -1 - bar],self.low[length -1 - bar],self.close[length -1 - bar],self.volume[length -1 - bar]) 
-            for bar in xrange(length)])
+        if self.length == 0:
+            return "Date, Open, High, Low, Close, Volume\n"
+        fields = [self.date[::-1].astype(str)] + [np.char.mod('%.2f',column[::-1]) for column in (self.open_,self.high,self.low,self.close)] \
+            + [self.volume[::-1].astype(str)]
+        rows = fields[0]
+        for field in fields[1:]:
+            rows = np.char.add(np.char.add(rows,','),field)
+        return "Date, Open, High, Low, Close, Volume\n" + '\n'.join(rows.tolist()) + '\n'
      
     def write_csv(self,filename):
         print("Saving latest stock data to file in CSV format.\n")
         with open(filename,'w') as f:
             f.write(self.to_csv())
-    '''  
+
     def read_csv(self,filename):
-        self.symbol = ''
-        self.date,self.open_,self.high,self.low,self.close,self.volume = ([] for _ in range(7))
-        for line in open(filename,'r'):
-            symbol,ds,ts,open_,high,low,close,volume = line.rstrip().split(',')
-            self.symbol = symbol
-            dt = datetime.datetime.strptime(ds+' '+ts,self.DATE_FMT+' '+self.TIME_FMT)
-            self.append(dt,open_,high,low,close,volume)
+        columns = qp.parseQuoteFile(filename) # any layout QuoteParser reads, i.e. orcl.csv's SYMBOL,date,time rows
+        self.clear(len(columns['close']))
+        if 'symbol' in columns and len(columns['symbol']):
+            self.symbol = str(columns['symbol'][-1])
+        self.extend(columns)
         return True
+
+    '''
+    Saves the bars as a NumPy .npy file of records, which read_binary can memory map back without parsing
     '''
+    def write_binary(self,filename):
+        records = np.empty(self.length,dtype=list(self.COLUMNS))
+        for name,dtype in self.COLUMNS:
+            records[name] = self.columns[name][:self.length]
+        with open(filename,'wb') as f:
+            np.save(f,records)
+
+    def read_binary(self,filename):
+        records = np.load(filename,mmap_mode='r')
+        self.clear(len(records))
+        self.extend(dict((name,records[name]) for name,dtype in self.COLUMNS))
+        return True
 
     def __repr__(self):
         return self.to_csv()
 
-''' Daily quotes from Yahoo. Date format='yyyy-mm-dd' '''
+'''
+Split and dividend adjustment of columnar quotes (see QuoteParser.parseQuoteText). The factor of every bar is
+adjClose/close, worked out for all bars in one array operation and applied to the open, high, low and close
+columns at once.
+    'back'    - history is scaled down to today's prices (Yahoo's adjusted close, the newest bar is unchanged)
+    'forward' - later bars are scaled up from the oldest bar's prices (the oldest bar is unchanged)
+    None      - prices are left as traded
+@param columns - dict of column arrays, oldest bar first, with an 'adjClose' column if adjustment is wanted
+@param mode - 'back', 'forward' or None
+@return adjusted - copy of columns with adjusted prices, the unadjusted prices as 'rawOpen', 'rawHigh',
+'rawLow' and 'rawClose', and the factor applied to each bar as 'adjFactor'
+'''
+def adjustPrices(columns, mode='back'):
+    if mode not in ('back', 'forward', None):
+        raise ValueError("Unknown price adjustment: %s" % mode)
+    close = columns['close']
+    factor = np.ones(len(close))
+    if mode is not None and 'adjClose' in columns and len(close):
+        valid = np.isfinite(columns['adjClose']) & np.isfinite(close) & (close != 0)
+        np.divide(columns['adjClose'], close, out=factor, where=valid)
+        if mode == 'forward':
+            factor /= factor[0]
+    adjusted = dict(columns)
+    for name, rawName in (('open', 'rawOpen'), ('high', 'rawHigh'), ('low', 'rawLow'), ('close', 'rawClose')):
+        adjusted[rawName] = columns[name]
+        adjusted[name] = columns[name] * factor
+    adjusted['adjFactor'] = factor
+    return adjusted
+
+
+''' Daily quotes from Yahoo. Date format='yyyy-mm-dd'
+    adjust - 'back' (default), 'forward' or None, see adjustPrices. The unadjusted prices are kept in raw '''
 class YahooQuote(Quote):
-    def __init__(self,symbol,start_date,end_date=datetime.date.today().isoformat()):
+    def __init__(self,symbol,start_date,end_date=datetime.date.today().isoformat(),adjust='back'):
         super(YahooQuote,self).__init__()
         self.symbol = symbol.upper()
         start_year,start_month,start_day = start_date.split('-')
@@ -162,16 +706,9 @@ class YahooQuote(Quote):
         url_string = "http://ichart.finance.yahoo.com/table.csv?s={0}".format(symbol)
         url_string += "&a={0}&b={1}&c={2}".format(start_month,start_day,start_year)
         url_string += "&d={0}&e={1}&f={2}".format(end_month,end_day,end_year)
-        csv = urllib.urlopen(url_string).readlines()
-        csv.reverse()
-        for bar in xrange(0,len(csv)-1):
-            ds,open_,high,low,close,volume,adjc = csv[bar].rstrip().split(',')
-            open_,high,low,close,adjc = [float(x) for x in [open_,high,low,close,adjc]]
-            if close != adjc:
-                factor = adjc/close
-                open_,high,low,close = [x*factor for x in [open_,high,low,close]]
-            dt = datetime.datetime.strptime(ds,'%Y-%m-%d')
-            self.append(dt,open_,high,low,close,volume)
+        columns = adjustPrices(qp.parseQuoteText(urllib.urlopen(url_string).read()),adjust)
+        self.raw = dict((name,columns[name]) for name in ('rawOpen','rawHigh','rawLow','rawClose','adjFactor'))
+        self.extend(columns)
 
 
 # Sample code to test getting a Yahoo Quote
@@ -197,10 +734,4 @@ class GoogleQuote(Quote):
         url_string = "http://www.google.com/finance/historical?q={0}".format(self.symbol)
         url_string += "&startdate={0}&enddate={1}&output=csv".format(
               start.strftime('%b %d, %Y'),end.strftime('%b %d, %Y'))
-        csv = urllib.urlopen(url_string).readlines()
-        csv.reverse()
-        for bar in xrange(0,len(csv)-1):
-            ds,open_,high,low,close,volume = csv[bar].rstrip().split(',')
-            open_,high,low,close = [float(x) for x in [open_,high,low,close]]
-            dt = datetime.datetime.strptime(ds,'%d-%b-%y')
-            self.append(dt,open_,high,low,close,volume)
\ No newline at end of file
+        self.extend(qp.parseQuoteText(urllib.urlopen(url_string).read()))
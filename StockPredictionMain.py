@@ -1,6 +1,13 @@
+import sys
+if '--profile-startup' in sys.argv: # installed before the other imports so they are timed too
+	import ImportProfiler
+	ImportProfiler.install()
+import argparse
 import RegressionModel as rm
 import StockData as sd
 import TreeTraversal as tt
+import PredictionCache as pc
+import Metrics as mt
 import urllib, time, datetime
 from datetime import timedelta
 from collections import OrderedDict
@@ -11,16 +18,22 @@ from peak.rules import abstract, when, around, before, after
 daysInThePast = 30 # number of days in the past to obtain stock data for
 dayInFutureToPredict = 1 # day to predict; 0 = today, 1 = tomorrow, -1 = yesterday, etc. 
 dayTodayToPredict = 0
-regressionModelType = 'linear'
+regressionModelType = 'linear' # 'linear' or 'rbf' (SVR per subset), 'ols'/'fast-linear' (closed form) or 'poly2'/'poly3'/'ridge'/'rbf-approx' (batched, all subsets at once)
+modelOptions = {} # settings overriding rm.modelParameters of the model type, i.e. {'numOfFeatures': 50, 'seed': 7} for 'rbf-approx'
 stockDataSource = 'google finance'
 stockToPredict = 'AAPL' # predicting apple stock
 csvFilename = stockToPredict + '.csv'
 dataFilename = stockToPredict + '.plk'
 acceptedTolerance = 0.5
 testingDate = 10
-passTest = 0
 numRules = 3 # number of rules in the rule-based
 numOfChildren = 3 # number of children for each ndoe to build trees with
+numOfWorkers = 1 # number of processes to fit subsets with for models that have no closed form (i.e. rbf)
+ruleWindows = (10, 20, 30) # days in the past used by rule 1, 2 and 3
+subsetStrategy = sd.AllPairs() # subsets to predict: sd.AllPairs(), sd.AnchoredWindows(), sd.GeometricLadder(ratio) or sd.StrideStarts(stride)
+predictionCacheDirectory = None # where subset predictions are cached between runs (i.e. '.predictioncache'), None to not cache
+predictionCacheMaxMb = 256
+predictionCache = None # PredictionCache made by main from the two settings above
 
 ########################################################################
 
@@ -44,34 +57,28 @@ def betterPrediction(try1, try2, try3):
 def betterPrediction(try1, try2, try3):
 	'''Rule 1 is using the subset of data of 10 previous date'''
 	print("Rule 1 Fire")
-	return processDataWithLatestTree(10)
+	return processDataWithSharedTree(ruleWindows[0])
 
 @when(betterPrediction, "try1 == True and try2 == True and try3 == False")
 def betterPrediction(try1, try2, try3):
 	'''Rule 1 is using the subset of data of 20 previous date'''
 	print("Rule 2 Fire")
-	return processDataWithLatestTree(20)
+	return processDataWithSharedTree(ruleWindows[1])
 
 @when(betterPrediction, "try1 == True and try2 == True and try3 == True")
 def betterPrediction(try1, try2, try3):
 	'''Rule 1 is using the subset of data of 30 previous date'''
 	print("Rule 3 Fire")
-	return processDataWithLatestTree(30)
+	return processDataWithSharedTree(ruleWindows[2])
 
 def processDataWithLatestTree(dayToSubset):
 	daysInThePast = dayToSubset
 	todaysDateValue = sd.getDataCsv(csvFilename, 0, 0)
 	todaysPrice = float(todaysDateValue.get(0))
 	dateValues = sd.getDataCsv(csvFilename, 1, daysInThePast)
-	dateValueSubsets = sd.getAllContigSubsetsDict(dateValues)
-	predictedDateValueSubsets = rm.predictAllPrices(dateValueSubsets, dayTodayToPredict, regressionModelType)
-	rootNode = tt.createTree(3, predictedDateValueSubsets)
-	foundNode = tt.breadthFirstSearch(rootNode, todaysPrice)
-	foundPrice = foundNode.value
-	foundDataset = foundNode.dataset
-	todaysDifference = float(rm.getPriceDifference(foundPrice, todaysPrice))
-
-	return todaysDifference, foundPrice, foundDataset, rootNode, foundNode
+	dateValueSubsets = sd.ContigSubsets(dateValues, strategy=subsetStrategy)
+	predictedDateValueSubsets = rm.predictAllPrices(dateValueSubsets, dayTodayToPredict, regressionModelType, numOfWorkers, predictionCache, **modelOptions)
+	return searchPredictions(predictedDateValueSubsets, todaysPrice, tt.PredictionIndex(predictedDateValueSubsets))
 
 #	print("Today's stock price: $%.2f" % todaysPrice)
 #	print("Today's predicted stock price: $%.2f" % foundPrice)
@@ -86,170 +93,335 @@ def processDataWithLatestTree(dayToSubset):
 #	tt.writeTreeToFile(rootNode, foundNode, sd.getTodaysDateCsv(csvFilename), dataFilename)
 
 
+'''
+Rolls a stored closed form linear tree forward to today instead of recomputing every subset. Only the subsets
+that include a day newer than the stored tree are fitted
+@param rootNode - root node of the stored tree, with the fitted lines of its subsets
+@param dayOffSet - number of market days passed since the tree was stored
+'''
+def processDataWithRolledTree(rootNode, dayOffSet):
+	tree = rootNode.tree
+	todaysDateValue = sd.getDataCsv(csvFilename, 0, 0)
+	todaysPrice = float(todaysDateValue.get(0))
+	dateValues = sd.getDataCsv(csvFilename, 1, int(tree.datasets[:, 1].max()))
+	predictedDateValueSubsets = rm.rollLinearPredictions(tree.datasets, tree.slopes, tree.intercepts, dateValues, dayOffSet, dayTodayToPredict, subsetStrategy)
+	return searchPredictions(predictedDateValueSubsets, todaysPrice, tt.PredictionIndex(predictedDateValueSubsets))
 
-# todaysDate = datetime.date.today().isoformat()
-todaysDate = datetime.date.today()
-testingDateSpan = timedelta(1)
-
-for i in range(testingDate):
-	print("\n****************************************")
-	print("Stock Prediction Application initiated.")
-	print("****************************************\n")
-	print("Today's date: %s" % todaysDate)
-	print("Stock ticker symbol: %s" % stockToPredict)
-	print("Source of stock data: %s" % stockDataSource)
-	print("Using stock data from the past %d days" % daysInThePast)
-	print("Predicting stock price %s day(s) in the future" % dayInFutureToPredict)
-	print("Regression model type: %s" % regressionModelType)
-	print("Accepted tolerance for predictions: $%.2f" % acceptedTolerance)
-	print("")
-
-	isFatal = 0
-	isLatestCsv = 0
-	isExistingCsv = 0
-	isExistingNode = 0
-
-
-	try: # get latest CSV and download to File
-		# print(alfjasldkfhj)
-		sd.downloadCsvFile(stockToPredict, (todaysDate + timedelta(days = -365)).isoformat(), todaysDate.isoformat(), stockDataSource)
-		# sd.downloadCsvFile(stockToPredict, (todaysDate + timedelta(days = -365)).isoformat(), (todaysDate + timedelta(days = -8)).isoformat(), stockDataSource)
-		isLatestCsv = 1
-		try: # see if we can get any saved Node data
-			# print(adsfasdf)
-			retrievedData = tt.readTreeFromFile(dataFilename)
-			print("*** Saved node data found from latest closing date %s. Initiating agent to compute prediction based on existing tree to see if it is still within tolerance. Please wait... ***\n" % retrievedData[2])
-			isExistingNode = 1
-		except:
-			print("*** No saved Node data found. Initiating agent to calculate optimal subset to use for predicting tomorrow's price. Please wait... ***\n")
-	except: # could not get latest CSV and download to File
-		try: # get current CSV
-			
-			todaysDateValue = sd.getDataCsv(csvFilename, 0, 0)
-			print("\n**********************************************")
-			print("WARNING: Unable to download latest CSV File. This is most likely due to an internet connectivity issue. Now using most recent  CSV from %s as backup. However, we won't be able to compare against today's price and will have to use outdated data which can cause inaccurate predictions!" % sd.getTodaysDateCsv(csvFilename))
-			print("**********************************************\n")
-			isExistingCsv = 1
-		except: # no current CSV
-			try: # get current Node Data
-				# print(asdfasd)
-				retrievedData = tt.readTreeFromFile(dataFilename)
-				print("\n*********************************************")
-				print("WARNING: Unable to download latest CSV File and no saved CSV found. Now using most recent stored Node data from %s for predicitons. However, we won't be able to compare against today's price and will have to use outdated data which can cause inaccurate predictions!" % retrievedData[2])
-				print("**********************************************\n")
-				isExistingNode = 1
-			except: # cannot get any CSV or any Node Data = FATAL
-				print("\n**********************************************")
-				print("FATAL: Unable to download latest CSV File and there is no saved CSV file or Node Data! Impossible to make any predictions. Exiting...")
-				print("**********************************************\n")
-				isFatal = 1
-
-
-
+'''
+Same as processDataWithLatestTree, but the subset predictions are shared between the rules. Only the window a
+rule needs is predicted, and a later rule with a larger window only fits the subsets that end after the
+smaller window's, so escalating through all the rules costs one computation of the largest window in total.
+The sorted index of the shared predictions is built once with them, and each rule searches it restricted to
+its own window
+@param dayToSubset - number of days in the past to use
+'''
+def processDataWithSharedTree(dayToSubset):
+	todaysDateValue = sd.getDataCsv(csvFilename, 0, 0)
+	todaysPrice = float(todaysDateValue.get(0))
+	predictions, index = getSharedPredictions(dayToSubset)
+	predictedDateValueSubsets = rm.filterPredictionsByWindow(predictions, dayToSubset)
+	return searchPredictions(predictedDateValueSubsets, todaysPrice, index.restrict(dayToSubset))
 
-	if (isFatal == 1):
-		print("Fatal Error: Cannot download the CSV file. Check your Internet connection")
-	elif (isLatestCsv == 1):
-		if (isExistingNode == 1):
-			rules_based = Rule_Based(numRules)
+sharedPredictions = {} # (window, predictions, index) of the largest window asked for so far, keyed by what they were computed from
 
-			todaysDateValue = sd.getDataCsv(csvFilename, 0, 0)
-			todaysPrice = float(todaysDateValue.get(0))
-			rootNode = retrievedData[0]
-			foundNode = retrievedData[1]
-			dateOfWrite = retrievedData[2]
-			# testDate = todaysDate + timedelta(days = -5)
-			dayOffSet = sd.getDayOffsetCsv(csvFilename, dateOfWrite)
-			print("There are %d market day(s) passed between when the node data was stored and today." % dayOffSet)
-			foundPrice = foundNode.value
-			foundDataset = foundNode.dataset
-			print("found dataset: %s" % str(foundDataset))
-			print("found price: $%.2f" % foundPrice)
+'''
+Gets the predictions of at least the subsets of days 1..dayToSubset, extending the shared ones if they were
+made for a smaller window
+@return predictions, index - the predictions and their TreeTraversal.PredictionIndex
+'''
+def getSharedPredictions(dayToSubset):
+	sharedKey = (csvFilename, sd.getPriceSeries(csvFilename).sourceHash, dayTodayToPredict, regressionModelType, repr(sorted(modelOptions.items())), repr(subsetStrategy))
+	window, predictions, index = sharedPredictions.get(sharedKey, (0, None, None))
+	if window < dayToSubset:
+		sharedPredictions.clear()
+		subsets = sd.ContigSubsets(sd.getDataCsv(csvFilename, 1, dayToSubset), strategy=subsetStrategy)
+		if predictions is None:
+			predictions = rm.predictAllPrices(subsets, dayTodayToPredict, regressionModelType, numOfWorkers, predictionCache, **modelOptions)
+		else:
+			predictions = rm.extendPredictionsWindow(predictions, window, subsets, dayTodayToPredict, regressionModelType, numOfWorkers, predictionCache, **modelOptions)
+		index = tt.PredictionIndex(predictions)
+		sharedPredictions[sharedKey] = (dayToSubset, predictions, index)
+	return predictions, index
 
+'''
+Builds the tree of subset predictions and finds the subset whose prediction is closest to today's price
+@param index - TreeTraversal.PredictionIndex of the predictions, built once for each set of predictions
+@return todaysDifference, foundPrice, foundDataset, rootNode, foundNode
+'''
+def searchPredictions(predictedDateValueSubsets, todaysPrice, index):
+	rootNode = tt.createTree(3, predictedDateValueSubsets, subsetStrategy)
+	foundNode = index.nearest(todaysPrice)
+	print("Optimal node value: %.2f dataset: %s\n" % (foundNode.value, foundNode.dataset))
+	foundPrice = foundNode.value
+	foundDataset = foundNode.dataset
+	todaysDifference = float(rm.getPriceDifference(foundPrice, todaysPrice))
 
+	return todaysDifference, foundPrice, foundDataset, rootNode, foundNode
 
-			adjustedFoundDataset = foundDataset[0]+dayOffSet, foundDataset[1]+dayOffSet
-			adjustedFoundDateValues = OrderedDict(sd.getDateValueCsv(adjustedFoundDataset, 0, csvFilename))
-			adjustedFoundPrice = rm.predictPrice(adjustedFoundDateValues, dayTodayToPredict, regressionModelType, 0, 0)
-			print("adjusted found dataset: %s" % str(adjustedFoundDataset))
-			todaysDifference = float(rm.getPriceDifference(adjustedFoundPrice, todaysPrice))
-			print("Today's stock price: $%.2f" % todaysPrice)
-			print("Today's adjusted predicted stock price: $%.2f" % adjustedFoundPrice)
-			print("Difference between predicted and real price for today: $%.2f" % todaysDifference)
-			print("Prediction accuracy: %.3f%%\n" % (100.00*(todaysPrice - abs(todaysDifference))/todaysPrice))
+def canRollTree(rootNode, dayOffSet):
+	return (regressionModelType in rm.olsModelTypes and dayOffSet > 0 and isinstance(rootNode, tt.ArrayNode)
+		and rootNode.tree.slopes is not None)
 
-			lastChoice = False
 
-			if (todaysDifference > acceptedTolerance):
-				print("*** The difference between today's actual price and the predicted price for today is %.2f, which is greater than the accepted tolerance of %.2f. Agent is now initiated to re-process, store and search computed data for a more accurate dataset. Please wait... ***\n" % (todaysDifference, acceptedTolerance))
-	#			processDataWithLatestTree()
+'''
+Runs the agent for today and each of the testingDate - 1 market days before it, and prints how many days its
+prediction for the day was within acceptedTolerance
+'''
+def runPredictions():
+	# todaysDate = datetime.date.today().isoformat()
+	todaysDate = datetime.date.today()
+	testingDateSpan = timedelta(1)
+	passTest = 0
+	rules_based = Rule_Based(numRules)
+
+	for i in range(testingDate):
+		print("\n****************************************")
+		print("Stock Prediction Application initiated.")
+		print("****************************************\n")
+		print("Today's date: %s" % todaysDate)
+		print("Stock ticker symbol: %s" % stockToPredict)
+		print("Source of stock data: %s" % stockDataSource)
+		print("Using stock data from the past %d days" % daysInThePast)
+		print("Predicting stock price %s day(s) in the future" % dayInFutureToPredict)
+		print("Regression model type: %s" % regressionModelType)
+		print("Accepted tolerance for predictions: $%.2f" % acceptedTolerance)
+		print("")
+
+		isFatal = 0
+		isLatestCsv = 0
+		isExistingCsv = 0
+		isExistingNode = 0
+
+
+		try: # get latest CSV and download to File
+			# print(alfjasldkfhj)
+			if (todaysDate == datetime.date.today()): # only download the days missing from the saved CSV
+				newBars = sd.syncCsvFile(stockToPredict, todaysDate.isoformat(), stockDataSource, csvFilename, (todaysDate + timedelta(days = -365)).isoformat())
+				print("Downloaded %d new day(s) of stock data." % newBars)
+			else: # testing an earlier day, so the CSV has to end on that day
+				sd.downloadCsvFile(stockToPredict, (todaysDate + timedelta(days = -365)).isoformat(), todaysDate.isoformat(), stockDataSource)
+			# sd.downloadCsvFile(stockToPredict, (todaysDate + timedelta(days = -365)).isoformat(), (todaysDate + timedelta(days = -8)).isoformat(), stockDataSource)
+			isLatestCsv = 1
+			try: # see if we can get any saved Node data
+				# print(adsfasdf)
+				retrievedData = tt.readTreeFromFile(dataFilename)
+				print("*** Saved node data found from latest closing date %s. Initiating agent to compute prediction based on existing tree to see if it is still within tolerance. Please wait... ***\n" % retrievedData[2])
+				isExistingNode = 1
+			except:
+				print("*** No saved Node data found. Initiating agent to calculate optimal subset to use for predicting tomorrow's price. Please wait... ***\n")
+		except: # could not get latest CSV and download to File
+			try: # get current CSV
+			
+				todaysDateValue = sd.getDataCsv(csvFilename, 0, 0)
+				print("\n**********************************************")
+				print("WARNING: Unable to download latest CSV File. This is most likely due to an internet connectivity issue. Now using most recent  CSV from %s as backup. However, we won't be able to compare against today's price and will have to use outdated data which can cause inaccurate predictions!" % sd.getTodaysDateCsv(csvFilename))
+				print("**********************************************\n")
+				isExistingCsv = 1
+			except: # no current CSV
+				try: # get current Node Data
+					# print(asdfasd)
+					retrievedData = tt.readTreeFromFile(dataFilename)
+					print("\n*********************************************")
+					print("WARNING: Unable to download latest CSV File and no saved CSV found. Now using most recent stored Node data from %s for predicitons. However, we won't be able to compare against today's price and will have to use outdated data which can cause inaccurate predictions!" % retrievedData[2])
+					print("**********************************************\n")
+					isExistingNode = 1
+				except: # cannot get any CSV or any Node Data = FATAL
+					print("\n**********************************************")
+					print("FATAL: Unable to download latest CSV File and there is no saved CSV file or Node Data! Impossible to make any predictions. Exiting...")
+					print("**********************************************\n")
+					isFatal = 1
+
+
+
+
+		if (isFatal == 1):
+			print("Fatal Error: Cannot download the CSV file. Check your Internet connection")
+		elif (isLatestCsv == 1):
+			if (isExistingNode == 1):
+				rules_based = Rule_Based(numRules)
+
+				todaysDateValue = sd.getDataCsv(csvFilename, 0, 0)
+				todaysPrice = float(todaysDateValue.get(0))
+				rootNode = retrievedData[0]
+				foundNode = retrievedData[1]
+				dateOfWrite = retrievedData[2]
+				# testDate = todaysDate + timedelta(days = -5)
+				dayOffSet = sd.getDayOffsetCsv(csvFilename, dateOfWrite)
+				print("There are %d market day(s) passed between when the node data was stored and today." % dayOffSet)
+				foundPrice = foundNode.value
+				foundDataset = foundNode.dataset
+				print("found dataset: %s" % str(foundDataset))
+				print("found price: $%.2f" % foundPrice)
+
+
+
+				adjustedFoundDataset = foundDataset[0]+dayOffSet, foundDataset[1]+dayOffSet
+				adjustedFoundDateValues = OrderedDict(sd.getDateValueCsv(adjustedFoundDataset, 0, csvFilename))
+				# today's and tomorrow's prices from one fit of the found subset
+				adjustedFoundPrice, adjustedTomorrowsPrice = rm.predictPrice(adjustedFoundDateValues, [dayTodayToPredict, dayInFutureToPredict], regressionModelType, 0, 0, **modelOptions)
+				print("adjusted found dataset: %s" % str(adjustedFoundDataset))
+				todaysDifference = float(rm.getPriceDifference(adjustedFoundPrice, todaysPrice))
+				print("Today's stock price: $%.2f" % todaysPrice)
+				print("Today's adjusted predicted stock price: $%.2f" % adjustedFoundPrice)
+				print("Difference between predicted and real price for today: $%.2f" % todaysDifference)
+				print("Prediction accuracy: %.3f%%\n" % (100.00*(todaysPrice - abs(todaysDifference))/todaysPrice))
+
+				lastChoice = False
+
+				if (todaysDifference > acceptedTolerance):
+					print("*** The difference between today's actual price and the predicted price for today is %.2f, which is greater than the accepted tolerance of %.2f. Agent is now initiated to re-process, store and search computed data for a more accurate dataset. Please wait... ***\n" % (todaysDifference, acceptedTolerance))
+		#			processDataWithLatestTree()
 				
-				tempTodaysDifference = todaysDifference
-				foundPrice = 0
-				foundDataset = 0
-				rootNode = 0
-				foundNode = 0
-				try_num = 0
-
-				while (tempTodaysDifference > acceptedTolerance and try_num < 3):
-					tempTodaysDifference, foundPrice, foundDataset, rootNode, foundNode = rules_based.tryRule(try_num)
-					try_num += 1
-
-				if (tempTodaysDifference > acceptedTolerance):
-					lastChoice = True
-				else:
-					passTest += 1
-					print("Today's stock price: $%.2f" % todaysPrice)
-					print("Today's predicted stock price: $%.2f" % foundPrice)
-					print("Difference between predicted and real price for today: $%.2f" % tempTodaysDifference)
-					print("Prediction accuracy: %.3f%%\n" % (100.00*(todaysPrice - tempTodaysDifference)/todaysPrice))
-					foundDateValues = sd.getDateValueCsv(foundDataset, 0, csvFilename)
-					tomorrowsPrice = rm.predictPrice(foundDateValues, dayInFutureToPredict, regressionModelType, 0, todaysPrice)
+					tempTodaysDifference = todaysDifference
+					foundPrice = 0
+					foundDataset = 0
+					rootNode = 0
+					foundNode = 0
+					try_num = 0
+
+					if canRollTree(retrievedData[0], dayOffSet):
+						print("*** Rolling the stored subsets forward %d market day(s) before trying the rules. ***\n" % dayOffSet)
+						tempTodaysDifference, foundPrice, foundDataset, rootNode, foundNode = processDataWithRolledTree(retrievedData[0], dayOffSet)
+
+					while (tempTodaysDifference > acceptedTolerance and try_num < 3):
+						tempTodaysDifference, foundPrice, foundDataset, rootNode, foundNode = rules_based.tryRule(try_num)
+						try_num += 1
+
+					if (tempTodaysDifference > acceptedTolerance):
+						lastChoice = True
+					else:
+						passTest += 1
+						print("Today's stock price: $%.2f" % todaysPrice)
+						print("Today's predicted stock price: $%.2f" % foundPrice)
+						print("Difference between predicted and real price for today: $%.2f" % tempTodaysDifference)
+						print("Prediction accuracy: %.3f%%\n" % (100.00*(todaysPrice - tempTodaysDifference)/todaysPrice))
+						foundDateValues = sd.getDateValueCsv(foundDataset, 0, csvFilename)
+						tomorrowsPrice = rm.predictPrice(foundDateValues, dayInFutureToPredict, regressionModelType, 0, todaysPrice, **modelOptions)
+						print("Tomorrow's predicted price: $%.2f" % tomorrowsPrice)
+						tomorrowsGainLoss = float(tomorrowsPrice - todaysPrice)
+						print("Predicted gain/loss for tomorrow: $%.2f" % tomorrowsGainLoss)
+						print(sd.getTodaysDateCsv(csvFilename))
+						tt.writeTreeToFile(rootNode, foundNode, sd.getTodaysDateCsv(csvFilename), dataFilename, stockToPredict, regressionModelType, sd.getPriceSeries(csvFilename).sourceHash)
+
+				if (todaysDifference <= acceptedTolerance or lastChoice):
+					if(todaysDifference <= acceptedTolerance):
+						passTest += 1
+					print("*** The difference between today's actual price and the predicted price for today is %.2f, which is less than the accepted tolerance of %.2f. Agent will reuse the same contiguous dataset from %s to predict tomorrow's price. ***\n" % (todaysDifference, acceptedTolerance, retrievedData[2]))
+					tomorrowsPrice = adjustedTomorrowsPrice
 					print("Tomorrow's predicted price: $%.2f" % tomorrowsPrice)
 					tomorrowsGainLoss = float(tomorrowsPrice - todaysPrice)
 					print("Predicted gain/loss for tomorrow: $%.2f" % tomorrowsGainLoss)
-					print(sd.getTodaysDateCsv(csvFilename))
-					tt.writeTreeToFile(rootNode, foundNode, sd.getTodaysDateCsv(csvFilename), dataFilename)
-
-			if (todaysDifference <= acceptedTolerance or lastChoice):
-				if(todaysDifference <= acceptedTolerance):
-					passTest += 1
-				print("*** The difference between today's actual price and the predicted price for today is %.2f, which is less than the accepted tolerance of %.2f. Agent will reuse the same contiguous dataset from %s to predict tomorrow's price. ***\n" % (todaysDifference, acceptedTolerance, retrievedData[2]))
-				tomorrowsPrice = rm.predictPrice(adjustedFoundDateValues, dayInFutureToPredict, regressionModelType, 0, todaysPrice)
+
+					# testDate = todaysDate + timedelta(days = -10)
+					# print("test date: %s" % testDate)
+					# print("*** %d" % sd.getDayCsv(csvFilename, testDate))
+
+			else: # no existing node data
+				todaysPrice = float(sd.getDataCsv(csvFilename, 0, 0).get(0))
+				tempTodaysDifference, foundPrice, foundDataset, rootNode, foundNode = processDataWithLatestTree(5)
+				print("Today's stock price: $%.2f" % todaysPrice)
+				print("Today's predicted stock price: $%.2f" % foundPrice)
+				print("Difference between predicted and real price for today: $%.2f" % tempTodaysDifference)
+				print("Prediction accuracy: %.3f%%\n" % (100.00*(todaysPrice - tempTodaysDifference)/todaysPrice))
+				foundDateValues = sd.getDateValueCsv(foundDataset, 0, csvFilename)
+				tomorrowsPrice = rm.predictPrice(foundDateValues, dayInFutureToPredict, regressionModelType, 0, todaysPrice, **modelOptions)
 				print("Tomorrow's predicted price: $%.2f" % tomorrowsPrice)
 				tomorrowsGainLoss = float(tomorrowsPrice - todaysPrice)
 				print("Predicted gain/loss for tomorrow: $%.2f" % tomorrowsGainLoss)
+				print(sd.getTodaysDateCsv(csvFilename))
+				tt.writeTreeToFile(rootNode, foundNode, sd.getTodaysDateCsv(csvFilename), dataFilename, stockToPredict, regressionModelType, sd.getPriceSeries(csvFilename).sourceHash)
+
+		else:
+			print("ERROR: no conditions satisified")
+
+		todaysDate = todaysDate - testingDateSpan
+		rules_based.reset()
+
+	#Perfomance metric
+	print("---------*--------")
+	print("Testing Result:")
+	print("Number of testing days from today: %.d" % testingDate)
+	print("Number of pass test: %.d" % passTest)
+	print("Percentage of performance: %.2f%%" % (float(passTest) / float(testingDate) * 100))
+	if predictionCache is not None:
+		predictionCache.printStats()
+
 
-				# testDate = todaysDate + timedelta(days = -10)
-				# print("test date: %s" % testDate)
-				# print("*** %d" % sd.getDayCsv(csvFilename, testDate))
-
-		else: # no existing node data
-			tempTodaysDifference, foundPrice, foundDataset, rootNode, foundNode = processDataWithLatestTree(5)
-			print("Today's stock price: $%.2f" % todaysPrice)
-			print("Today's predicted stock price: $%.2f" % foundPrice)
-			print("Difference between predicted and real price for today: $%.2f" % tempTodaysDifference)
-			print("Prediction accuracy: %.3f%%\n" % (100.00*(todaysPrice - tempTodaysDifference)/todaysPrice))
-			foundDateValues = sd.getDateValueCsv(foundDataset, 0, csvFilename)
-			tomorrowsPrice = rm.predictPrice(foundDateValues, dayInFutureToPredict, regressionModelType, 0, todaysPrice)
-			print("Tomorrow's predicted price: $%.2f" % tomorrowsPrice)
-			tomorrowsGainLoss = float(tomorrowsPrice - todaysPrice)
-			print("Predicted gain/loss for tomorrow: $%.2f" % tomorrowsGainLoss)
-			print(sd.getTodaysDateCsv(csvFilename))
-			tt.writeTreeToFile(rootNode, foundNode, sd.getTodaysDateCsv(csvFilename), dataFilename)
-
-	else:
-		print("ERROR: no conditions satisified")
-
-	todaysDate = todaysDate - testingDateSpan
-	rules_based.reset()
-
-#Perfomance metric
-print("---------*--------")
-print("Testing Result:")
-print("Number of testing days from today: %.d" % testingDate)
-print("Number of pass test: %.d" % passTest)
-print("Percentage of performance: %.2f%%" % (float(passTest) / float(testingDate) * 100))
+'''
+Runs the walk-forward backtest of Backtest.py over the last testingDate days of the saved CSV instead of
+running the agent once per day
+'''
+def runBacktest():
+	import Backtest
+	dates = sd.getPriceSeries(csvFilename).date
+	result = Backtest.backtest(stockToPredict, dates[min(testingDate, len(dates)) - 1], None, {'csvFilename': csvFilename,
+		'daysInThePast': daysInThePast, 'dayTodayToPredict': dayTodayToPredict, 'dayInFutureToPredict': dayInFutureToPredict,
+		'regressionModelType': regressionModelType, 'modelOptions': modelOptions, 'acceptedTolerance': acceptedTolerance, 'subsetStrategy': subsetStrategy,
+		'cacheDirectory': predictionCacheDirectory})
+	result.printSummary()
+
+
+'''
+Command line entry point. The configuration variables above are the defaults of the options
+'''
+def main(argv=None):
+	global stockToPredict, csvFilename, dataFilename, daysInThePast, regressionModelType, modelOptions, stockDataSource, acceptedTolerance
+	global testingDate, numOfWorkers, subsetStrategy, predictionCacheDirectory, predictionCache
+	parser = argparse.ArgumentParser(description='Predict tomorrow\'s stock price from the contiguous subset of past days that best predicts today.')
+	parser.add_argument('ticker', nargs='?', default=stockToPredict, help='stock ticker symbol (default: %(default)s)')
+	parser.add_argument('--model', default=regressionModelType, help='linear, rbf, ols, fast-linear, poly2, poly3, ridge or rbf-approx (default: %(default)s)')
+	parser.add_argument('--model-option', type=rm.parseModelOption, action='append', default=[], metavar='NAME=VALUE',
+		help='model setting overriding its default, i.e. numOfFeatures=50 or seed=7 for rbf-approx (repeatable)')
+	parser.add_argument('--days', type=int, default=daysInThePast, help='number of days in the past to use (default: %(default)s)')
+	parser.add_argument('--testing-days', type=int, default=testingDate, help='number of days to run the agent for, going back from today (default: %(default)s)')
+	parser.add_argument('--tolerance', type=float, default=acceptedTolerance, help='accepted difference from today\'s price (default: %(default)s)')
+	parser.add_argument('--source', default=stockDataSource, help='stock data source (default: %(default)s)')
+	parser.add_argument('--workers', type=int, default=numOfWorkers, help='processes to fit subsets with (default: %(default)s)')
+	parser.add_argument('--subsets', type=sd.parseSubsetStrategy, default=subsetStrategy, help='all, anchored, ladder[:ratio] or stride[:days], with optional ,min=N,max=N')
+	parser.add_argument('--cache', default=predictionCacheDirectory, metavar='DIR', help='folder to cache predictions in between runs (default: no cache)')
+	parser.add_argument('--backtest', action='store_true', help='backtest the last --testing-days days of the saved CSV instead')
+	parser.add_argument('--profile-startup', action='store_true', help='print how long each import took')
+	parser.add_argument('--metrics', default=None, help='file to write stage timings to, Prometheus text if it ends in .prom, JSON otherwise')
+	args = parser.parse_args(argv)
+
+	stockToPredict = args.ticker.upper()
+	csvFilename = stockToPredict + '.csv'
+	dataFilename = stockToPredict + '.plk'
+	regressionModelType = args.model
+	modelOptions = dict(args.model_option)
+	try:
+		rm.getModelParameters(regressionModelType, modelOptions)
+	except ValueError as error:
+		parser.error(str(error))
+	daysInThePast = args.days
+	testingDate = args.testing_days
+	acceptedTolerance = args.tolerance
+	stockDataSource = args.source
+	numOfWorkers = args.workers
+	subsetStrategy = args.subsets
+	predictionCacheDirectory = args.cache
+	predictionCache = pc.PredictionCache(predictionCacheDirectory, predictionCacheMaxMb * 1024 * 1024) if predictionCacheDirectory else None
+
+	if args.profile_startup:
+		import ImportProfiler # already installed at the top of this module when the flag is on the command line
+		ImportProfiler.install()
+		ImportProfiler.report('startup')
+		startupImports = len(ImportProfiler.records)
+	recorder = mt.enable() if args.metrics else mt.getRecorder()
+	with mt.tickerScope(stockToPredict):
+		if args.backtest:
+			runBacktest()
+		else:
+			runPredictions()
+	if args.metrics:
+		recorder.printReport()
+		recorder.writeFile(args.metrics)
+	if args.profile_startup:
+		ImportProfiler.report('imported while running', first=startupImports)
+
+
+if __name__ == '__main__': # also keeps worker processes (numOfWorkers > 1) from running the agent when they import this module
+	main()
 
 
 '''
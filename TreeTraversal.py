@@ -1,6 +1,13 @@
 import sys
+import os
+import json
+import struct
 import pickle
 from Queue import *
+from collections import deque, OrderedDict
+import numpy as np
+import StockData as sd
+import Metrics as mt
 
 class Node(object):
     def __init__(self, dataset, value):
@@ -25,32 +32,121 @@ class Node(object):
 def println(text):
     sys.stdout.write(text + "\n")
 
+'''
+Tree with N number of children on each node stored in two NumPy arrays instead of linked Node objects.
+Node i's children are nodes N*i+1 .. N*i+N, the same layout the level by level construction in createTree
+gives, so node indexes are also the breadth first search order
+@param numOfChildren - number of children per node
+@param values - array of node values
+@param datasets - n by 2 array of node (start day, end day) datasets
+@param slopes, intercepts - optional arrays of each node's fitted line for closed form linear models
+@param subsetStrategy - StockData.SubsetStrategy the datasets were made with, None if not known
+@param horizons, horizonValues - optional list of days predicted and n by len(horizons) array of each node's
+prediction for them (from RegressionModel.HorizonPredictions), values being one of its columns
+'''
+class ArrayTree(object):
+
+    def __init__(self, numOfChildren, values, datasets, slopes=None, intercepts=None, subsetStrategy=None,
+                 horizons=None, horizonValues=None):
+        self.numOfChildren = numOfChildren
+        self.values = np.asarray(values, dtype=float)
+        self.datasets = np.asarray(datasets, dtype=np.int64).reshape(len(self.values), 2)
+        self.slopes = slopes
+        self.intercepts = intercepts
+        self.subsetStrategy = subsetStrategy
+        self.horizons = np.asarray(horizons).tolist() if horizons is not None else None
+        self.horizonValues = horizonValues
+
+    '''
+    Gets the same tree with each node's value being its prediction for another of the tree's horizons
+    @param horizon - one of horizons
+    @return tree - ArrayTree sharing this tree's arrays
+    '''
+    def selectHorizon(self, horizon):
+        if self.horizons is None or horizon not in self.horizons:
+            raise ValueError("Tree has no predictions for day %s, only for days %s" % (horizon, self.horizons))
+        return ArrayTree(self.numOfChildren, self.horizonValues[:, self.horizons.index(horizon)], self.datasets, self.slopes,
+                         self.intercepts, self.subsetStrategy, self.horizons, self.horizonValues)
+
+    def __len__(self):
+        return len(self.values)
+
+    def getRoot(self):
+        return ArrayNode(self, 0)
+
+    def getNode(self, index):
+        return ArrayNode(self, index)
+
+    def getChildIndexes(self, index):
+        first = self.numOfChildren * index + 1
+        return xrange(min(first, len(self.values)), min(first + self.numOfChildren, len(self.values)))
+
+    '''
+    Gets the indexes of a node and all of its descendants in breadth first order. Each level of a subtree is a
+    contiguous run of indexes, so this is one slice per level
+    '''
+    def getSubtreeIndexes(self, index):
+        levels = []
+        first = last = index
+        while first < len(self.values):
+            levels.append(np.arange(first, min(last + 1, len(self.values))))
+            first = self.numOfChildren * first + 1
+            last = self.numOfChildren * last + self.numOfChildren
+        return np.concatenate(levels)
+
+
+'''
+Node view of one node of an ArrayTree, with the same accessors as Node
+'''
+class ArrayNode(object):
+
+    def __init__(self, tree, index):
+        self.tree = tree
+        self.index = index
+
+    def __repr__(self):
+        return "Node: [%s, %s]" % (self.value, self.dataset)
+
+    @property
+    def dataset(self):
+        return tuple(self.tree.datasets[self.index].tolist())
+
+    @property
+    def value(self):
+        return float(self.tree.values[self.index])
+
+    @property
+    def children(self):
+        return [ArrayNode(self.tree, childIndex) for childIndex in self.tree.getChildIndexes(self.index)]
+
+    def getChildren(self):
+        return self.children
+
+    def getRevChildren(self):
+        children = self.children
+        children.reverse()
+        return children
+
+
 '''
 Creates an unordered tree with N number of children on each node from a date:value dict
 @param numOfChildren - number of children per node 
-@param dateValues - list of date:value dictionaries to be added to the tree
+@param dateValues - list of date:value dictionaries to be added to the tree, or RegressionModel.HorizonPredictions
+@param subsetStrategy - StockData.SubsetStrategy the subsets were made with, saved along with the tree
+@param horizon - for HorizonPredictions, the horizon whose predictions are the node values (None for the first);
+the other horizons are kept in the tree for ArrayTree.selectHorizon
 @return rootNode - root node of the created tree
 '''
-def createTree(numOfChildren, dateValues):
-    dateValuesList = dateValues.keys()
-    lengthDateValues = len(dateValuesList)
-    rootNode = Node(dateValuesList[0], dateValues.get(dateValuesList[0]))
-    currParentNodes = Queue()
-    currParentNodes.put(rootNode)
-    index = 1
-
-    while index < lengthDateValues:
-        currParentNodesSize = currParentNodes.qsize()
-        for parentIndex in range(0,currParentNodesSize):
-            currParentNode = currParentNodes.get()
-            for childIndex in range(0, numOfChildren):
-                if (index == lengthDateValues):
-                    break
-                childNode = Node(dateValuesList[index], dateValues.get(dateValuesList[index]))
-                currParentNode.addChild(childNode)
-                currParentNodes.put(childNode)
-                index +=1
-    return rootNode
+@mt.timed('treeBuild')
+def createTree(numOfChildren, dateValues, subsetStrategy=None, horizon=None):
+    if hasattr(dateValues, 'horizons'):
+        tree = ArrayTree(numOfChildren, dateValues.prices[:, dateValues.horizonIndex(horizon)], dateValues.datasets,
+                         dateValues.slopes, dateValues.intercepts, subsetStrategy, dateValues.horizons, dateValues.prices)
+        return tree.getRoot()
+    # keep the fitted lines of RegressionModel.LinearSubsetPredictions so the tree can be rolled forward later
+    tree = ArrayTree(numOfChildren, dateValues.values(), dateValues.keys(),
+                     getattr(dateValues, 'slopes', None), getattr(dateValues, 'intercepts', None), subsetStrategy)
+    return tree.getRoot()
 
 
 '''
@@ -58,6 +154,11 @@ Prints out all nodes and their children
 @param rootNode - root node of the tree
 '''
 def printAllTreeNodes(rootNode):
+    if isinstance(rootNode, ArrayNode):
+        for count, index in enumerate(rootNode.tree.getSubtreeIndexes(rootNode.index).tolist()):
+            currNode = rootNode.tree.getNode(index)
+            print("Current node %d value: %s dataset: %s children: %s" % (count, currNode.value, currNode.dataset, currNode.children))
+        return
     currParentNodes = Queue()
     currParentNodes.put(rootNode)
     lengthCurrParentNodes = currParentNodes.qsize()
@@ -79,6 +180,8 @@ Gets the count of all nodes within a tree
 @return count - count of all nodes of the tree
 '''
 def countOfAllTreeNodes(rootNode):
+    if isinstance(rootNode, ArrayNode):
+        return len(rootNode.tree.getSubtreeIndexes(rootNode.index))
     currParentNodes = Queue()
     currParentNodes.put(rootNode)
     lengthCurrParentNodes = currParentNodes.qsize()
@@ -99,19 +202,18 @@ then the closest matched node will get returned.
 @param rootNode - root node of the tree
 @return foundNode - node that most closely matches the value we are looking for
 '''
+@mt.timed('search')
 def breadthFirstSearch(rootNode, value):
-    currParentNodes = Queue()
-    currParentNodes.put(rootNode)
-    lengthCurrParentNodes = currParentNodes.qsize()
-    lengthTree = countOfAllTreeNodes(rootNode)
+    if isinstance(rootNode, ArrayNode):
+        return arrayBreadthFirstSearch(rootNode, value)
+    currParentNodes = deque([rootNode])
     foundNode = rootNode
     difference = abs(value - rootNode.value)
     count = 0
     foundNodeCount = 0
 
-    while currParentNodes.qsize() > 0:
-        percentComplete = 100*float((count+1)) / float(lengthTree)
-        currNode = currParentNodes.get()
+    while currParentNodes:
+        currNode = currParentNodes.popleft()
         currDifference = abs(value - currNode.value)
         if currDifference < difference:
             difference = currDifference
@@ -119,25 +221,279 @@ def breadthFirstSearch(rootNode, value):
             foundNodeCount = count
         if difference == 0:
             break
-        lengthOfChildren = len(currNode.children)
-        if(lengthOfChildren > 0):
-            for childIndex in range(0,lengthOfChildren):
-                currParentNodes.put(currNode.children[childIndex])
+        currParentNodes.extend(currNode.children)
         count +=1
 
+    mt.count('nodesSearched', count)
+    print("Optimal node #%d found searching through %d nodes" % (foundNodeCount, count))
+    print("Optimal node value: %.2f dataset: %s\n" % (foundNode.value, foundNode.dataset))
+    return foundNode
+
+
+'''
+breadthFirstSearch over an ArrayTree, done as one vectorized pass over the subtree's indexes
+@param rootNode - ArrayNode to start searching from
+@return foundNode - ArrayNode that most closely matches the value we are looking for
+'''
+def arrayBreadthFirstSearch(rootNode, value):
+    indexes = rootNode.tree.getSubtreeIndexes(rootNode.index)
+    differences = np.abs(value - rootNode.tree.values[indexes])
+    foundNodeCount = int(np.argmin(differences))
+    count = foundNodeCount if differences[foundNodeCount] == 0 else len(indexes)
+    foundNode = rootNode.tree.getNode(int(indexes[foundNodeCount]))
+
+    mt.count('nodesSearched', count)
     print("Optimal node #%d found searching through %d nodes" % (foundNodeCount, count))
     print("Optimal node value: %.2f dataset: %s\n" % (foundNode.value, foundNode.dataset))
     return foundNode
 
 
-def writeTreeToFile(rootNode, foundNode, todaysDate, filename):
-    with open(filename, 'wb') as output:
-        pickle.dump(rootNode, output, pickle.HIGHEST_PROTOCOL)
-        pickle.dump(foundNode, output, pickle.HIGHEST_PROTOCOL)
-        pickle.dump(todaysDate, output, pickle.HIGHEST_PROTOCOL)
+'''
+Sorted index of predicted prices for finding the subsets whose prediction is closest to a value by bisection,
+which is what the tree search is used for. Ties are broken in favour of the subset that comes first in
+dateValues, the same node breadthFirstSearch would find
+@param dateValues - dict of (start day, end day):predicted price pairs from RegressionModel.predictAllPrices, or
+RegressionModel.HorizonPredictions
+@param horizon - for HorizonPredictions, the horizon to index (None for the first)
+'''
+class PredictionIndex(object):
+
+    def __init__(self, dateValues, horizon=None):
+        if hasattr(dateValues, 'select'):
+            dateValues = dateValues.select(horizon)
+        values = np.array(dateValues.values(), dtype=float)
+        self.positions = np.argsort(values, kind='mergesort') # position of each sorted value in dateValues
+        self.values = values[self.positions]
+        self.datasets = np.array(dateValues.keys(), dtype=np.int64).reshape(len(values), 2)[self.positions]
+
+    def __len__(self):
+        return len(self.values)
+
+    '''
+    Index of only the subsets that end on or before maxDay (i.e. for a smaller rule window), taken from this one
+    without sorting again. Ties are still broken by the subsets' order in dateValues
+    '''
+    def restrict(self, maxDay):
+        kept = self.datasets[:, 1] <= maxDay
+        index = PredictionIndex.__new__(PredictionIndex)
+        index.positions = self.positions[kept]
+        index.values = self.values[kept]
+        index.datasets = self.datasets[kept]
+        return index
+
+    '''
+    Returns the subset at a sorted index as a Node
+    '''
+    def getNode(self, index):
+        return Node(tuple(self.datasets[index].tolist()), float(self.values[index]))
+
+    '''
+    Returns the sorted index of the value closest to value
+    '''
+    def nearestIndex(self, value):
+        index = int(np.searchsorted(self.values, value))
+        if index == len(self.values): # every value is below, so the largest one is closest
+            return int(np.searchsorted(self.values, self.values[-1]))
+        if index > 0:
+            below = int(np.searchsorted(self.values, self.values[index - 1])) # first subset with that value
+            belowDifference = value - self.values[below]
+            difference = abs(self.values[index] - value)
+            if belowDifference < difference or (belowDifference == difference and self.positions[below] < self.positions[index]):
+                index = below
+        return index
+
+    '''
+    Finds the subset whose predicted price is closest to value
+    @return foundNode - Node of the closest subset
+    '''
+    @mt.timed('search')
+    def nearest(self, value):
+        return self.getNode(self.nearestIndex(value))
+
+    '''
+    Finds the k subsets whose predicted prices are closest to value
+    @return nodes - list of Nodes, closest first
+    '''
+    @mt.timed('search')
+    def kNearest(self, value, k):
+        if k <= 0 or len(self.values) == 0:
+            return []
+        index = int(np.searchsorted(self.values, value))
+        differences = np.abs(self.values[max(index - k, 0):index + k] - value)
+        kthDifference = np.sort(differences)[min(k, len(differences)) - 1]
+        # widen to every subset tied with the kth closest so ties are broken the same way as nearest
+        return self.withinTolerance(value, kthDifference)[:k]
+
+    '''
+    Finds every subset whose predicted price is within tolerance of value (i.e. acceptedTolerance)
+    @return nodes - list of Nodes, closest first
+    '''
+    def withinTolerance(self, value, tolerance):
+        slack = 1e-9 * (abs(value) + tolerance) # guards the bisection bounds against rounding in value +/- tolerance
+        first = int(np.searchsorted(self.values, value - tolerance - slack, 'left'))
+        last = int(np.searchsorted(self.values, value + tolerance + slack, 'right'))
+        candidates = np.arange(first, last)
+        differences = np.abs(self.values[candidates] - value)
+        candidates = candidates[differences <= tolerance]
+        differences = differences[differences <= tolerance]
+        closest = candidates[np.lexsort((self.positions[candidates], differences))]
+        return [self.getNode(index) for index in closest]
+
+
+'''
+Saved prediction state is a small binary file that can be memory mapped instead of unpickled:
+    8 byte magic, 4 byte little endian header length, JSON header padded to an 8 byte boundary,
+    then each array's raw bytes at the offset given in the header
+The header holds the format version, ticker, as-of date, model type, source data hash, subset strategy, tree
+shape and found node, so the file can be validated before any arrays are touched. The arrays are the node
+values and datasets, plus slopes and intercepts for trees of closed form linear models, and the predictions of
+every horizon (with the horizons in the header) for trees of multi-horizon predictions
+'''
+treeFileMagic = 'SPTREE\x00\x01'
+treeFileVersion = 1
+
+'''
+Saves a tree and the node found in it to a prediction state file
+@param rootNode - root node of the tree, an ArrayNode from createTree or a Node
+@param foundNode - node found when searching the tree
+@param todaysDate - date of the latest price the tree was computed from
+@param filename - name of the file to write
+@param ticker, modelType, sourceHash - optional details stored in the header
+'''
+@mt.timed('persistWrite')
+def writeTreeToFile(rootNode, foundNode, todaysDate, filename, ticker='', modelType='', sourceHash=''):
+    tree = toArrayTree(rootNode)
+    foundIndex = -1
+    if isinstance(foundNode, ArrayNode) and foundNode.tree is tree:
+        foundIndex = foundNode.index
+    else:
+        matches = np.flatnonzero((tree.datasets == foundNode.dataset).all(axis=1))
+        if len(matches) > 0:
+            foundIndex = int(matches[0])
+    header = {'version': treeFileVersion, 'ticker': ticker, 'asOfDate': str(todaysDate), 'modelType': modelType,
+              'sourceHash': sourceHash, 'numOfChildren': tree.numOfChildren, 'foundIndex': foundIndex,
+              'foundDataset': list(foundNode.dataset), 'foundValue': float(foundNode.value),
+              'subsetStrategy': tree.subsetStrategy.describe() if tree.subsetStrategy is not None else None,
+              'horizons': tree.horizons}
+    arrays = OrderedDict([('values', tree.values), ('datasets', tree.datasets)])
+    if tree.slopes is not None and tree.intercepts is not None:
+        arrays['slopes'] = tree.slopes
+        arrays['intercepts'] = tree.intercepts
+    if tree.horizonValues is not None:
+        arrays['horizonValues'] = tree.horizonValues
+    writeArrayFile(filename, header, arrays)
+
+
+'''
+Writes a header dict and named arrays in the prediction state format. The file is written to a temporary name
+and then renamed so a crash never leaves half a file behind
+'''
+def writeArrayFile(filename, header, arrays):
+    arrays = OrderedDict((name, np.ascontiguousarray(array)) for name, array in arrays.items())
+    header = dict(header)
+    header['arrays'] = {}
+    # array offsets depend on the header length, so lay the arrays out until the header stops growing
+    headerLength = 0
+    while True:
+        offset = alignTo8(len(treeFileMagic) + 4 + headerLength)
+        for name, array in arrays.items():
+            header['arrays'][name] = {'offset': offset, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+            offset = alignTo8(offset + array.nbytes)
+        headerBytes = json.dumps(header, sort_keys=True)
+        if len(headerBytes) <= headerLength:
+            break
+        headerLength = len(headerBytes)
+    headerBytes = headerBytes.ljust(alignTo8(len(treeFileMagic) + 4 + headerLength) - len(treeFileMagic) - 4)
+
+    tempFilename = filename + '.tmp'
+    with open(tempFilename, 'wb') as output:
+        output.write(treeFileMagic)
+        output.write(struct.pack('<I', len(headerBytes)))
+        output.write(headerBytes)
+        for name, array in arrays.items():
+            output.seek(header['arrays'][name]['offset'])
+            output.write(array.tobytes())
+    if os.name == 'nt' and os.path.exists(filename):
+        os.remove(filename) # os.rename does not replace existing files on Windows
+    os.rename(tempFilename, filename)
+
+
+def alignTo8(offset):
+    return (offset + 7) // 8 * 8
+
+
+'''
+Reads the header of a prediction state file and memory maps its arrays, which takes the same time no matter
+how big the tree is
+@return header, arrays - header dict and dict of name:memory mapped array
+'''
+def readArrayFile(filename):
+    with open(filename, 'rb') as input:
+        if input.read(len(treeFileMagic)) != treeFileMagic:
+            raise ValueError("%s is not a prediction state file" % filename)
+        headerLength = struct.unpack('<I', input.read(4))[0]
+        header = json.loads(input.read(headerLength))
+    if header['version'] > treeFileVersion:
+        raise ValueError("%s was written by a newer version (%d) of the prediction state format" % (filename, header['version']))
+    arrays = {}
+    for name, layout in header['arrays'].items():
+        shape = tuple(layout['shape'])
+        if np.prod(shape) == 0:
+            arrays[name] = np.zeros(shape, dtype=layout['dtype'])
+        else:
+            arrays[name] = np.memmap(filename, dtype=layout['dtype'], mode='r', offset=layout['offset'], shape=shape)
+    return header, arrays
+
+
+def isArrayFile(filename):
+    with open(filename, 'rb') as input:
+        return input.read(len(treeFileMagic)) == treeFileMagic
+
+
+'''
+Converts a tree of linked Nodes (i.e. from a legacy pickle) into an ArrayTree. ArrayNode trees are returned as is
+'''
+def toArrayTree(rootNode):
+    if isinstance(rootNode, ArrayNode):
+        return rootNode.tree
+    values = []
+    datasets = []
+    numOfChildren = 1
+    currParentNodes = deque([rootNode])
+    while currParentNodes:
+        currNode = currParentNodes.popleft()
+        values.append(currNode.value)
+        datasets.append(currNode.dataset)
+        numOfChildren = max(numOfChildren, len(currNode.children))
+        currParentNodes.extend(currNode.children)
+    return ArrayTree(numOfChildren, values, datasets)
+
+
+'''
+Reads a tree saved by writeTreeToFile. Files written before the binary format existed are unpickled instead
+@param filename - name of the file to read
+@param horizon - for trees of multi-horizon predictions, the horizon to give the node values of (None for the
+one the tree was saved with)
+@return rootNode, foundNode, dateOfWrite - root node of the tree, the node found in it and the as-of date
+'''
+@mt.timed('persistRead')
+def readTreeFromFile(filename, horizon=None):
+    if not isArrayFile(filename):
+        return readLegacyTreeFromFile(filename)
+    header, arrays = readArrayFile(filename)
+    # files written before subset strategies existed always hold every subset
+    tree = ArrayTree(header['numOfChildren'], arrays['values'], arrays['datasets'], arrays.get('slopes'), arrays.get('intercepts'),
+                     sd.subsetStrategyFromDescription(header.get('subsetStrategy')), header.get('horizons'), arrays.get('horizonValues'))
+    if horizon is not None:
+        tree = tree.selectHorizon(horizon)
+    if header['foundIndex'] >= 0:
+        foundNode = tree.getNode(header['foundIndex'])
+    else:
+        foundNode = Node(tuple(header['foundDataset']), header['foundValue'])
+    return tree.getRoot(), foundNode, str(header['asOfDate'])
 
 
-def readTreeFromFile(filename):
+def readLegacyTreeFromFile(filename):
     with open(filename, 'rb') as input:
         rootNode = pickle.load(input)
         foundNode = pickle.load(input)
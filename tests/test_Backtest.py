@@ -0,0 +1,46 @@
+import os
+import sys
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import StockData as sd
+import Backtest
+import Benchmark as bm
+
+repoDirectory = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+strategies = [None, sd.AllPairs(3, 12), sd.AnchoredWindows(), sd.GeometricLadder(1.5), sd.StrideStarts(3)]
+
+'''
+The vectorized closed form backtest has to pick the same subsets as running the agent for each as-of day
+'''
+class BacktestParityTest(unittest.TestCase):
+
+	def assertParity(self, closes, daysInThePast):
+		asOfIndexes = np.arange(daysInThePast, len(closes))
+		for strategy in strategies:
+			config = dict(Backtest.defaultConfig, daysInThePast=daysInThePast, subsetStrategy=strategy)
+			predicted, datasets, predictedNext = Backtest.backtestOls(closes, asOfIndexes, config)
+			expected, expectedDatasets, expectedNext = Backtest.backtestEachDay(closes, asOfIndexes, config)
+			self.assertEqual(datasets.tolist(), expectedDatasets.tolist(), strategy)
+			self.assertTrue(np.array_equal(predicted, expected), strategy)
+			self.assertTrue(np.allclose(predictedNext, expectedNext, rtol=0, atol=1e-8), strategy)
+
+	def testAaplParity(self):
+		closes = sd.getPriceSeries(os.path.join(repoDirectory, 'AAPL.csv')).close[::-1]
+		self.assertParity(closes[-120:], 20)
+
+	def testTiesOfFlatAndTrendingSeries(self):
+		for kind in ('flat', 'trending'):
+			closes = np.array(bm.syntheticCloses(kind, 60, 1))
+			self.assertParity(closes, 15)
+
+	def testBacktestUsesClosedFormPath(self):
+		result = Backtest.backtest('AAPL', config={'csvFilename': os.path.join(repoDirectory, 'AAPL.csv'), 'daysInThePast': 10})
+		self.assertEqual(len(result), len(sd.getPriceSeries(os.path.join(repoDirectory, 'AAPL.csv'))) - 10)
+		self.assertTrue(0.0 <= result.passRate <= 1.0)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,61 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import PredictionCache as pc
+
+
+def storeWorkerFits(args):
+	directory, worker, rounds = args
+	cache = pc.PredictionCache(directory)
+	for i in xrange(rounds):
+		cache.storeFits('table', {pc.subsetDigest(np.array([worker, i]), np.array([0.0])): float(worker * 1000 + i)})
+	return worker
+
+
+class PredictionCacheTest(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+
+	def tearDown(self):
+		shutil.rmtree(self.directory)
+
+	def testEntryRoundTrip(self):
+		cache = pc.PredictionCache(self.directory)
+		key = pc.makeKey('predictAllPrices', 'ols', {'C': 1.0}, 0, np.arange(5))
+		self.assertIsNone(cache.get('predictions', key))
+		cache.put('predictions', key, {'prices': np.array([1.0, 2.0])})
+		self.assertEqual(cache.get('predictions', key)['prices'].tolist(), [1.0, 2.0])
+		self.assertEqual((cache.hits, cache.misses), (1, 1))
+		self.assertNotEqual(key, pc.makeKey('predictAllPrices', 'ols', {'C': 1.0}, 1, np.arange(5)))
+
+	def testConcurrentStoreFitsKeepsEveryFit(self):
+		workers, rounds = 4, 25
+		pool = multiprocessing.Pool(workers)
+		try:
+			pool.map(storeWorkerFits, [(self.directory, worker, rounds) for worker in range(workers)])
+		finally:
+			pool.close()
+			pool.join()
+		digests = [pc.subsetDigest(np.array([worker, i]), np.array([0.0])) for worker in range(workers) for i in range(rounds)]
+		fits = pc.PredictionCache(self.directory).lookupFits('table', digests)
+		self.assertEqual(len(fits), workers * rounds)
+
+	def testEvictionKeepsTheCacheUnderMaxBytes(self):
+		cache = pc.PredictionCache(self.directory, maxBytes=4096)
+		for i in range(20):
+			cache.put('predictions', str(i), {'prices': np.arange(64, dtype=float)})
+		self.assertTrue(cache.stats()['bytesOnDisk'] <= 4096)
+		self.assertTrue(cache.evictions > 0)
+		self.assertIsNotNone(cache.get('predictions', '19'))
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,67 @@
+import os
+import sys
+import json
+import shutil
+import urllib2
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import PredictionServer as ps
+
+repoDirectory = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+
+class PredictionServerTest(unittest.TestCase):
+
+	def setUp(self):
+		self.directory = tempfile.mkdtemp()
+		shutil.copy(os.path.join(repoDirectory, 'AAPL.csv'), self.directory)
+		self.service = ps.PredictionService({'csvDirectory': self.directory, 'daysInThePast': 15,
+			'cacheDirectory': os.path.join(self.directory, 'cache'), 'metrics': False})
+		self.server = ps.PredictionServer(self.service, 0)
+		self.thread = threading.Thread(target=self.server.serve_forever)
+		self.thread.daemon = True
+		self.thread.start()
+
+	def tearDown(self):
+		self.server.shutdown()
+		self.server.server_close()
+		shutil.rmtree(self.directory)
+
+	def get(self, path):
+		return json.loads(urllib2.urlopen(self.server.baseUrl + path).read())
+
+	def testPredict(self):
+		prediction = self.get('/predict/aapl')
+		self.assertEqual(prediction['ticker'], 'AAPL')
+		self.assertTrue(prediction['foundStartDay'] <= prediction['foundEndDay'] <= 15)
+		nearest = self.get('/nearest/AAPL?price=%r&k=3' % prediction['todaysPrice'])
+		self.assertEqual(nearest['subsets'][0]['predictedPrice'], prediction['foundPrice'])
+
+	def testConcurrentRequestsAreAllCounted(self):
+		threads, requestsPerThread = 8, 10
+		errors = []
+		def requestMany():
+			try:
+				for i in range(requestsPerThread):
+					self.get('/predict/AAPL')
+			except Exception as error:
+				errors.append(error)
+		workers = [threading.Thread(target=requestMany) for i in range(threads)]
+		for worker in workers:
+			worker.start()
+		for worker in workers:
+			worker.join()
+		self.assertEqual(errors, [])
+		health = self.service.health()
+		self.assertEqual(health['requests'], threads * requestsPerThread)
+		self.assertEqual(health['rebuilds'], 1)
+		stats = self.service.cache.stats()
+		self.assertEqual(stats['hits'] + stats['misses'], 1)
+
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,98 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import StockData as sd
+import QuoteParser as qp
+import QuoteDownloader as qd
+
+repoDirectory = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+'''
+Tests of the concurrent downloader against the local FixtureServer, so they run without the internet
+'''
+
+
+class DownloadCsvFilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.fixtures = tempfile.mkdtemp()
+        self.output = tempfile.mkdtemp()
+        shutil.copy(os.path.join(repoDirectory, 'AAPL.csv'), os.path.join(self.fixtures, 'AAPL.csv'))
+        shutil.copy(os.path.join(repoDirectory, 'orcl.csv'), os.path.join(self.fixtures, 'ORCL.csv'))
+        shutil.copy(os.path.join(repoDirectory, 'aaplOld2.csv'), os.path.join(self.fixtures, 'GOOG.csv'))
+        self.server = qd.FixtureServer(self.fixtures)
+
+    def tearDown(self):
+        self.server.shutdown()
+        shutil.rmtree(self.fixtures)
+        shutil.rmtree(self.output)
+
+    def downloadCsvFiles(self, tickers, source='google finance', **options):
+        downloader = qd.QuoteDownloader(self.server.quoteUrl, **options)
+        return qd.downloadCsvFiles(tickers, '2011-01-01', '2017-05-12', source, self.output, downloader=downloader)
+
+    def assertSameQuotes(self, ticker, fixtureName):
+        expected = qp.parseQuoteFile(os.path.join(self.fixtures, fixtureName))
+        downloaded = qp.parseQuoteFile(os.path.join(self.output, ticker + '.csv'))
+        np.testing.assert_array_equal(downloaded['date'], expected['date'])
+        for name in ('open', 'high', 'low', 'close'):
+            np.testing.assert_allclose(downloaded[name], expected[name], atol=0.005)
+        np.testing.assert_array_equal(downloaded['volume'], expected['volume'])
+
+    def testDownloadsEveryLayoutOverOneConnection(self):
+        failed = self.downloadCsvFiles(['AAPL', 'ORCL', 'GOOG'], maxConcurrency=1)
+        self.assertEqual(failed, {})
+        for ticker in ('AAPL', 'ORCL', 'GOOG'):
+            self.assertSameQuotes(ticker, ticker + '.csv')
+        self.assertEqual(self.server.requestCount, 3)
+        self.assertEqual(self.server.connectionCount, 1)
+
+    def testConcurrentWorkersKeepTheirConnections(self):
+        tickers = ['AAPL%d' % i for i in xrange(12)]
+        for ticker in tickers:
+            shutil.copy(os.path.join(self.fixtures, 'AAPL.csv'), os.path.join(self.fixtures, ticker + '.csv'))
+        results = qd.QuoteDownloader(self.server.quoteUrl, maxConcurrency=3).download(tickers, '2011-01-01', '2017-05-12')
+        self.assertEqual(results.keys(), tickers)
+        self.assertTrue(all(len(columns['close']) == 251 for columns in results.values()))
+        self.assertEqual(self.server.requestCount, 12)
+        self.assertLessEqual(self.server.connectionCount, 3)
+
+    def testServerErrorsAreRetried(self):
+        self.server.failures['AAPL'] = 2
+        failed = self.downloadCsvFiles(['AAPL'], retries=3, backoff=0.01)
+        self.assertEqual(failed, {})
+        self.assertSameQuotes('AAPL', 'AAPL.csv')
+        self.assertEqual(self.server.requestCount, 3)
+
+    def testFailuresAreReported(self):
+        self.server.failures['ORCL'] = 10
+        failed = self.downloadCsvFiles(['AAPL', 'MSFT', 'ORCL'], retries=2, backoff=0.01)
+        self.assertEqual(sorted(failed), ['MSFT', 'ORCL'])
+        self.assertTrue(all(isinstance(error, qd.QuoteDownloadError) for error in failed.values()))
+        self.assertTrue('404' in str(failed['MSFT']) and '503' in str(failed['ORCL']))
+        self.assertEqual(self.server.requestCount, 1 + 1 + 3) # a missing symbol is not retried
+        self.assertTrue(os.path.exists(os.path.join(self.output, 'AAPL.csv')))
+        self.assertFalse(os.path.exists(os.path.join(self.output, 'MSFT.csv')))
+
+    def testYahooPricesAreAdjusted(self):
+        with open(os.path.join(self.fixtures, 'YHOO.csv'), 'w') as fixture:
+            fixture.write("Date,Open,High,Low,Close,Volume,Adj Close\n"
+                          "2017-05-12,20.00,21.00,19.00,20.00,100,20.00\n"
+                          "2017-05-11,40.00,42.00,38.00,40.00,100,19.80\n"
+                          "2017-05-10,42.00,42.00,40.00,40.00,100,19.80\n")
+        failed = self.downloadCsvFiles(['YHOO'], source='yahoo')
+        self.assertEqual(failed, {})
+        downloaded = qp.parseQuoteFile(os.path.join(self.output, 'YHOO.csv'))
+        expected = sd.adjustPrices(qp.parseQuoteFile(os.path.join(self.fixtures, 'YHOO.csv')), 'back')
+        np.testing.assert_allclose(downloaded['close'], expected['close'], atol=0.005)
+        np.testing.assert_allclose(downloaded['open'], [20.79, 19.80, 20.00], atol=0.005)
+
+
+if __name__ == '__main__':
+    unittest.main()
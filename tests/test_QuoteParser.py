@@ -0,0 +1,82 @@
+import os
+import sys
+import csv
+import datetime
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import QuoteParser as qp
+
+repoDirectory = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+
+'''
+Tests of the bulk parser against the per-line csv.reader/strptime parsing it replaced, on the repo's CSV files
+'''
+
+
+def parseQuoteLines(filename, dialectName):
+    rows = []
+    with open(filename, 'r') as csvfile:
+        csvFileReader = csv.reader(csvfile)
+        if dialectName != 'symbol':
+            next(csvFileReader) # skip first row because it's only column names
+        for row in csvFileReader:
+            if not row:
+                continue
+            if dialectName == 'symbol':
+                symbol, ds, ts, open_, high, low, close, volume = row
+                date = datetime.datetime.strptime(ds, '%Y-%m-%d')
+            else:
+                ds, open_, high, low, close, volume = row[:6]
+                date = datetime.datetime.strptime(ds.strip(), '%Y-%m-%d' if dialectName == 'iso' else '%d-%b-%y')
+            rows.append((date.date().isoformat(), float(open_), float(high), float(low), float(close), int(volume)))
+    rows.sort()
+    return rows
+
+
+class ParseQuoteFileTest(unittest.TestCase):
+
+    files = (('AAPL.csv', 'iso'), ('aaplOld2.csv', 'google'), ('orcl.csv', 'symbol'))
+
+    def assertSameColumns(self, columns, expected):
+        self.assertEqual(sorted(columns), sorted(expected))
+        for name in expected:
+            np.testing.assert_array_equal(columns[name], expected[name])
+
+    def testDetectsEachDialect(self):
+        for name, dialectName in self.files:
+            with open(os.path.join(repoDirectory, name), 'rb') as quoteFile:
+                self.assertEqual(qp.detectDialect(quoteFile.read(4096)).name, dialectName)
+
+    def testMatchesPerLineParsing(self):
+        for name, dialectName in self.files:
+            columns = qp.parseQuoteFile(os.path.join(repoDirectory, name))
+            rows = parseQuoteLines(os.path.join(repoDirectory, name), dialectName)
+            self.assertEqual(columns['date'].astype(str).tolist(), [row[0] for row in rows])
+            for i, field in enumerate(('open', 'high', 'low', 'close', 'volume')):
+                self.assertEqual(columns[field].tolist(), [row[i + 1] for row in rows])
+            if dialectName == 'symbol':
+                self.assertEqual(set(columns['symbol'].tolist()), set(['ORCL']))
+
+    def testChunksMatchAFullParse(self):
+        for name, dialectName in self.files:
+            filename = os.path.join(repoDirectory, name)
+            expected = qp.parseQuoteFile(filename)
+            for chunkBytes in (1, 100, 4096):
+                chunks = list(qp.iterQuoteChunks(filename, chunkBytes))
+                self.assertEqual(sum(len(chunk['close']) for chunk in chunks), len(expected['close']))
+                self.assertSameColumns(qp.sortColumns(qp.concatenateColumns(chunks)), expected)
+                self.assertSameColumns(qp.parseQuoteFile(filename, chunkBytes), expected)
+
+    def testOnlyALeadingByteOrderMarkIsRemoved(self):
+        self.assertEqual(qp.stripBom(qp.utf8Bom + 'Date'), 'Date')
+        self.assertEqual(qp.stripBom('\xbb\xef\xbfDate'), '\xbb\xef\xbfDate')
+        self.assertEqual(qp.stripBom(qp.utf8Bom + qp.utf8Bom + 'Date'), qp.utf8Bom + 'Date')
+        text = "Date,Open,High,Low,Close,Volume\n2017-05-12,1.00,2.00,0.50,1.50,10\n"
+        self.assertSameColumns(qp.parseQuoteText(qp.utf8Bom + text), qp.parseQuoteText(text))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,204 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import StockData as sd
+import RegressionModel as rm
+import Benchmark as bm
+import PredictionCache as pc
+
+'''
+Tests of the vectorized subset models against the one subset at a time ones
+'''
+
+
+class PredictAllPricesDictsTest(unittest.TestCase):
+
+	def setUp(self):
+		self.dateValues = bm.syntheticDateValues('random-walk', 60, seed=3)
+
+	def assertMatchesDicts(self, dicts, dayToPredict, modelType):
+		predictions = rm.predictAllPrices(dicts, dayToPredict, modelType)
+		self.assertEqual(predictions.keys(), [(min(subset), max(subset)) for subset in dicts])
+		for subset, price in zip(dicts, predictions.values()):
+			self.assertAlmostEqual(price, rm.predictPrice(subset, dayToPredict, modelType, 0, 0), places=6)
+
+	def testAnchoredDictsGiveOneResultEach(self):
+		dicts = sd.getAllContigSubsetsDict(self.dateValues, strategy=sd.AnchoredWindows())
+		self.assertEqual(len(dicts), 59)
+		self.assertMatchesDicts(dicts, 1, 'ols')
+
+	def testSingleDict(self):
+		dicts = [sd.getAllContigSubsetsDict(self.dateValues)[100]]
+		self.assertEqual(len(rm.predictAllPrices(dicts, 0, 'ols')), 1)
+		self.assertMatchesDicts(dicts, 0, 'ols')
+
+	def testDictOrderIsKept(self):
+		dicts = sd.getAllContigSubsetsDict(self.dateValues, strategy=sd.StrideStarts(7))[::-3]
+		self.assertMatchesDicts(dicts, 1, 'ols')
+		self.assertMatchesDicts(dicts, 1, 'poly2')
+
+	def assertMatchesLeastSquares(self, dicts, predictions, degree, alpha):
+		for subset, (dataset, price) in zip(dicts, predictions.items()):
+			x = -np.array(subset.keys(), dtype=float)
+			y = np.array(subset.values())
+			self.assertEqual(dataset, (min(subset), max(subset)))
+			if alpha == 0.0: # plain least squares, of a lower degree when the subset has too few days
+				expected = np.polyval(np.polyfit(x, y, min(degree, len(x) - 1)), 1.0)
+			else: # ridge on x scaled to [-1, 0] from the subset's first day, the constant not penalised
+				scaledX = (x - x[0]) / (abs(x[-1] - x[0]) or 1.0)
+				design = scaledX[:, np.newaxis] ** np.arange(degree + 1)
+				penalty = alpha * np.eye(degree + 1)
+				penalty[0, 0] = 0.0
+				coefficients = np.linalg.solve(design.T.dot(design) + penalty, design.T.dot(y))
+				expected = np.polyval(coefficients[::-1], (1.0 - x[0]) / (abs(x[-1] - x[0]) or 1.0))
+			np.testing.assert_allclose(price, expected, rtol=1e-8, atol=1e-6)
+
+	def testBatchModelsAndHorizons(self):
+		dicts = sd.getAllContigSubsetsDict(self.dateValues, strategy=sd.GeometricLadder(2.0))
+		for modelType in ('poly2', 'poly3', 'ridge'):
+			parameters = rm.getModelParameters(modelType)
+			self.assertMatchesLeastSquares(dicts, rm.predictAllPrices(dicts, 1, modelType), parameters['degree'], parameters['alpha'])
+		self.assertEqual(len(rm.predictAllPrices(dicts, 1, 'rbf-approx')), len(dicts))
+		horizons = rm.predictAllPrices(dicts, [0, 1, 5], 'ols')
+		self.assertEqual(len(horizons), len(dicts))
+		self.assertEqual(horizons.select(5).keys(), [(min(subset), max(subset)) for subset in dicts])
+
+	def testInconsistentDictsAreRejected(self):
+		self.assertRaises(ValueError, rm.predictAllPrices, [{1: 1.0, 3: 2.0}, {1: 1.0, 2: 4.0, 3: 2.0}], 0, 'ols')
+		self.assertRaises(ValueError, rm.predictAllPrices, [{1: 1.0, 2: 2.0}, {2: 5.0, 3: 1.0}], 0, 'ols')
+
+
+class ModelOptionsTest(unittest.TestCase):
+
+	def setUp(self):
+		self.subsets = sd.ContigSubsets(bm.syntheticDateValues('random-walk', 40, seed=5), strategy=sd.StrideStarts(3))
+
+	def testOptionsReachTheModel(self):
+		starts, ends = self.subsets.indexArrays()
+		expected = rm.predictAllRbfApprox(self.subsets.days * -1, self.subsets.values, starts, ends, 1, numOfFeatures=5,
+			gamma=0.1, alpha=1e-3, seed=3)
+		predictions = rm.predictAllPrices(self.subsets, 1, 'rbf-approx', numOfFeatures=5, seed=3)
+		np.testing.assert_allclose(predictions.values(), expected)
+		self.assertNotEqual(predictions.values(), rm.predictAllPrices(self.subsets, 1, 'rbf-approx').values())
+
+	def testUnknownOptionIsRejected(self):
+		self.assertRaises(ValueError, rm.predictAllPrices, self.subsets, 1, 'rbf-approx', numOfFeature=5)
+		self.assertRaises(ValueError, rm.predictAllPrices, self.subsets, 1, 'ols', seed=3)
+
+	def testUnknownModelTypeIsRejected(self):
+		self.assertRaises(ValueError, rm.getModelParameters, 'bogus')
+		self.assertRaises(ValueError, rm.predictAllPrices, self.subsets, 1, 'bogus')
+		self.assertEqual(rm.getModelParameters('ols'), {})
+
+	def testParseModelOption(self):
+		self.assertEqual(rm.parseModelOption('numOfFeatures=50'), ('numOfFeatures', 50))
+		self.assertEqual(rm.parseModelOption('gamma=0.5'), ('gamma', 0.5))
+		self.assertEqual(rm.parseModelOption('kernel=rbf'), ('kernel', 'rbf'))
+		self.assertRaises(ValueError, rm.parseModelOption, 'numOfFeatures')
+
+	def testOptionsArePartOfTheCacheKey(self):
+		directory = tempfile.mkdtemp()
+		try:
+			cache = pc.PredictionCache(directory)
+			default = rm.predictAllPrices(self.subsets, 1, 'rbf-approx', cache=cache)
+			tuned = rm.predictAllPrices(self.subsets, 1, 'rbf-approx', cache=cache, numOfFeatures=5, seed=3)
+			self.assertNotEqual(default.values(), tuned.values())
+			self.assertEqual(rm.predictAllPrices(self.subsets, 1, 'rbf-approx', cache=cache, numOfFeatures=5, seed=3).values(),
+				tuned.values())
+		finally:
+			shutil.rmtree(directory)
+
+
+class ExtendPredictionsWindowTest(unittest.TestCase):
+
+	def setUp(self):
+		self.dateValues = bm.syntheticDateValues('random-walk', 30, seed=11)
+
+	def window(self, maxDay):
+		return OrderedDict((day, self.dateValues[day]) for day in range(1, maxDay + 1))
+
+	def assertExtendsLikeFresh(self, strategy, modelType):
+		small = sd.ContigSubsets(self.window(10), strategy=strategy)
+		large = sd.ContigSubsets(self.window(30), strategy=strategy)
+		extended = rm.extendPredictionsWindow(rm.predictAllPrices(small, 1, modelType), 10, large, 1, modelType)
+		fresh = rm.predictAllPrices(large, 1, modelType)
+		self.assertEqual(extended.keys(), fresh.keys())
+		np.testing.assert_allclose(extended.values(), fresh.values(), rtol=1e-9)
+		self.assertEqual(isinstance(extended, rm.LinearSubsetPredictions), isinstance(fresh, rm.LinearSubsetPredictions))
+
+	def testExtendedMatchesFresh(self):
+		for strategy in (sd.AllPairs(), sd.AnchoredWindows(), sd.StrideStarts(3)):
+			for modelType in ('ols', 'poly2', 'rbf-approx'):
+				self.assertExtendsLikeFresh(strategy, modelType)
+
+	def testOnlyNewSubsetsAreFitted(self):
+		small = sd.ContigSubsets(self.window(10), strategy=sd.AllPairs())
+		large = sd.ContigSubsets(self.window(30), strategy=sd.AllPairs())
+		predictions = rm.predictAllPrices(small, 1, 'ols')
+		fitted = []
+		predictAllPrices = rm.predictAllPrices
+		def countingPredictAllPrices(subsets, *args, **kwargs):
+			fitted.append(len(subsets))
+			return predictAllPrices(subsets, *args, **kwargs)
+		rm.predictAllPrices = countingPredictAllPrices
+		try:
+			rm.extendPredictionsWindow(predictions, 10, large, 1, 'ols')
+		finally:
+			rm.predictAllPrices = predictAllPrices
+		self.assertEqual(fitted, [len(large) - len(small)])
+
+
+class FitAllLinearTest(unittest.TestCase):
+
+	def setUp(self):
+		random = np.random.RandomState(7)
+		self.dates = -np.arange(1, 41, dtype=float)
+		self.values = 100.0 + np.cumsum(random.normal(0.0, 1.0, 40))
+		self.starts = random.randint(0, 39, 60)
+		self.ends = self.starts + [random.randint(1, 40 - start) for start in self.starts]
+
+	def testMatchesPolyfit(self):
+		slopes, intercepts = rm.fitAllLinear(self.dates, self.values, self.starts, self.ends)
+		for start, end, slope, intercept in zip(self.starts, self.ends, slopes, intercepts):
+			expectedSlope, expectedIntercept = np.polyfit(self.dates[start:end + 1], self.values[start:end + 1], 1)
+			self.assertAlmostEqual(slope, expectedSlope, places=8)
+			self.assertAlmostEqual(intercept, expectedIntercept, places=6)
+
+	def testSeriesPerRowMatchesOneSeriesAtATime(self):
+		rows = np.vstack((self.values, self.values[::-1], self.values * 2.0))
+		slopes, intercepts = rm.fitAllLinear(self.dates, rows, self.starts, self.ends)
+		for row, rowSlopes, rowIntercepts in zip(rows, slopes, intercepts):
+			expectedSlopes, expectedIntercepts = rm.fitAllLinear(self.dates, row, self.starts, self.ends)
+			np.testing.assert_allclose(rowSlopes, expectedSlopes, rtol=1e-12, atol=1e-12)
+			np.testing.assert_allclose(rowIntercepts, expectedIntercepts, rtol=1e-12)
+
+
+class RollLinearPredictionsTest(unittest.TestCase):
+
+	def setUp(self):
+		self.closes = bm.syntheticCloses('random-walk', 60, seed=9)
+
+	def dateValuesAsOf(self, today, numOfDays):
+		return OrderedDict((day, float(self.closes[today - day])) for day in range(1, numOfDays + 1))
+
+	def testRolledMatchesFresh(self):
+		for strategy in (None, sd.AnchoredWindows(), sd.StrideStarts(4), sd.GeometricLadder(1.5)):
+			for dayOffset in (0, 1, 3, 25):
+				stored = rm.predictAllPrices(sd.ContigSubsets(self.dateValuesAsOf(50 - dayOffset, 25), strategy=strategy), 1, 'ols')
+				dateValues = self.dateValuesAsOf(50, 25)
+				rolled = rm.rollLinearPredictions(stored.keys(), stored.slopes, stored.intercepts, dateValues, dayOffset, 1, strategy)
+				fresh = rm.predictAllPrices(sd.ContigSubsets(dateValues, strategy=strategy), 1, 'ols')
+				self.assertEqual(rolled.keys(), fresh.keys())
+				np.testing.assert_allclose(rolled.values(), fresh.values(), rtol=1e-9)
+				np.testing.assert_allclose(rolled.slopes, fresh.slopes, rtol=1e-7, atol=1e-9)
+
+
+if __name__ == '__main__':
+	unittest.main()
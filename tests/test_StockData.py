@@ -0,0 +1,277 @@
+import os
+import sys
+import datetime
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import StockData as sd
+import QuoteParser as qp
+
+
+class ParseSubsetStrategyTest(unittest.TestCase):
+
+    def testParsesEveryStrategy(self):
+        self.assertEqual(sd.parseSubsetStrategy('all'), sd.AllPairs())
+        self.assertEqual(sd.parseSubsetStrategy('anchored,min=3'), sd.AnchoredWindows(minLength=3))
+        self.assertEqual(sd.parseSubsetStrategy('ladder:1.5,max=60'), sd.GeometricLadder(1.5, maxLength=60))
+        self.assertEqual(sd.parseSubsetStrategy('stride:5,min=3,max=60'), sd.StrideStarts(5, 3, 60))
+
+    def testArgumentOfStrategyWithoutOneIsValueError(self):
+        for text in ('anchored:5', 'all:3'):
+            self.assertRaises(ValueError, sd.parseSubsetStrategy, text)
+
+    def testBadOptionsAreValueError(self):
+        for text in ('pairs', 'stride:x', 'all,size=3', 'ladder:1'):
+            self.assertRaises(ValueError, sd.parseSubsetStrategy, text)
+
+
+class SubsetStrategyTest(unittest.TestCase):
+
+    def testStrategiesArePrefixConsistent(self):
+        for strategy in (sd.AllPairs(), sd.AnchoredWindows(), sd.GeometricLadder(1.5), sd.StrideStarts(4, 3, 12)):
+            longStarts, longEnds = strategy.indexArrays(30)
+            starts, ends = strategy.indexArrays(17)
+            kept = longEnds < 17
+            self.assertEqual(zip(longStarts[kept], longEnds[kept]), zip(starts, ends), strategy)
+
+    def testContigSubsetsMatchGetAllContigSubsetsList(self):
+        dateValues = OrderedDict((day, 100.0 + day % 7) for day in range(1, 13))
+        strategy = sd.StrideStarts(3)
+        subsets = sd.ContigSubsets(dateValues, strategy=strategy)
+        days = sd.getAllContigSubsetsList(dateValues.keys(), strategy)
+        self.assertEqual([list(subsetDays) for subsetDays, values in subsets], days)
+        self.assertEqual(list(subsets.datasets()), [(subsetDays[0], subsetDays[-1]) for subsetDays in days])
+
+
+class MergeQuoteIntoCsvTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'TEST.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def makeQuote(self, dates, closes):
+        return sd.Quote.from_numpy({'date': np.array(dates, dtype='datetime64[D]'), 'open': closes, 'high': closes,
+            'low': closes, 'close': closes, 'volume': np.full(len(closes), 100)}, 'TEST')
+
+    def testOnlyNewerBarsAreAdded(self):
+        sd.writeFileAtomically(self.filename, self.makeQuote(['2017-05-08', '2017-05-09'], np.array([10.0, 11.0])).to_csv())
+        added = sd.mergeQuoteIntoCsv(self.filename, self.makeQuote(['2017-05-09', '2017-05-10', '2017-05-11'], np.array([99.0, 12.0, 13.0])))
+        self.assertEqual(added, 2)
+        series = sd.PriceSeries(self.filename)
+        self.assertEqual(series.close.tolist(), [13.0, 12.0, 11.0, 10.0])
+        self.assertEqual(series.getTodaysDate(), '2017-05-11')
+        self.assertEqual(sd.mergeQuoteIntoCsv(self.filename, self.makeQuote(['2017-05-10'], np.array([1.0]))), 0)
+        self.assertEqual(sorted(os.listdir(self.directory)), ['TEST.csv', 'TEST.csv.idx'])
+
+    def assertIndexPointsAtRows(self, index):
+        with open(self.filename, 'rb') as csvfile:
+            content = csvfile.read()
+        self.assertEqual(index.keys(), [row.split(',')[0] for row in content.splitlines()[1:]])
+        for date, offset in index.items():
+            self.assertTrue(content[offset:].startswith(date + ','))
+
+    def testIndexIsUpdatedByMerges(self):
+        sd.writeFileAtomically(self.filename, self.makeQuote(['2017-05-08', '2017-05-09'], np.array([10.0, 11.0])).to_csv())
+        self.assertEqual(sd.readCsvIndex(self.filename), None)
+        sd.mergeQuoteIntoCsv(self.filename, self.makeQuote(['2017-05-10'], np.array([12.0]))) # no index yet, so it is built
+        self.assertIndexPointsAtRows(sd.readCsvIndex(self.filename))
+        sd.mergeQuoteIntoCsv(self.filename, self.makeQuote(['2017-05-11', '2017-05-12'], np.array([13.0, 14.0])))
+        index = sd.readCsvIndex(self.filename)
+        self.assertIndexPointsAtRows(index)
+        self.assertEqual(index.keys()[0], '2017-05-12')
+        self.assertEqual(sd.getLastSyncedDate(self.filename), '2017-05-12')
+
+    def testStaleIndexIsIgnored(self):
+        sd.writeFileAtomically(self.filename, self.makeQuote(['2017-05-08', '2017-05-09'], np.array([10.0, 11.0])).to_csv())
+        sd.writeCsvIndex(self.filename)
+        sd.writeFileAtomically(self.filename, self.makeQuote(['2017-05-08', '2017-05-09', '2017-05-10'], np.array([10.0, 11.0, 12.0])).to_csv())
+        self.assertEqual(sd.readCsvIndex(self.filename), None)
+        self.assertEqual(sd.getLastSyncedDate(self.filename), '2017-05-10')
+        sd.mergeQuoteIntoCsv(self.filename, self.makeQuote(['2017-05-11'], np.array([13.0])))
+        self.assertIndexPointsAtRows(sd.readCsvIndex(self.filename))
+
+    def testSyncDownloadsOnlyTheMissingDays(self):
+        requests = []
+        def downloadQuote(ticker, startDate, endDate, source):
+            requests.append((startDate, endDate))
+            days = np.arange(np.datetime64(startDate), np.datetime64(endDate) + 1)
+            return self.makeQuote(days, np.arange(len(days), dtype=float) + 10.0)
+        storedDownloadQuote = sd.downloadQuote
+        sd.downloadQuote = downloadQuote
+        try:
+            self.assertEqual(sd.syncCsvFile('TEST', '2017-05-09', 'google finance', self.filename, '2017-05-01'), 9)
+            self.assertEqual(sd.syncCsvFile('TEST', '2017-05-12', 'google finance', self.filename), 3)
+            self.assertEqual(sd.syncCsvFile('TEST', '2017-05-12', 'google finance', self.filename), 0)
+        finally:
+            sd.downloadQuote = storedDownloadQuote
+        self.assertEqual(requests, [('2017-05-01', '2017-05-09'), ('2017-05-10', '2017-05-12')])
+        self.assertIndexPointsAtRows(sd.readCsvIndex(self.filename))
+
+
+class QuoteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def makeQuote(self):
+        quote = sd.Quote(capacity=4)
+        quote.symbol = 'TEST'
+        start = datetime.datetime(2017, 1, 2)
+        for bar in xrange(10):
+            quote.append(start + datetime.timedelta(days=bar), 100.25 + bar, 101.5 + bar, 99.75 + bar, 100.5 + bar, 1000 + bar)
+        dates = np.arange(np.datetime64('2017-01-12'), np.datetime64('2017-02-01'))
+        closes = 110.0 + np.arange(len(dates)) * 0.25
+        quote.extend({'date': dates, 'open': closes - 0.5, 'high': closes + 1.0, 'low': closes - 1.0, 'close': closes,
+                      'volume': np.arange(len(dates)) + 2000})
+        return quote
+
+    def assertSameBars(self, quote, expected):
+        self.assertEqual(len(quote), len(expected))
+        for name, column in expected.to_numpy().items():
+            np.testing.assert_array_equal(quote.to_numpy()[name], column)
+
+    def testAppendsPastTheInitialCapacity(self):
+        quote = self.makeQuote()
+        self.assertEqual(len(quote), 30)
+        self.assertTrue(len(quote.columns['close']) >= 30)
+        self.assertEqual(quote.date[0], np.datetime64('2017-01-02'))
+        self.assertEqual(quote.date[-1], np.datetime64('2017-01-31'))
+        self.assertEqual(quote.close[:10].tolist(), [100.5 + bar for bar in xrange(10)])
+        self.assertEqual(quote.volume[9:11].tolist(), [1009, 2000])
+
+    def testFromNumpyArraysAreNotWrittenTo(self):
+        columns = self.makeQuote().to_numpy()
+        closes = columns['close'].copy()
+        quote = sd.Quote.from_numpy(columns, 'test')
+        quote.append(datetime.datetime(2017, 2, 1), 1.0, 1.0, 1.0, 1.0, 1)
+        np.testing.assert_array_equal(columns['close'], closes)
+        self.assertEqual((len(quote), quote.symbol, quote.close[-1]), (31, 'TEST', 1.0))
+
+    def testBinaryRoundTrip(self):
+        quote = self.makeQuote()
+        filename = os.path.join(self.directory, 'TEST.npy')
+        quote.write_binary(filename)
+        readQuote = sd.Quote()
+        readQuote.read_binary(filename)
+        self.assertSameBars(readQuote, quote)
+
+    def testCsvRoundTripMatchesTheOldFormat(self):
+        quote = self.makeQuote()
+        filename = os.path.join(self.directory, 'TEST.csv')
+        quote.write_csv(filename)
+        readQuote = sd.Quote()
+        readQuote.read_csv(filename)
+        self.assertSameBars(readQuote, quote)
+        oldRows = ["{0},{1:.2f},{2:.2f},{3:.2f},{4:.2f},{5}\n".format(str(quote.date[bar]), quote.open_[bar], quote.high[bar],
+                   quote.low[bar], quote.close[bar], quote.volume[bar]) for bar in reversed(xrange(len(quote)))]
+        self.assertEqual(quote.to_csv(), "Date, Open, High, Low, Close, Volume\n" + ''.join(oldRows))
+        binaryFilename = os.path.join(self.directory, 'TEST.npy')
+        readQuote.write_binary(binaryFilename)
+        binaryQuote = sd.Quote()
+        binaryQuote.read_binary(binaryFilename)
+        self.assertEqual(binaryQuote.to_csv(), quote.to_csv())
+
+
+class AdjustPricesTest(unittest.TestCase):
+
+    # newest first like Yahoo: a 2 for 1 split before 2017-05-05 and a dividend before 2017-05-09
+    yahooCsv = """Date,Open,High,Low,Close,Volume,Adj Close
+2017-05-10,101.00,102.00,100.00,101.50,1000,101.50
+2017-05-09,100.50,101.50,99.50,100.00,1100,100.00
+2017-05-08,100.00,100.80,99.00,100.40,1200,99.40
+2017-05-05,99.00,100.00,98.00,99.60,1300,98.60
+2017-05-04,198.00,200.00,196.00,198.40,900,98.21
+2017-05-03,196.00,199.00,195.00,197.00,950,97.52
+"""
+
+    def adjustRows(self, text):
+        # per-row adjustment of the former YahooQuote
+        rows = text.splitlines()
+        rows.reverse()
+        adjusted = []
+        for bar in xrange(0, len(rows) - 1):
+            ds, open_, high, low, close, volume, adjc = rows[bar].rstrip().split(',')
+            open_, high, low, close, adjc = [float(x) for x in [open_, high, low, close, adjc]]
+            if close != adjc:
+                factor = adjc / close
+                open_, high, low, close = [x * factor for x in [open_, high, low, close]]
+            adjusted.append((open_, high, low, close))
+        return np.array(adjusted)
+
+    def testBackMatchesPerRowAdjustment(self):
+        columns = qp.parseQuoteText(self.yahooCsv)
+        adjusted = sd.adjustPrices(columns, 'back')
+        expected = self.adjustRows(self.yahooCsv)
+        for i, name in enumerate(('open', 'high', 'low', 'close')):
+            np.testing.assert_array_equal(adjusted[name], expected[:, i])
+            np.testing.assert_array_equal(adjusted['raw' + name.capitalize()], columns[name])
+        np.testing.assert_array_equal(adjusted['close'], columns['adjClose'])
+        self.assertEqual(adjusted['adjFactor'][-1], 1.0)
+
+    def testForwardKeepsTheOldestBar(self):
+        columns = qp.parseQuoteText(self.yahooCsv)
+        adjusted = sd.adjustPrices(columns, 'forward')
+        expected = self.adjustRows(self.yahooCsv)
+        for i, name in enumerate(('open', 'high', 'low', 'close')):
+            np.testing.assert_allclose(adjusted[name], expected[:, i] * columns['close'][0] / columns['adjClose'][0], rtol=1e-12)
+        self.assertEqual(adjusted['close'][0], columns['close'][0])
+
+    def testNoAdjustment(self):
+        columns = qp.parseQuoteText(self.yahooCsv)
+        adjusted = sd.adjustPrices(columns, None)
+        np.testing.assert_array_equal(adjusted['close'], columns['close'])
+        self.assertRaises(ValueError, sd.adjustPrices, columns, 'sideways')
+
+
+class PriceSeriesCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cacheSize = sd.priceSeriesCacheSize
+        sd.priceSeriesCacheSize = 3
+        sd.priceSeriesCache.clear()
+
+    def tearDown(self):
+        sd.priceSeriesCacheSize = self.cacheSize
+        sd.priceSeriesCache.clear()
+        shutil.rmtree(self.directory)
+
+    def writeCsv(self, name, closes):
+        filename = os.path.join(self.directory, name + '.csv')
+        dates = np.datetime64('2017-05-12') - np.arange(len(closes))
+        sd.writeFileAtomically(filename, "Date,Open,High,Low,Close,Volume\n" + ''.join(
+            "%s,%.2f,%.2f,%.2f,%.2f,100\n" % (date, close, close, close, close) for date, close in zip(dates, closes)))
+        return filename
+
+    def testLeastRecentlyUsedFilesAreDropped(self):
+        filenames = [self.writeCsv('T%d' % i, [10.0 + i, 9.0]) for i in xrange(5)]
+        for filename in filenames[:3]:
+            sd.getPriceSeries(filename)
+        first = sd.getPriceSeries(filenames[0]) # used again, so T1 is now the least recently used
+        for filename in filenames[3:]:
+            sd.getPriceSeries(filename)
+        self.assertEqual(sd.priceSeriesCache.keys(), [os.path.abspath(filename) for filename in (filenames[0], filenames[3], filenames[4])])
+        self.assertTrue(sd.getPriceSeries(filenames[0]) is first)
+        self.assertEqual(sd.getPriceSeries(filenames[1]).close.tolist(), [11.0, 9.0])
+
+    def testOnlyTheLatestVersionOfAFileIsKept(self):
+        filename = self.writeCsv('T', [10.0, 9.0])
+        self.assertEqual(sd.getPriceSeries(filename).close.tolist(), [10.0, 9.0])
+        self.writeCsv('T', [12.0, 10.0, 9.0])
+        self.assertEqual(sd.getPriceSeries(filename).close.tolist(), [12.0, 10.0, 9.0])
+        self.assertEqual(len(sd.priceSeriesCache), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from collections import OrderedDict, deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import StockData as sd
+import RegressionModel as rm
+import TreeTraversal as tt
+import Benchmark as bm
+
+'''
+Tests of the array backed tree, the sorted prediction index and the prediction state files against the linked
+Node tree and brute force searches they replace
+'''
+
+
+def createLinkedTree(numOfChildren, dateValues):
+    keys = dateValues.keys()
+    rootNode = tt.Node(keys[0], dateValues[keys[0]])
+    currParentNodes = deque([rootNode])
+    index = 1
+    while index < len(keys):
+        currParentNode = currParentNodes.popleft()
+        for childIndex in range(numOfChildren):
+            if index == len(keys):
+                break
+            childNode = tt.Node(keys[index], dateValues[keys[index]])
+            currParentNode.addChild(childNode)
+            currParentNodes.append(childNode)
+            index += 1
+    return rootNode
+
+
+def bruteForceNearest(dateValues, value, k=1):
+    differences = [(abs(price - value), position) for position, price in enumerate(dateValues.values())]
+    return [dateValues.keys()[position] for difference, position in sorted(differences)[:k]]
+
+
+def roundedPredictions(numOfDays, seed):
+    predictions = rm.predictAllPrices(sd.ContigSubsets(bm.syntheticDateValues('random-walk', numOfDays, seed=seed)), 0, 'ols')
+    return OrderedDict((dataset, round(price, 1)) for dataset, price in predictions.items()) # rounded to have ties
+
+
+class ArrayTreeTest(unittest.TestCase):
+
+    def assertSameTree(self, arrayNode, linkedNode):
+        self.assertEqual(arrayNode.dataset, linkedNode.dataset)
+        self.assertEqual(arrayNode.value, linkedNode.value)
+        self.assertEqual(len(arrayNode.children), len(linkedNode.children))
+        for arrayChild, linkedChild in zip(arrayNode.children, linkedNode.children):
+            self.assertSameTree(arrayChild, linkedChild)
+
+    def testMatchesLinkedTree(self):
+        predictions = roundedPredictions(20, 1)
+        for numOfChildren in (1, 2, 3, 7):
+            rootNode = tt.createTree(numOfChildren, predictions)
+            self.assertSameTree(rootNode, createLinkedTree(numOfChildren, predictions))
+            self.assertEqual(tt.countOfAllTreeNodes(rootNode), len(predictions))
+
+    def testSearchFindsTheSameNode(self):
+        predictions = roundedPredictions(20, 2)
+        rootNode = tt.createTree(3, predictions)
+        linkedRoot = createLinkedTree(3, predictions)
+        for value in np.linspace(min(predictions.values()) - 1, max(predictions.values()) + 1, 25).tolist() + predictions.values()[::17]:
+            self.assertEqual(tt.breadthFirstSearch(rootNode, value).dataset, tt.breadthFirstSearch(linkedRoot, value).dataset)
+        subtreeRoot = rootNode.children[1]
+        linkedSubtreeRoot = linkedRoot.children[1]
+        self.assertEqual(tt.breadthFirstSearch(subtreeRoot, 100.0).dataset, tt.breadthFirstSearch(linkedSubtreeRoot, 100.0).dataset)
+
+
+class PredictionIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.predictions = roundedPredictions(25, 3)
+        self.index = tt.PredictionIndex(self.predictions)
+        prices = self.predictions.values()
+        self.queries = np.linspace(min(prices) - 1, max(prices) + 1, 40).tolist() + prices[::13]
+
+    def testNearestMatchesBruteForce(self):
+        for value in self.queries:
+            self.assertEqual(self.index.nearest(value).dataset, bruteForceNearest(self.predictions, value)[0])
+
+    def testNearestMatchesTreeSearch(self):
+        rootNode = tt.createTree(3, self.predictions)
+        for value in self.queries:
+            self.assertEqual(self.index.nearest(value).dataset, tt.breadthFirstSearch(rootNode, value).dataset)
+
+    def testKNearestMatchesBruteForce(self):
+        for value in self.queries:
+            for k in (1, 5, 30):
+                self.assertEqual([node.dataset for node in self.index.kNearest(value, k)],
+                                 bruteForceNearest(self.predictions, value, k))
+
+    def testRestrictedIndexMatchesAFreshOne(self):
+        for maxDay in (5, 12, 25):
+            restricted = self.index.restrict(maxDay)
+            fresh = tt.PredictionIndex(rm.filterPredictionsByWindow(self.predictions, maxDay))
+            self.assertEqual(len(restricted), len(fresh))
+            for value in self.queries:
+                self.assertEqual(restricted.nearest(value).dataset, fresh.nearest(value).dataset)
+                self.assertEqual([node.dataset for node in restricted.kNearest(value, 5)], [node.dataset for node in fresh.kNearest(value, 5)])
+                self.assertEqual([node.dataset for node in restricted.withinTolerance(value, 0.5)],
+                                 [node.dataset for node in fresh.withinTolerance(value, 0.5)])
+
+    def testWithinToleranceMatchesBruteForce(self):
+        for value in self.queries:
+            expected = [dataset for dataset in bruteForceNearest(self.predictions, value, len(self.predictions))
+                        if abs(self.predictions[dataset] - value) <= 0.5]
+            self.assertEqual([node.dataset for node in self.index.withinTolerance(value, 0.5)], expected)
+
+
+class TreeFileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory, 'AAPL.tree')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def testRoundTripKeepsEverything(self):
+        strategy = sd.StrideStarts(2)
+        predictions = rm.predictAllPrices(sd.ContigSubsets(bm.syntheticDateValues('random-walk', 20, seed=4), strategy=strategy), 0, 'ols')
+        rootNode = tt.createTree(3, predictions, strategy)
+        foundNode = tt.PredictionIndex(predictions).nearest(100.0)
+        tt.writeTreeToFile(rootNode, foundNode, '2017-05-12', self.filename, 'AAPL', 'ols', 'abc')
+        self.assertTrue(tt.isArrayFile(self.filename))
+
+        readRoot, readFound, dateOfWrite = tt.readTreeFromFile(self.filename)
+        self.assertEqual(dateOfWrite, '2017-05-12')
+        self.assertEqual((readFound.dataset, readFound.value), (foundNode.dataset, foundNode.value))
+        np.testing.assert_array_equal(readRoot.tree.values, rootNode.tree.values)
+        np.testing.assert_array_equal(readRoot.tree.datasets, rootNode.tree.datasets)
+        np.testing.assert_array_equal(readRoot.tree.slopes, predictions.slopes)
+        np.testing.assert_array_equal(readRoot.tree.intercepts, predictions.intercepts)
+        self.assertEqual(readRoot.tree.numOfChildren, 3)
+        self.assertEqual(readRoot.tree.subsetStrategy, strategy)
+        header, arrays = tt.readArrayFile(self.filename)
+        self.assertEqual((header['ticker'], header['modelType'], header['sourceHash']), ('AAPL', 'ols', 'abc'))
+
+    def testHorizonsRoundTrip(self):
+        subsets = sd.ContigSubsets(bm.syntheticDateValues('random-walk', 15, seed=5))
+        horizons = rm.predictAllPrices(subsets, [0, 1, 5], 'poly2')
+        rootNode = tt.createTree(3, horizons, horizon=1)
+        tt.writeTreeToFile(rootNode, rootNode.children[0], '2017-05-12', self.filename)
+        readRoot, readFound, dateOfWrite = tt.readTreeFromFile(self.filename, horizon=5)
+        np.testing.assert_array_equal(readRoot.tree.values, horizons.prices[:, 2])
+        self.assertEqual(readFound.dataset, rootNode.children[0].dataset)
+        self.assertRaises(ValueError, tt.readTreeFromFile, self.filename, 2)
+
+    def testLinkedTreeAndMissingFoundNode(self):
+        predictions = roundedPredictions(10, 6)
+        linkedRoot = createLinkedTree(2, predictions)
+        missingNode = tt.Node((100, 200), 1.5)
+        tt.writeTreeToFile(linkedRoot, missingNode, '2017-05-12', self.filename)
+        readRoot, readFound, dateOfWrite = tt.readTreeFromFile(self.filename)
+        ArrayTreeTest('assertSameTree').assertSameTree(readRoot, linkedRoot)
+        self.assertEqual((readFound.dataset, readFound.value), ((100, 200), 1.5))
+
+    def testOtherFilesAreRejected(self):
+        with open(self.filename, 'wb') as output:
+            output.write('not a tree file')
+        self.assertFalse(tt.isArrayFile(self.filename))
+        self.assertRaises(ValueError, tt.readArrayFile, self.filename)
+
+
+if __name__ == '__main__':
+    unittest.main()